@@ -0,0 +1,276 @@
+"""
+Benchmark end-to-end offline del sync: SAP sintetico (SQLite) → PostgreSQL locale.
+
+Per ogni mapping di MAPPINGS_REGISTRY (in ordine di dipendenza) esegue
+SyncEngine.sync_table due volte:
+- full:  ricaricamento completo (force_full);
+- delta: ciclo successivo senza modifiche alla sorgente (costo a regime).
+
+Per ogni esecuzione riporta righe/s, picco di RSS e tempi per stadio (dal
+profiler del ciclo). Con --save-baseline salva i risultati in JSON; con
+--baseline li confronta con un'esecuzione precedente ed esce con codice 1 se
+una tabella è più lenta oltre la tolleranza.
+
+ATTENZIONE: le tabelle sap.* del database indicato vengono svuotate e
+riscritte. Usare solo un PostgreSQL locale dedicato.
+
+    python -m benchmarks.sync_benchmark --pg-url postgresql://postgres@localhost/sap_bench \\
+        --rows 100000 --save-baseline benchmarks/baseline.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from src.config.database import set_database_config
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.models import Base
+from src.sync.engine import SyncEngine
+from src.sync.profiler import RunProfiler
+
+from .synthetic_sap import SyntheticDatabaseConfig, generate, sqlite_mappings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PASSES = ('full', 'delta')
+# Sotto questa differenza (secondi) una variazione è considerata rumore
+NOISE_SECONDS = 0.05
+
+# Tabelle del database STM Scheduler scritte dalle callback (create solo se mancanti)
+_SUPPORT_DDL = (
+    'CREATE SCHEMA IF NOT EXISTS sap',
+    """
+    CREATE TABLE IF NOT EXISTS magazzino (
+        id SERIAL PRIMARY KEY,
+        articolo TEXT,
+        posizione TEXT,
+        quantita DOUBLE PRECISION,
+        note TEXT,
+        data_aggiornamento TIMESTAMP DEFAULT now(),
+        UNIQUE (articolo, posizione)
+    )
+    """,
+)
+_ASSOC_DDL = """
+    CREATE TABLE IF NOT EXISTS sap.assoc_articoli_macchina (
+        id_articolo TEXT REFERENCES sap.anagrafica_articoli(id),
+        id_macchina TEXT,
+        PRIMARY KEY (id_articolo, id_macchina)
+    )
+"""
+
+
+def _reset_peak_rss() -> None:
+    """Azzera il picco di RSS del processo (Linux ≥ 4.0), per misurarlo per tabella."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss: KB su Linux, byte su macOS; non azzerabile
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _ordered_tables(table_names: List[str]) -> List[str]:
+    """Tabelle in ordine di dipendenza (TableMapping.depends_on)."""
+    ordered, pending = [], list(table_names)
+    while pending:
+        ready = [
+            name for name in pending
+            if all(dep in ordered or dep not in pending for dep in MAPPINGS_REGISTRY[name].depends_on)
+        ]
+        if not ready:
+            raise ValueError(f"Dipendenze cicliche tra {pending}")
+        ordered.extend(ready)
+        pending = [name for name in pending if name not in ready]
+    return ordered
+
+
+def prepare_postgres(config: SyntheticDatabaseConfig) -> None:
+    """Crea schema e tabelle e svuota le tabelle sap.* del benchmark."""
+    with config.pg_engine.begin() as connection:
+        for statement in _SUPPORT_DDL:
+            connection.execute(text(statement))
+    Base.metadata.create_all(config.pg_engine)
+    tables = ', '.join(mapping.pg_model.__table__.fullname for mapping in MAPPINGS_REGISTRY.values())
+    with config.pg_engine.begin() as connection:
+        connection.execute(text(_ASSOC_DDL))
+        connection.execute(text(
+            f'TRUNCATE {tables}, sap.assoc_articoli_macchina, sap.sync_state, magazzino CASCADE'
+        ))
+
+
+def _result(table_name: str, run: str, profiler: RunProfiler, seconds: float, peak_rss) -> dict:
+    stages = {record['stage']: record for record in profiler.table(table_name).records()}
+    rows = ((stages.get('transform') or {}).get('counters') or {}).get('rows', 0)
+    return {
+        'table': table_name,
+        'pass': run,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+        'peak_rss_mb': peak_rss,
+        'stages': {
+            name: round(record['duration_seconds'], 4)
+            for name, record in stages.items() if name != 'total'
+        },
+        'counters': {
+            name: record['counters'] for name, record in stages.items() if record['counters']
+        },
+    }
+
+
+def run_benchmark(config: SyntheticDatabaseConfig, table_names: List[str], pipelined: Optional[bool] = None) -> List[dict]:
+    """Esegue le passate full e delta per ogni tabella e restituisce i risultati."""
+    results = []
+    with sqlite_mappings():
+        prepare_postgres(config)
+        set_database_config(config)
+        try:
+            for table_name in _ordered_tables(table_names):
+                for run in PASSES:
+                    # Un profilo per passata: stadi full e delta non si sommano
+                    profiler = RunProfiler('benchmark', force_full=run == 'full')
+                    engine = SyncEngine(config, pipelined=pipelined, profiler=profiler)
+                    _reset_peak_rss()
+                    start = time.perf_counter()
+                    engine.sync_table(table_name, force_full=run == 'full')
+                    seconds = time.perf_counter() - start
+                    results.append(_result(table_name, run, profiler, seconds, _peak_rss_mb()))
+                    print(_format_result(results[-1]), flush=True)
+        finally:
+            set_database_config(None)
+    return results
+
+
+def _format_result(result: dict) -> str:
+    stages = ', '.join(f'{name} {seconds:.3f}s' for name, seconds in result['stages'].items())
+    rate = f"{result['rows_per_sec']:,.0f} righe/s" if result['rows_per_sec'] else '-'
+    rss = f"{result['peak_rss_mb']} MB" if result['peak_rss_mb'] is not None else '-'
+    return (
+        f"{result['table']:<28} {result['pass']:<6} {result['rows']:>9} righe "
+        f"{result['seconds']:>9.3f}s {rate:>16}  RSS {rss:>9}  [{stages}]"
+    )
+
+
+def compare(results: List[dict], baseline: dict, tolerance: float) -> List[str]:
+    """Regressioni rispetto al baseline: esecuzioni più lente di oltre `tolerance` (es. 0.1 = 10%)."""
+    previous = {(r['table'], r['pass']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get((result['table'], result['pass']))
+        if before is None:
+            continue
+        slower = result['seconds'] - before['seconds']
+        if slower > NOISE_SECONDS and result['seconds'] > before['seconds'] * (1 + tolerance):
+            regressions.append(
+                f"{result['table']} ({result['pass']}): {before['seconds']:.3f}s → "
+                f"{result['seconds']:.3f}s (+{slower / before['seconds']:.0%})"
+            )
+    return regressions
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark offline del sync SAP → PostgreSQL')
+    parser.add_argument('--pg-url', default=os.getenv('BENCHMARK_POSTGRES_URL'),
+                        help='PostgreSQL locale dedicato (default: BENCHMARK_POSTGRES_URL)')
+    parser.add_argument('--rows', type=int, default=100000, help='Righe SAP sintetiche totali (10k-5M)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--sap-db', help='File SQLite della sorgente SAP (riusato con --reuse-sap)')
+    parser.add_argument('--reuse-sap', action='store_true', help='Non rigenerare il file --sap-db')
+    parser.add_argument('--tables', nargs='+', choices=sorted(MAPPINGS_REGISTRY), help='Default: tutte')
+    parser.add_argument('--no-pipeline', action='store_true', help='Disattiva la pipeline lettura/scrittura')
+    parser.add_argument('--save-baseline', help='Salva i risultati in questo file JSON')
+    parser.add_argument('--baseline', help='Confronta con un file JSON salvato in precedenza')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Rallentamento tollerato (default 0.10)')
+    args = parser.parse_args(argv)
+
+    if not args.pg_url:
+        parser.error('indicare --pg-url o BENCHMARK_POSTGRES_URL (il benchmark svuota le tabelle sap.*)')
+    if args.pg_url == os.getenv('POSTGRES_URL'):
+        parser.error('--pg-url coincide con POSTGRES_URL: usare un database dedicato al benchmark')
+
+    sap_path = args.sap_db or os.path.join(tempfile.gettempdir(), f'sap_benchmark_{args.rows}_{args.seed}.db')
+    if not (args.reuse_sap and os.path.exists(sap_path)):
+        start = time.perf_counter()
+        counts = generate(sap_path, args.rows, args.seed)
+        print(f"Sorgente SAP sintetica {sap_path}: {counts} in {time.perf_counter() - start:.1f}s")
+
+    config = SyntheticDatabaseConfig(args.pg_url, sap_path)
+    try:
+        results = run_benchmark(
+            config, args.tables or list(MAPPINGS_REGISTRY), pipelined=False if args.no_pipeline else None
+        )
+    finally:
+        config.dispose()
+
+    print()
+    for result in results:
+        print(_format_result(result))
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'rows': args.rows,
+        'seed': args.seed,
+        'pipelined': not args.no_pipeline,
+        'results': results,
+    }
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f"Risultati salvati in {args.save_baseline}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        if (baseline.get('rows'), baseline.get('seed')) != (args.rows, args.seed):
+            print(f"Attenzione: baseline con rows={baseline.get('rows')} seed={baseline.get('seed')}")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSIONE {regression}")
+        if regressions:
+            return 1
+        print(f"Nessuna regressione rispetto a {args.baseline} (revisione {baseline.get('revision')})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,433 @@
+"""
+Sorgente SAP sintetica per i benchmark offline.
+
+Genera dati realistici per le tabelle lette dai mapping (OITM, OCRD, OSCN, SPP1,
+OPOR, POR1, OPDN, PDN1) in un file SQLite con gli stessi nomi di colonna di SAP,
+collegato alle connessioni come schema `dbo`: le query dei mapping girano quasi
+invariate. Le sole differenze di dialetto T-SQL sono coperte da:
+- GETDATE() e DATEADD(parte, n, data) registrate come funzioni SQLite;
+- BINARY_CHECKSUM e CHECKSUM_AGG (sonde di modifica) come funzione e aggregato
+  SQLite, COUNT_BIG riscritto in COUNT;
+- override espliciti per i costrutti senza equivalente (OUTER APPLY / TOP 1).
+
+Le date sono salvate come testo 'YYYY-MM-DD' (UpdateDate SAP non ha componente
+oraria) e restituite come datetime, come fa pyodbc.
+"""
+from __future__ import annotations
+
+import copy
+import random
+import re
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from src.mappings.registry import MAPPINGS_REGISTRY
+
+# Quota di ogni tabella SAP sul totale di righe generate
+TABLE_SHARES = {
+    'OITM': 0.20,
+    'OCRD': 0.01,
+    'OSCN': 0.15,
+    'SPP1': 0.10,
+    'OPOR': 0.03,
+    'POR1': 0.25,
+    'OPDN': 0.02,
+    'PDN1': 0.24,
+}
+
+_DDL = {
+    'OITM': """
+        CREATE TABLE OITM (
+            ItemCode TEXT PRIMARY KEY, ItemName TEXT, FrgnName TEXT, U_Aggiuntiva TEXT,
+            U_FamigliaTornitura TEXT, U_FamigliaLEV2 TEXT, U_FamigliaLEV3 TEXT,
+            U_SFT_FAMILY_LEV1 TEXT, U_SFT_SUBCAT TEXT, U_SFT_FAMILY_LEV3 TEXT,
+            U_SFT_PURCH_SPEC TEXT, U_Dev_ArtBase TEXT, MinLevel REAL, ReorderQty REAL,
+            U_SFT_FAMILY_LEV2 TEXT, QryGroup14 TEXT, QryGroup15 TEXT, QryGroup16 TEXT,
+            UpdateDate SAPDATE, UpdateTS INTEGER
+        )""",
+    'OCRD': """
+        CREATE TABLE OCRD (
+            CardCode TEXT PRIMARY KEY, CardName TEXT, CardType TEXT, E_Mail TEXT,
+            UpdateDate SAPDATE, UpdateTS INTEGER
+        )""",
+    'OSCN': """
+        CREATE TABLE OSCN (
+            ItemCode TEXT, CardCode TEXT, Substitute TEXT,
+            PRIMARY KEY (ItemCode, CardCode, Substitute)
+        )""",
+    'SPP1': """
+        CREATE TABLE SPP1 (
+            ItemCode TEXT, CardCode TEXT, LINENUM INTEGER, Price REAL,
+            PRIMARY KEY (ItemCode, CardCode, LINENUM)
+        )""",
+    'OPOR': """
+        CREATE TABLE OPOR (
+            DocEntry INTEGER PRIMARY KEY, DocNum INTEGER, DocDate SAPDATE, DocDueDate SAPDATE,
+            CardCode TEXT, DocStatus TEXT, UpdateDate SAPDATE, UpdateTS INTEGER
+        )""",
+    'POR1': """
+        CREATE TABLE POR1 (
+            DocEntry INTEGER, LineNum INTEGER, ItemCode TEXT, Quantity REAL,
+            ShipDate SAPDATE, LineStatus TEXT, PRIMARY KEY (DocEntry, LineNum)
+        )""",
+    'OPDN': """
+        CREATE TABLE OPDN (
+            DocEntry INTEGER PRIMARY KEY, DocDate SAPDATE, CardCode TEXT, DocStatus TEXT,
+            UpdateDate SAPDATE, UpdateTS INTEGER
+        )""",
+    'PDN1': """
+        CREATE TABLE PDN1 (
+            DocEntry INTEGER, LineNum INTEGER, ItemCode TEXT, Quantity REAL,
+            BaseEntry INTEGER, BaseLine INTEGER, LineStatus TEXT, PRIMARY KEY (DocEntry, LineNum)
+        )""",
+}
+
+# Indici presenti anche in SAP (join e filtri delle query dei mapping)
+_INDEXES = (
+    'CREATE INDEX OPOR_DocDate ON OPOR (DocDate)',
+    'CREATE INDEX OPDN_DocDate ON OPDN (DocDate)',
+    'CREATE INDEX POR1_ItemCode ON POR1 (ItemCode)',
+)
+
+# Query senza equivalente SQLite diretto (OUTER APPLY ... TOP 1)
+QUERY_OVERRIDES = {
+    'catalogoBusinessPartner': """
+SELECT
+    o.ItemCode,
+    o.CardCode,
+    o.Substitute,
+    (
+        SELECT Price
+        FROM dbo.SPP1
+        WHERE ItemCode = o.ItemCode
+          AND CardCode = o.CardCode
+        ORDER BY SPP1.LINENUM
+        LIMIT 1
+    ) AS Price
+FROM dbo.OSCN o
+""".strip(),
+}
+
+_DATEADD_PART = re.compile(r'\bDATEADD\(\s*(\w+)\s*,', re.IGNORECASE)
+_COUNT_BIG = re.compile(r'\bCOUNT_BIG\(', re.IGNORECASE)
+_INSERT_CHUNK = 10000
+
+
+def _format_date(value) -> str:
+    return value.strftime('%Y-%m-%d')
+
+
+def _convert_sapdate(value: bytes) -> datetime:
+    text = value.decode()
+    return datetime.strptime(text, '%Y-%m-%d %H:%M:%S' if ' ' in text else '%Y-%m-%d')
+
+
+sqlite3.register_adapter(date, _format_date)
+sqlite3.register_converter('SAPDATE', _convert_sapdate)
+
+
+def _getdate() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _dateadd(part: str, amount: int, value: Optional[str]) -> Optional[str]:
+    """DATEADD T-SQL per year/month/day su date testuali."""
+    if value is None:
+        return None
+    moment = datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S' if len(value) > 10 else '%Y-%m-%d')
+    part = part.lower()
+    if part in ('year', 'yy', 'yyyy', 'month', 'mm', 'm'):
+        months = amount * 12 if part in ('year', 'yy', 'yyyy') else amount
+        month_index = moment.month - 1 + months
+        year, month = moment.year + month_index // 12, month_index % 12 + 1
+        moment = moment.replace(year=year, month=month, day=min(moment.day, 28))
+    elif part in ('day', 'dd', 'd'):
+        moment += timedelta(days=amount)
+    else:
+        raise ValueError(f"DATEADD: parte {part} non supportata")
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _binary_checksum(*values) -> int:
+    """BINARY_CHECKSUM: intero a 32 bit con segno dai valori della riga."""
+    return zlib.crc32(repr(values).encode()) - 2 ** 31
+
+
+class _ChecksumAgg:
+    """CHECKSUM_AGG: XOR dei checksum di riga (NULL se nessuna riga)."""
+
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None:
+            self.value = value if self.value is None else self.value ^ value
+
+    def finalize(self):
+        return self.value
+
+
+def to_sqlite(query: str) -> str:
+    """Adatta una query dei mapping al dialetto SQLite (parte di DATEADD come stringa, COUNT_BIG)."""
+    query = _COUNT_BIG.sub('COUNT(', query)
+    return _DATEADD_PART.sub(lambda m: f"DATEADD('{m.group(1)}',", query)
+
+
+def create_sap_engine(path: str):
+    """
+    Engine SQLite sul file `path`, collegato anche come schema dbo e con le
+    funzioni T-SQL usate dai mapping. Le connessioni sono usabili dai thread
+    della pipeline (lettura SAP su un thread dedicato).
+    """
+    engine = create_engine(
+        f'sqlite:///{path}',
+        connect_args={'detect_types': sqlite3.PARSE_DECLTYPES, 'check_same_thread': False},
+    )
+
+    @event.listens_for(engine, 'connect')
+    def _attach_dbo(dbapi_connection, connection_record):
+        dbapi_connection.execute('ATTACH DATABASE ? AS dbo', (path,))
+        dbapi_connection.create_function('GETDATE', 0, _getdate, deterministic=False)
+        dbapi_connection.create_function('DATEADD', 3, _dateadd, deterministic=True)
+        dbapi_connection.create_function('BINARY_CHECKSUM', -1, _binary_checksum, deterministic=True)
+        dbapi_connection.create_aggregate('CHECKSUM_AGG', 1, _ChecksumAgg)
+
+    return engine
+
+
+def table_counts(total_rows: int) -> Dict[str, int]:
+    """Righe per tabella SAP per un totale di `total_rows` (minimo 1 per tabella)."""
+    return {table: max(1, int(total_rows * share)) for table, share in TABLE_SHARES.items()}
+
+
+def _update_stamp(rng: random.Random, today: date):
+    updated = today - timedelta(days=rng.randint(0, 900))
+    return updated, rng.randint(0, 23) * 10000 + rng.randint(0, 59) * 100 + rng.randint(0, 59)
+
+
+def _items(rng, count, today):
+    machines = [f'M{i:02d}' for i in range(1, 40)]
+    for i in range(count):
+        updated, ts = _update_stamp(rng, today)
+        group = rng.random()
+        subcat = None
+        roll = rng.random()
+        if roll < 0.05:
+            subcat = f'A{rng.randrange(count):07d}'
+        elif roll < 0.07:
+            subcat = f'X-{rng.randrange(1000)}'
+        yield (
+            f'A{i:07d}',
+            f'Articolo {i} {rng.choice(("cuscinetto", "ingranaggio", "guarnizione", "albero"))}',
+            rng.choice((None, f'Destinazione {i % 97}')),
+            rng.choice((None, None, None, 'PRIORITA 1', 'CRITICO')),
+            rng.choice((None, 'SC-01', 'SC-02', 'MAG-A', 'MAG-B')),
+            '-'.join(rng.sample(machines, rng.randint(1, 3))) if rng.random() < 0.3 else None,
+            rng.choice(('ATTIVO', 'OBSOLETO', None)),
+            rng.choice(('SKF', 'FAG', 'INA', None)),
+            subcat,
+            rng.choice(('RICAMBIO', 'CONSUMO', None)),
+            rng.choice(('SI', 'NO', None)),
+            rng.choice((None, f'Nota acquisti {i % 13}')),
+            float(rng.randint(0, 50)),
+            float(rng.randint(0, 100)),
+            rng.choice((None, f'F{rng.randrange(1000):05d}')),
+            'Y' if 0.20 <= group < 0.45 else 'N',
+            'Y' if 0.45 <= group < 0.70 else 'N',
+            'Y' if group < 0.20 else 'N',
+            updated,
+            ts,
+        )
+
+
+def _partners(rng, count, today):
+    for i in range(count):
+        updated, ts = _update_stamp(rng, today)
+        yield (
+            f'F{i:05d}',
+            f'Fornitore {i} S.r.l.',
+            rng.choice(('S', 'S', 'C')),
+            f'acquisti{i}@fornitore{i}.it' if rng.random() < 0.8 else None,
+            updated,
+            ts,
+        )
+
+
+def _catalog(rng, count, n_items, n_partners):
+    seen = set()
+    while len(seen) < count:
+        key = (f'A{rng.randrange(n_items):07d}', f'F{rng.randrange(n_partners):05d}', f'SUB-{rng.randrange(10**6)}')
+        if key not in seen:
+            seen.add(key)
+            yield key
+
+
+def _prices(rng, count, catalog_keys):
+    produced = 0
+    priced = set()
+    for item, card, _ in catalog_keys:
+        if (item, card) in priced:
+            continue
+        priced.add((item, card))
+        for line in range(rng.randint(1, 3)):
+            if produced >= count:
+                return
+            yield item, card, line, round(rng.uniform(1, 500), 2)
+            produced += 1
+
+
+def _documents(rng, count, n_partners, today, with_due_date):
+    for entry in range(1, count + 1):
+        doc_date = today - timedelta(days=rng.randint(0, 540))
+        updated = min(today, doc_date + timedelta(days=rng.randint(0, 30)))
+        ts = rng.randint(0, 23) * 10000 + rng.randint(0, 59) * 100
+        status = 'C' if rng.random() < 0.6 else 'O'
+        card = f'F{rng.randrange(n_partners):05d}'
+        if with_due_date:
+            yield entry, 100000 + entry, doc_date, doc_date + timedelta(days=30), card, status, updated, ts
+        else:
+            yield entry, doc_date, card, status, updated, ts
+
+
+def _order_lines(rng, count, n_orders, n_items, today):
+    per_order = max(1, count // n_orders)
+    produced = 0
+    for entry in range(1, n_orders + 1):
+        for line in range(per_order if entry < n_orders else count - produced):
+            yield (
+                entry, line, f'A{rng.randrange(n_items):07d}', float(rng.randint(1, 100)),
+                today + timedelta(days=rng.randint(-200, 60)), 'C' if rng.random() < 0.6 else 'O',
+            )
+            produced += 1
+
+
+def _receipt_lines(rng, count, n_receipts, n_orders, n_items):
+    per_receipt = max(1, count // n_receipts)
+    produced = 0
+    for entry in range(1, n_receipts + 1):
+        for line in range(per_receipt if entry < n_receipts else count - produced):
+            base = rng.randint(1, n_orders) if rng.random() < 0.7 else None
+            yield (
+                entry, line, f'A{rng.randrange(n_items):07d}', float(rng.randint(1, 100)),
+                base, rng.randint(0, 5) if base else None, 'C' if rng.random() < 0.8 else 'O',
+            )
+            produced += 1
+
+
+def _insert(connection, table: str, rows: Iterator[tuple]) -> int:
+    chunk, total = [], 0
+    statement = None
+    for row in rows:
+        if statement is None:
+            statement = f"INSERT INTO {table} VALUES ({', '.join('?' * len(row))})"
+        chunk.append(row)
+        if len(chunk) >= _INSERT_CHUNK:
+            connection.executemany(statement, chunk)
+            total += len(chunk)
+            chunk = []
+    if chunk:
+        connection.executemany(statement, chunk)
+        total += len(chunk)
+    return total
+
+
+def generate(path: str, total_rows: int, seed: int = 42) -> Dict[str, int]:
+    """
+    Crea (sovrascrivendo) il file SQLite `path` con ~`total_rows` righe SAP
+    sintetiche, deterministiche per `seed`. Restituisce le righe per tabella.
+    """
+    counts = table_counts(total_rows)
+    rng = random.Random(seed)
+    today = date.today()
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        for table, ddl in _DDL.items():
+            connection.execute(f'DROP TABLE IF EXISTS {table}')
+            connection.execute(ddl)
+        n_items, n_partners = counts['OITM'], counts['OCRD']
+        catalog = list(_catalog(rng, min(counts['OSCN'], n_items * n_partners), n_items, n_partners))
+        written = {
+            'OITM': _insert(connection, 'OITM', _items(rng, n_items, today)),
+            'OCRD': _insert(connection, 'OCRD', _partners(rng, n_partners, today)),
+            'OSCN': _insert(connection, 'OSCN', iter(catalog)),
+            'SPP1': _insert(connection, 'SPP1', _prices(rng, counts['SPP1'], catalog)),
+            'OPOR': _insert(connection, 'OPOR', _documents(rng, counts['OPOR'], n_partners, today, True)),
+            'POR1': _insert(connection, 'POR1', _order_lines(rng, counts['POR1'], counts['OPOR'], n_items, today)),
+            'OPDN': _insert(connection, 'OPDN', _documents(rng, counts['OPDN'], n_partners, today, False)),
+            'PDN1': _insert(
+                connection, 'PDN1', _receipt_lines(rng, counts['PDN1'], counts['OPDN'], counts['OPOR'], n_items)
+            ),
+        }
+        for statement in _INDEXES:
+            connection.execute(statement)
+        connection.commit()
+    finally:
+        connection.close()
+    return written
+
+
+def sqlite_mapping(table_name: str):
+    """Copia del mapping con le query adattate a SQLite."""
+    mapping = copy.copy(MAPPINGS_REGISTRY[table_name])
+    override = QUERY_OVERRIDES.get(table_name)
+    if override is not None:
+        mapping.sap_query = override
+    elif mapping.sap_query:
+        mapping.sap_query = to_sqlite(mapping.sap_query)
+    if mapping.header_query:
+        mapping.header_query = to_sqlite(mapping.header_query)
+    if mapping.change_probe:
+        mapping.change_probe = to_sqlite(mapping.change_probe)
+    return mapping
+
+
+@contextmanager
+def sqlite_mappings():
+    """Sostituisce temporaneamente i mapping del registry con le versioni SQLite."""
+    originals = dict(MAPPINGS_REGISTRY)
+    try:
+        for table_name in originals:
+            MAPPINGS_REGISTRY[table_name] = sqlite_mapping(table_name)
+        yield MAPPINGS_REGISTRY
+    finally:
+        MAPPINGS_REGISTRY.clear()
+        MAPPINGS_REGISTRY.update(originals)
+
+
+class SyntheticDatabaseConfig:
+    """
+    Connessioni del benchmark: PostgreSQL locale e SAP sintetico. Espone la
+    stessa interfaccia di DatabaseConfig usata da engine e callback
+    (DEPOSYTA e MODULA non configurati: gli arricchimenti vengono saltati).
+    """
+
+    deposyta_db_url = None
+    modula_db_url = None
+
+    def __init__(self, postgres_url: str, sap_path: str):
+        self.postgres_url = postgres_url
+        self.pg_engine = create_engine(postgres_url)
+        self.sap_engine = create_sap_engine(sap_path)
+        self.PGSession = sessionmaker(bind=self.pg_engine)
+        self.SAPSession = sessionmaker(bind=self.sap_engine)
+
+    def get_pg_session(self):
+        return self.PGSession()
+
+    def get_sap_session(self):
+        return self.SAPSession()
+
+    def pool_stats(self) -> dict:
+        return {}
+
+    def dispose(self) -> None:
+        self.pg_engine.dispose()
+        self.sap_engine.dispose()
@@ -0,0 +1,290 @@
+"""
+Micro-benchmark dei transformer (src/utils/transformers.py) e della
+trasformazione righe dei mapping, con soglie di regressione.
+
+Casi misurati:
+- transformer:<funzione>  safe_* e parse_update_ts su un mix di valori reali;
+- transform_row:<tabella> TableMapping.transform_row (post_transform inclusa);
+- compiled:<tabella>      transformer compilato usato dal motore.
+
+Le righe sono lette dalla sorgente SAP sintetica (benchmarks/synthetic_sap.py)
+con le query dei mapping e riusate a ciclo fino a --rows; i numerici arrivano
+come Decimal e cursor.description riporta i tipi Python, come con pyodbc.
+Tutto gira offline: nessuna connessione a SAP o PostgreSQL.
+
+Il costo è riportato in ns/riga e, per confrontare macchine diverse, in
+rapporto a un carico di riferimento in puro Python misurato nella stessa
+esecuzione. Il gate fallisce (exit code 1) se un caso supera la soglia
+relativa salvata in transform_thresholds.json; --update-thresholds la
+riscrive dalle misure correnti più il margine.
+
+    python -m benchmarks.transform_benchmark --rows 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+from decimal import Decimal
+from itertools import cycle, islice
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+import src.mappings.anagrafica_articoli as anagrafica_articoli_module
+import src.mappings.entrata_merci_lines as entrata_merci_lines_module
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.utils.transformers import (
+    parse_update_ts,
+    safe_date,
+    safe_datetime,
+    safe_float,
+    safe_int,
+    safe_string,
+)
+
+from .synthetic_sap import create_sap_engine, generate, sqlite_mapping
+
+THRESHOLDS_PATH = Path(__file__).resolve().parent / 'transform_thresholds.json'
+# Margine applicato da --update-thresholds sopra il costo relativo misurato
+DEFAULT_HEADROOM = 0.50
+SAMPLE_SOURCE_ROWS = 20000
+BLOCK_ROWS = 10000
+
+_TRANSFORMERS = {
+    'safe_datetime': safe_datetime,
+    'safe_date': safe_date,
+    'safe_float': safe_float,
+    'safe_int': safe_int,
+    'safe_string': safe_string,
+}
+
+Case = Tuple[Callable, list, bool]
+
+
+def _reference_row(row: tuple) -> dict:
+    """Carico di riferimento: dict da tupla, come una trasformazione senza conversioni."""
+    return {'a': row[0], 'b': row[1], 'c': row[2], 'd': row[3], 'e': row[4], 'f': row[5]}
+
+
+def _measure(function: Callable, items: list, unpack: bool, repeats: int) -> float:
+    """
+    ns per elemento: minimo tra i blocchi di BLOCK_ROWS elementi su `repeats`
+    passate (GC disattivato), così le interferenze momentanee non pesano.
+    """
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeats):
+            for offset in range(0, len(items), BLOCK_ROWS):
+                block = items[offset:offset + BLOCK_ROWS]
+                start = time.perf_counter_ns()
+                if unpack:
+                    for item in block:
+                        function(*item)
+                else:
+                    for item in block:
+                        function(item)
+                elapsed = (time.perf_counter_ns() - start) / len(block)
+                best = elapsed if best is None else min(best, elapsed)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+
+def _to_pyodbc(value):
+    # pyodbc restituisce i numeric SAP come Decimal
+    return Decimal(repr(value)) if isinstance(value, float) else value
+
+
+def sample_rows(sap_path: str) -> Dict[str, Tuple[List[str], List[tuple], list]]:
+    """Per mapping: colonne, righe e cursor.description stile pyodbc dalla sorgente sintetica."""
+    engine = create_sap_engine(sap_path)
+    samples = {}
+    try:
+        with engine.connect() as connection:
+            for table_name in MAPPINGS_REGISTRY:
+                mapping = sqlite_mapping(table_name)
+                query = mapping.sap_query or (
+                    f"SELECT {', '.join(mapping.column_mappings)} FROM {mapping.sap_table}"
+                )
+                result = connection.execute(text(query))
+                columns = list(result.keys())
+                rows = [tuple(_to_pyodbc(value) for value in row) for row in result]
+                types = [
+                    next((type(row[i]) for row in rows if row[i] is not None), str)
+                    for i in range(len(columns))
+                ]
+                samples[table_name] = (columns, rows, [(name, t) for name, t in zip(columns, types)])
+    finally:
+        engine.dispose()
+    return samples
+
+
+def _value_samples(samples) -> Tuple[Dict[str, list], list]:
+    """Valori delle colonne a cui ogni transformer è applicato nei mapping, più UpdateDate/UpdateTS."""
+    values = {name: [] for name in _TRANSFORMERS}
+    update_stamps = []
+    for table_name, (columns, rows, _) in samples.items():
+        mapping = MAPPINGS_REGISTRY[table_name]
+        index = {name.lower(): i for i, name in enumerate(columns)}
+        for sap_col, pg_col in mapping.column_mappings.items():
+            converter = mapping.transformations.get(pg_col)
+            for name, function in _TRANSFORMERS.items():
+                if converter is function and sap_col.lower() in index:
+                    values[name].extend(row[index[sap_col.lower()]] for row in rows)
+        if 'updatedate' in index and 'updatets' in index:
+            update_stamps.extend((row[index['updatedate']], row[index['updatets']]) for row in rows)
+    values = {name: items for name, items in values.items() if items}
+    return values, update_stamps
+
+
+def build_cases(samples) -> Dict[str, Case]:
+    """Casi del benchmark: nome → (funzione, campione, argomenti da spacchettare)."""
+    values, update_stamps = _value_samples(samples)
+    cases: Dict[str, Case] = {}
+    for name, items in values.items():
+        cases[f'transformer:{name}'] = (_TRANSFORMERS[name], items, False)
+    if update_stamps:
+        cases['transformer:parse_update_ts'] = (parse_update_ts, update_stamps, True)
+    for table_name, (columns, rows, description) in samples.items():
+        mapping = MAPPINGS_REGISTRY[table_name]
+        # transform_row normalizza le chiavi della riga: un dict nuovo per chiamata
+        cases[f'transform_row:{table_name}'] = (
+            lambda row, m=mapping, c=columns: m.transform_row(dict(zip(c, row))), rows, False
+        )
+        cases[f'compiled:{table_name}'] = (mapping.compile_transformer(columns, description), rows, False)
+    return cases
+
+
+def _resize(items: list, count: int) -> list:
+    return list(islice(cycle(items), count))
+
+
+def run(
+    rows: int,
+    repeats: int = 3,
+    sap_path: Optional[str] = None,
+    select: Optional[Callable[[str], bool]] = None,
+) -> dict:
+    """Misura i casi (tutti o quelli scelti da `select`) su `rows` elementi ciascuno."""
+    with tempfile.TemporaryDirectory() as directory:
+        if sap_path is None:
+            sap_path = os.path.join(directory, 'sap.db')
+            generate(sap_path, SAMPLE_SOURCE_ROWS)
+        samples = sample_rows(sap_path)
+
+    # Stato delle post_transform come dopo pre_sync / pre_process del motore
+    saved = anagrafica_articoli_module._sap_item_codes, entrata_merci_lines_module._valid_order_ids
+    columns, item_rows, _ = samples['anagraficheArticoli']
+    anagrafica_articoli_module._sap_item_codes = {row[columns.index('ItemCode')] for row in item_rows}
+    entrata_merci_lines_module._valid_order_ids = {
+        row[0] for row in samples['ordiniAcquisto'][1]
+    }
+    try:
+        cases = build_cases(samples)
+        reference_rows = _resize([tuple(range(6))], rows)
+        references, results = [], {}
+        for name, (function, items, unpack) in cases.items():
+            if select is not None and not select(name):
+                continue
+            # Riferimento rimisurato accanto a ogni caso: il rapporto segue le variazioni della CPU
+            reference = _measure(_reference_row, reference_rows, False, repeats)
+            references.append(reference)
+            ns = _measure(function, _resize(items, rows), unpack, repeats)
+            results[name] = {'ns_per_row': round(ns, 1), 'relative': round(ns / reference, 3)}
+    finally:
+        anagrafica_articoli_module._sap_item_codes, entrata_merci_lines_module._valid_order_ids = saved
+    return {'reference_ns': round(min(references, default=0), 2), 'rows': rows, 'cases': results}
+
+
+def merge(reports: List[dict], pick: Callable = max) -> dict:
+    """Unisce più report tenendo per caso il costo relativo scelto da `pick` (max o min)."""
+    cases = {}
+    for report in reports:
+        for name, result in report['cases'].items():
+            if name not in cases or pick(result['relative'], cases[name]['relative']) != cases[name]['relative']:
+                cases[name] = result
+    return {**reports[-1], 'cases': cases}
+
+
+def check(report: dict, thresholds: Dict[str, float]) -> Tuple[List[str], List[str]]:
+    """(regressioni oltre soglia, casi senza soglia)."""
+    regressions, missing = [], []
+    for name, result in report['cases'].items():
+        limit = thresholds.get(name)
+        if limit is None:
+            missing.append(name)
+        elif result['relative'] > limit:
+            regressions.append(f"{name}: {result['relative']:.3f} > soglia {limit:.3f} ({result['ns_per_row']:.0f} ns/riga)")
+    return regressions, missing
+
+
+def load_thresholds(path: Path = THRESHOLDS_PATH) -> Dict[str, float]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding='utf-8'))['max_relative']
+
+
+def save_thresholds(report: dict, headroom: float, path: Path = THRESHOLDS_PATH) -> None:
+    payload = {
+        'headroom': headroom,
+        'max_relative': {
+            name: round(result['relative'] * (1 + headroom), 3)
+            for name, result in sorted(report['cases'].items())
+        },
+    }
+    path.write_text(json.dumps(payload, indent=2) + '\n', encoding='utf-8')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Micro-benchmark transformer e transform_row dei mapping')
+    parser.add_argument('--rows', type=int, default=1000000, help='Righe per caso (default 1M)')
+    parser.add_argument('--repeats', type=int, default=3, help='Esecuzioni per caso (vale la migliore)')
+    parser.add_argument('--only', help='Solo i casi il cui nome contiene questo testo')
+    parser.add_argument('--thresholds', type=Path, default=THRESHOLDS_PATH)
+    parser.add_argument('--update-thresholds', action='store_true', help='Riscrive le soglie dalle misure correnti')
+    parser.add_argument('--headroom', type=float, default=DEFAULT_HEADROOM)
+    parser.add_argument('--runs', type=int, default=1,
+                        help='Misure complete da eseguire (gate: vale la migliore; soglie: la peggiore)')
+    parser.add_argument('--json', help='Salva il report in questo file')
+    args = parser.parse_args(argv)
+
+    select = (lambda name: args.only in name) if args.only else None
+    reports = [run(args.rows, args.repeats, select=select) for _ in range(args.runs)]
+    report = merge(reports, max if args.update_thresholds else min)
+    print(f"Riferimento: {report['reference_ns']} ns/riga, {args.rows} righe per caso")
+    for name, result in report['cases'].items():
+        print(f"{name:<42} {result['ns_per_row']:>10.1f} ns/riga  x{result['relative']:.2f}")
+
+    if args.update_thresholds:
+        # Soglie dalla misura più lenta tra le esecuzioni: il gate non deve dipendere dal rumore
+        save_thresholds(report, args.headroom, args.thresholds)
+        print(f"Soglie aggiornate in {args.thresholds}")
+        return 0
+
+    thresholds = load_thresholds(args.thresholds)
+    regressions, missing = check(report, thresholds)
+    if regressions:
+        # Conferma: i casi oltre soglia vengono rimisurati e vale la misura migliore
+        failed = {name for name, result in report['cases'].items() if result['relative'] > thresholds.get(name, float('inf'))}
+        print(f"Rimisura di {len(failed)} casi oltre soglia...")
+        report = merge([report, run(args.rows, args.repeats, select=failed.__contains__)], min)
+        regressions, missing = check(report, thresholds)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding='utf-8')
+    for name in missing:
+        print(f"Nessuna soglia per {name} (usare --update-thresholds)")
+    for regression in regressions:
+        print(f"REGRESSIONE {regression}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,10 +14,14 @@ import os
 import time
 import signal
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from src.sync.engine import SyncEngine
-from src.config.database import DatabaseConfig
+from src.sync import profiler as profiling
+from src.sync import progress as progress_tracking
+from src.sync.progress import SyncCancelled
+from src.sync.scheduler import DagScheduler, SyncNode, table_nodes
+from src.config.database import get_database_config, refresh_database_config
+from src.config.settings_cache import settings_cache
 from src.utils.logger import setup_application_logger, setup_error_logger, log_performance
 from src.api.app import run_api_server, _sync_status, _sync_lock
 from datetime import datetime, timezone
@@ -25,16 +29,13 @@ from datetime import datetime, timezone
 # Flag per shutdown graceful
 _shutdown_event = threading.Event()
 
+# L'ordine di esecuzione deriva da TableMapping.depends_on (scheduler a grafo)
 TABLES_TO_SYNC = [
     "anagraficheBusinessPartner",
     "anagraficheArticoli",
     "catalogoBusinessPartner",
     "ordiniAcquisto",
     "ordiniAcquistoLines",
-]
-
-# Testata prima delle righe: FK entrata_merci_lines -> entrata_merci (ON DELETE CASCADE)
-ENTRATA_MERCI_TABLES = [
     "entrataMerci",
     "entrataMerciLines",
 ]
@@ -44,99 +45,166 @@ SETTINGS_KEY = 'sap_sync_interval_minutes'
 
 
 def _get_sync_interval(logger) -> int:
-    """Legge l'intervallo di sincronizzazione da PostgreSQL settings. Fallback al default."""
+    """Legge l'intervallo di sincronizzazione da settings (cache). Fallback al default."""
     try:
-        from sqlalchemy import create_engine, text
-        db_config = DatabaseConfig()
-        engine = create_engine(db_config.postgres_url)
-        with engine.connect() as conn:
-            row = conn.execute(
-                text("SELECT value FROM settings WHERE key = :key"),
-                {'key': SETTINGS_KEY}
-            ).fetchone()
-        engine.dispose()
-        if row and row[0]:
-            return max(1, int(row[0]))
+        value = settings_cache.get(SETTINGS_KEY)
+        if value:
+            return max(1, int(value))
     except Exception as e:
         logger.warning(f"Impossibile leggere intervallo da DB, uso default {DEFAULT_INTERVAL_MINUTES}m: {e}")
     return DEFAULT_INTERVAL_MINUTES
 
 
-def _cleanup_orphan_order_headers(logger) -> None:
-    """Rimuove testate ordine senza righe valide importate.
-    Eseguita sequenzialmente dopo tutti i sync paralleli.
+def _cleanup_orphans(logger, scope, force_full: bool = False) -> dict:
+    """Rimuove testate ordine e righe entrata merci orfane dei documenti toccati nel ciclo.
+    Nodo del grafo: parte dopo ordini, entrata merci e relative righe.
     """
+    from src.sync.cleanup import cleanup_orphans
+    pg_session = get_database_config().get_pg_session()
     try:
-        from sqlalchemy import create_engine, text
-        db_config = DatabaseConfig()
-        engine = create_engine(db_config.postgres_url)
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                DELETE FROM sap.ordini_acquisto o
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM sap.ordini_acquisto_lines l
-                    WHERE l.cod_documento = o.id
-                )
-                AND NOT EXISTS (
-                    SELECT 1 FROM sap.entrata_merci_lines em
-                    WHERE em.cod_order_acquisto = o.id
-                )
-            """))
-            conn.commit()
-            deleted = result.rowcount
-        engine.dispose()
-        if deleted:
-            logger.info(f"Cleanup ordini: rimossi {deleted} ordini senza righe valide")
-    except Exception as e:
-        logger.warning(f"Cleanup orphan headers fallito (non bloccante): {e}")
+        return cleanup_orphans(pg_session, scope, logger, full=force_full)
+    finally:
+        pg_session.close()
 
 
-def _cleanup_orphan_entrata_merci_lines(logger) -> None:
-    """Rimuove righe entrata merci senza testata (non dovrebbero esistere con FK attiva)."""
+def _reconcile_rfq(logger, force_full: bool = False, scope=None) -> dict:
+    """Riconcilia RFQ aperte con gli ordini di acquisto appena sincronizzati.
+    Incrementale sui watermark; con force_full, o se le righe ordine del ciclo (scope)
+    sono state ricaricate per intero, confronta tutte le RFQ aperte con tutti gli ordini.
+    """
+    from src.sync.reconciler import reconcile_rfq_with_orders
+    pg_session = get_database_config().get_pg_session()
     try:
-        from sqlalchemy import create_engine, text
-        db_config = DatabaseConfig()
-        engine = create_engine(db_config.postgres_url)
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                DELETE FROM sap.entrata_merci_lines l
-                WHERE NOT EXISTS (
-                    SELECT 1 FROM sap.entrata_merci e WHERE e.id = l.cod_entrata_merci
-                )
-            """))
-            conn.commit()
-            deleted = result.rowcount
-        engine.dispose()
-        if deleted:
-            logger.info(f"Cleanup entrata merci: rimosse {deleted} righe orfane")
-    except Exception as e:
-        logger.warning(f"Cleanup orphan entrata merci lines fallito (non bloccante): {e}")
+        return reconcile_rfq_with_orders(pg_session, logger, full=force_full, scope=scope)
+    finally:
+        pg_session.close()
 
 
-def sync_single_table(table_name: str, logger, error_logger, force_full: bool = False) -> dict:
-    """Sincronizza una singola tabella — funzione per threading."""
+def _profiled_job(profiler, name: str, job):
+    """Esegue un job del grafo registrando durata e statistiche numeriche nel profilo del ciclo."""
+    def run():
+        profile = profiler.table(name)
+        profiling.set_current(profile)
+        try:
+            with profile.stage('job'):
+                stats = job()
+            if isinstance(stats, dict):
+                profile.count('job', **{
+                    key: value for key, value in stats.items()
+                    if isinstance(value, int) and not isinstance(value, bool)
+                })
+        finally:
+            profiling.set_current(None)
+    return run
+
+
+def _tracked_job(progress, name: str, job):
+    """Esegue un job del grafo pubblicandone lo stato nell'avanzamento; non parte se il ciclo è annullato."""
+    def run():
+        progress.check_cancelled()
+        tracker = progress.table(name)
+        tracker.start()
+        tracker.set_stage('job')
+        try:
+            job()
+        except Exception as e:
+            tracker.finish(progress_tracking.FAILED, str(e))
+            raise
+        tracker.finish(progress_tracking.DONE)
+    return run
+
+
+def build_sync_graph(logger, error_logger, force_full: bool = False, profiler=None, progress=None) -> list:
+    """Nodi del ciclo di sincronizzazione: tabelle (dipendenze dai mapping) e job successivi."""
+    from src.sync.cleanup import CleanupScope
+    cleanup_scope = CleanupScope()
+    profiler = profiler or profiling.NULL_PROFILER
+    progress = progress or progress_tracking.NULL_PROGRESS
+
+    def run_table(table_name):
+        result = sync_single_table(table_name, logger, error_logger, force_full, cleanup_scope, profiler, progress)
+        if result.get("cancelled"):
+            raise SyncCancelled()
+        if not result["success"]:
+            raise RuntimeError(result["error"])
+        return result["skipped"]
+
+    nodes = table_nodes(TABLES_TO_SYNC, run_table)
+    nodes += [
+        SyncNode(
+            "cleanupOrfani",
+            _tracked_job(progress, "cleanupOrfani", _profiled_job(
+                profiler, "cleanupOrfani", lambda: _cleanup_orphans(logger, cleanup_scope, force_full)
+            )),
+            ("ordiniAcquisto", "ordiniAcquistoLines", "entrataMerci", "entrataMerciLines"),
+            kind="job",
+        ),
+        SyncNode(
+            "riconciliazioneRfq",
+            _tracked_job(progress, "riconciliazioneRfq", _profiled_job(
+                profiler, "riconciliazioneRfq", lambda: _reconcile_rfq(logger, force_full, cleanup_scope)
+            )),
+            ("ordiniAcquisto", "ordiniAcquistoLines", "cleanupOrfani"),
+            kind="job",
+        ),
+    ]
+    return nodes
+
+
+def sync_single_table(
+    table_name: str, logger, error_logger, force_full: bool = False, cleanup_scope=None, profiler=None,
+    progress=None,
+) -> dict:
+    """Sincronizza una singola tabella — funzione per threading.
+    Con cleanup_scope registra i documenti toccati (e quelli referenziati dalle righe rimosse)
+    per il cleanup incrementale degli orfani e registra come fallite le tabelle non completate
+    (documenti non noti);
+    con profiler registra i tempi per stadio nel profilo del ciclo; con progress pubblica
+    l'avanzamento e si interrompe se il ciclo viene annullato.
+    """
     table_start = time.time()
     logger.info(f"Avvio sincronizzazione tabella: {table_name}")
     try:
-        db_config = DatabaseConfig()
-        sync_engine = SyncEngine(db_config)
+        sync_engine = SyncEngine(get_database_config(), profiler=profiler, progress=progress)
         sync_engine.sync_table(table_name, force_full=force_full)
+        if cleanup_scope is not None:
+            cleanup_scope.record(table_name, sync_engine.touched_documents)
+            for source, references in sync_engine.released_references.items():
+                cleanup_scope.record(source, references)
         table_duration = time.time() - table_start
         log_performance(logger, f"Sincronizzazione {table_name}", table_duration)
-        logger.info(f"Completata sincronizzazione tabella: {table_name}")
-        return {"table": table_name, "success": True, "duration": table_duration, "error": None}
+        if sync_engine.skipped:
+            logger.info(f"Saltata sincronizzazione tabella (invariata): {table_name}")
+        else:
+            logger.info(f"Completata sincronizzazione tabella: {table_name}")
+        return {
+            "table": table_name, "success": True, "skipped": sync_engine.skipped,
+            "duration": table_duration, "error": None,
+        }
+    except SyncCancelled as e:
+        if cleanup_scope is not None:
+            cleanup_scope.record_failure(table_name)
+        table_duration = time.time() - table_start
+        logger.warning(f"Sincronizzazione {table_name} annullata dopo {table_duration:.2f}s")
+        return {
+            "table": table_name, "success": False, "skipped": False, "duration": table_duration,
+            "error": str(e), "cancelled": True,
+        }
     except Exception as e:
+        if cleanup_scope is not None:
+            cleanup_scope.record_failure(table_name)
         table_duration = time.time() - table_start
         error_logger.error(f"Errore sincronizzazione {table_name} dopo {table_duration:.2f}s: {str(e)}")
         logger.error(f"Fallita sincronizzazione tabella: {table_name}")
-        return {"table": table_name, "success": False, "duration": table_duration, "error": str(e)}
+        return {"table": table_name, "success": False, "skipped": False, "duration": table_duration, "error": str(e)}
 
 
 def run_full_sync(logger, error_logger, force_full: bool = False) -> dict:
     """
-    Esegue la sincronizzazione completa in parallelo.
-    Aggiorna _sync_status durante l'esecuzione.
-    Restituisce il dict di risultato.
+    Esegue la sincronizzazione completa con lo scheduler a grafo: ogni tabella
+    parte appena le sue dipendenze sono terminate, seguita da cleanup e
+    riconciliazione RFQ. Aggiorna _sync_status durante l'esecuzione.
+    Restituisce il dict di risultato (errori delle sole tabelle, come in precedenza).
     Se force_full=True, ignora il last_sync per le tabelle UPSERT (full resync).
     """
     import src.api.app as api_module
@@ -149,51 +217,38 @@ def run_full_sync(logger, error_logger, force_full: bool = False) -> dict:
         api_module._sync_status['running'] = True
 
     start_time = time.time()
-    results = []
-    failed_tables = []
+    profiler = profiling.create_run_profiler('scheduler', force_full)
+    cycle_profile = profiler.table(profiling.CYCLE)
+    # Avanzamento pubblicato su /api/sync/status; /api/sync/cancel annulla anche il ciclo schedulato
+    progress = progress_tracking.start_run('scheduler', TABLES_TO_SYNC, force_full)
+    sync_result = None
 
     try:
-        max_workers = min(len(TABLES_TO_SYNC), 3)
-        logger.info(f"Avvio sincronizzazione parallela con {max_workers} thread per {len(TABLES_TO_SYNC)} tabelle")
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_table = {
-                executor.submit(sync_single_table, t, logger, error_logger, force_full): t
-                for t in TABLES_TO_SYNC
-            }
-            for future in as_completed(future_to_table):
-                result = future.result()
-                results.append(result)
-                if result["success"]:
-                    logger.info(f"✓ {result['table']} completata in {result['duration']:.2f}s")
-                else:
-                    failed_tables.append(result['table'])
-                    logger.error(f"✗ {result['table']} fallita in {result['duration']:.2f}s: {result['error']}")
+        # Ricrea i pool solo se le credenziali in settings sono cambiate
+        with cycle_profile.stage('refresh_database_config'):
+            refresh_database_config()
+        scheduler = DagScheduler(
+            build_sync_graph(logger, error_logger, force_full, profiler, progress),
+            logger=logger,
+            error_logger=error_logger,
+        )
+        with cycle_profile.stage('graph'):
+            results = scheduler.run()
+        table_results = [r for r in results if r["kind"] == "table"]
 
         total_duration = time.time() - start_time
-        successful = len([r for r in results if r["success"]])
-        logger.info(f"Riepilogo parallelo: {successful}/{len(TABLES_TO_SYNC)} riuscite in {total_duration:.2f}s")
-
-        for table_name in ENTRATA_MERCI_TABLES:
-            result = sync_single_table(table_name, logger, error_logger, force_full)
-            results.append(result)
-            if result["success"]:
-                logger.info(f"✓ {result['table']} completata in {result['duration']:.2f}s")
-            else:
-                failed_tables.append(result['table'])
-                logger.error(f"✗ {result['table']} fallita in {result['duration']:.2f}s: {result['error']}")
-
-        # Cleanup sequenziale: rimuove testate senza righe (entrambe le sync sono completate)
-        _cleanup_orphan_order_headers(logger)
-        _cleanup_orphan_entrata_merci_lines(logger)
-
-        total_tables = len(TABLES_TO_SYNC) + len(ENTRATA_MERCI_TABLES)
-        successful = len([r for r in results if r["success"]])
-        logger.info(f"Riepilogo totale: {successful}/{total_tables} riuscite")
+        successful = len([r for r in table_results if r["success"]])
+        # Riuscite includono le saltate (dati già allineati), riportate a parte
+        skipped = [r["table"] for r in table_results if r["skipped"]]
+        logger.info(f"Riepilogo totale: {successful}/{len(TABLES_TO_SYNC)} riuscite in {total_duration:.2f}s")
+        if skipped:
+            logger.info(f"Saltate perché invariate ({len(skipped)}): {', '.join(skipped)}")
 
         sync_result = {
-            'success': len(failed_tables) == 0,
-            'errors': [{'table': r['table'], 'error': r['error']} for r in results if not r["success"]],
+            'success': successful == len(table_results),
+            'errors': [{'table': r['table'], 'error': r['error']} for r in table_results if not r["success"]],
+            'skipped': skipped,
+            'cancelled': progress.cancel_requested,
             'completed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
         }
     except Exception as e:
@@ -204,9 +259,11 @@ def run_full_sync(logger, error_logger, force_full: bool = False) -> dict:
             'completed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
         }
     finally:
+        progress.finish()
         api_module._sync_status['running'] = False
         api_module._sync_status['last_result'] = sync_result
 
+    profiler.finish(bool(sync_result and sync_result['success']), logger)
     return sync_result
 
 
@@ -234,19 +291,11 @@ def _trigger_scheduled_notifications(logger, now: 'datetime') -> None:
     headers = _scheduler_auth_headers()
 
     try:
-        from sqlalchemy import create_engine, text as sa_text
-        from src.config.database import DatabaseConfig
-        db_config = DatabaseConfig()
-        engine = create_engine(db_config.postgres_url)
-        with engine.connect() as conn:
-            rows = conn.execute(sa_text(
-                "SELECT key, value FROM settings WHERE key IN ("
-                "'rfq_digest_enabled','rfq_digest_hour',"
-                "'understock_report_enabled','understock_report_hour',"
-                "'intervention_reminder_enabled','intervention_reminder_hour')"
-            )).fetchall()
-        engine.dispose()
-        cfg_map = {r[0]: r[1] for r in rows}
+        cfg_map = settings_cache.get_many([
+            'rfq_digest_enabled', 'rfq_digest_hour',
+            'understock_report_enabled', 'understock_report_hour',
+            'intervention_reminder_enabled', 'intervention_reminder_hour',
+        ])
     except Exception as e:
         logger.warning(f"_trigger_scheduled_notifications: impossibile leggere settings: {e}")
         return
@@ -322,10 +371,9 @@ def scheduler_loop(logger, error_logger):
     """
     Loop principale dello scheduler.
     Legge l'intervallo dal DB, esegue la sync, aspetta, ripete.
-    Controlla _reload_requested per ricaricare l'intervallo al volo.
+    L'attesa si interrompe appena la cache settings viene invalidata
+    (NOTIFY settings_changed o /api/reload-config) per applicare subito il nuovo intervallo.
     """
-    import src.api.app as api_module
-
     logger.info("Scheduler loop avviato")
 
     first_run = True
@@ -339,17 +387,10 @@ def scheduler_loop(logger, error_logger):
         logger.info("=" * 50)
         logger.info("Avvio ciclo di sincronizzazione" + (" (full resync — primo avvio)" if first_run else ""))
         logger.info("=" * 50)
+        # La riconciliazione RFQ è un nodo del grafo (dopo ordini e cleanup)
         run_full_sync(logger, error_logger, force_full=first_run)
         first_run = False
 
-        # Riconcilia RFQ aperte con ordini di acquisto appena sincronizzati
-        try:
-            from src.sync.reconciler import reconcile_rfq_with_orders
-            db_config_rec = DatabaseConfig()
-            reconcile_rfq_with_orders(db_config_rec.postgres_url, logger)
-        except Exception as e:
-            error_logger.error(f"Post-sync RFQ reconciliation error: {e}")
-
         # Trigger notifiche schedulate (primo controllo del ciclo)
         try:
             _trigger_scheduled_notifications(logger, datetime.now(timezone.utc))
@@ -358,28 +399,29 @@ def scheduler_loop(logger, error_logger):
 
         # Attendi fino al prossimo ciclo, con possibilità di interruzione e reload
         logger.info(f"Prossima sincronizzazione tra {interval_minutes} minuti")
-        elapsed = 0
-        check_interval = 10  # controlla ogni 10 secondi
-        elapsed_since_trigger = 0
-
-        while elapsed < interval_seconds and not _shutdown_event.is_set():
-            time.sleep(check_interval)
-            elapsed += check_interval
-            elapsed_since_trigger += check_interval
-
-            # Ricarica intervallo se richiesto dalla API
-            if api_module._reload_requested:
-                api_module._reload_requested = False
+        wait_start = time.monotonic()
+        next_trigger = wait_start + 3600
+
+        while not _shutdown_event.is_set():
+            now = time.monotonic()
+            remaining = interval_seconds - (now - wait_start)
+            if remaining <= 0:
+                break
+
+            if settings_cache.wait_for_change(timeout=min(remaining, max(0.0, next_trigger - now))):
+                if _shutdown_event.is_set():
+                    break
+                # Configurazione cambiata: ricarica l'intervallo
                 new_interval = _get_sync_interval(logger)
                 if new_interval != interval_minutes:
                     logger.info(f"Intervallo aggiornato da {interval_minutes} a {new_interval} minuti, riavvio ciclo")
                     interval_minutes = new_interval
                     interval_seconds = new_interval * 60
-                    elapsed = 0
+                    wait_start = time.monotonic()
 
             # Trigger notifiche schedulate ogni 60 minuti
-            if elapsed_since_trigger >= 3600:
-                elapsed_since_trigger = 0
+            if time.monotonic() >= next_trigger:
+                next_trigger = time.monotonic() + 3600
                 try:
                     _trigger_scheduled_notifications(logger, datetime.now(timezone.utc))
                 except Exception as e:
@@ -400,10 +442,14 @@ def main():
     def _handle_signal(signum, frame):
         logger.info(f"Segnale {signum} ricevuto, shutdown in corso...")
         _shutdown_event.set()
+        settings_cache.wake()
 
     signal.signal(signal.SIGINT, _handle_signal)
     signal.signal(signal.SIGTERM, _handle_signal)
 
+    # Invalidazione immediata della cache settings su NOTIFY settings_changed
+    settings_cache.start_listener()
+
     # Avvia API server in background
     api_thread = threading.Thread(target=run_api_server, daemon=True, name='sap-api-server')
     api_thread.start()
@@ -0,0 +1,22 @@
+-- UP
+CREATE OR REPLACE FUNCTION public.notify_settings_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_notify('settings_changed', TG_OP);
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS settings_changed_notify ON public.settings;
+
+CREATE TRIGGER settings_changed_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.settings
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION public.notify_settings_changed();
+
+-- DOWN
+DROP TRIGGER IF EXISTS settings_changed_notify ON public.settings;
+
+DROP FUNCTION IF EXISTS public.notify_settings_changed();
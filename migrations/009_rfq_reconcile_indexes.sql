@@ -0,0 +1,25 @@
+-- UP
+-- Indici per la riconciliazione incrementale RFQ → ordini (src/sync/reconciler.py)
+
+-- RFQ aperte (ordine_acquisto_id NULL): indice parziale, resta piccolo
+CREATE INDEX IF NOT EXISTS richieste_offerte_aperte_idx
+    ON sap.richieste_offerte (cod_business_partner, cod_articolo, created_at)
+    WHERE ordine_acquisto_id IS NULL;
+
+-- Ordini per fornitore e data documento (join con le RFQ, doc_date > created_at)
+CREATE INDEX IF NOT EXISTS ordini_acquisto_bp_doc_date_idx
+    ON sap.ordini_acquisto (cod_business_partner, doc_date);
+
+-- Ordini inseriti o aggiornati dopo il watermark
+CREATE INDEX IF NOT EXISTS ordini_acquisto_last_synced_at_idx
+    ON sap.ordini_acquisto (last_synced_at);
+
+-- Righe ordine per documento e articolo
+CREATE INDEX IF NOT EXISTS ordini_acquisto_lines_documento_articolo_idx
+    ON sap.ordini_acquisto_lines (cod_documento, cod_articolo);
+
+-- DOWN
+DROP INDEX IF EXISTS sap.ordini_acquisto_lines_documento_articolo_idx;
+DROP INDEX IF EXISTS sap.ordini_acquisto_last_synced_at_idx;
+DROP INDEX IF EXISTS sap.ordini_acquisto_bp_doc_date_idx;
+DROP INDEX IF EXISTS sap.richieste_offerte_aperte_idx;
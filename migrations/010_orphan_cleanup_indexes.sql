@@ -0,0 +1,8 @@
+-- UP
+-- Cleanup testate ordine orfane (src/sync/cleanup.py): NOT EXISTS sulle righe
+-- entrata merci che referenziano l'ordine, per i soli documenti toccati nel ciclo
+CREATE INDEX IF NOT EXISTS entrata_merci_lines_cod_order_acquisto_idx
+    ON sap.entrata_merci_lines (cod_order_acquisto);
+
+-- DOWN
+DROP INDEX IF EXISTS sap.entrata_merci_lines_cod_order_acquisto_idx;
@@ -0,0 +1,28 @@
+-- UP
+-- Profilo per stadio dei cicli di sincronizzazione (src/sync/profiler.py, SYNC_PROFILER=true)
+CREATE TABLE IF NOT EXISTS sap.sync_runs (
+    id BIGSERIAL PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP,
+    duration_seconds DOUBLE PRECISION,
+    trigger VARCHAR(20),
+    force_full BOOLEAN NOT NULL DEFAULT FALSE,
+    success BOOLEAN
+);
+
+CREATE INDEX IF NOT EXISTS sync_runs_started_at_idx
+    ON sap.sync_runs (started_at);
+
+CREATE TABLE IF NOT EXISTS sap.sync_run_stages (
+    run_id BIGINT NOT NULL REFERENCES sap.sync_runs(id) ON DELETE CASCADE,
+    table_name VARCHAR(64) NOT NULL,
+    stage VARCHAR(64) NOT NULL,
+    duration_seconds DOUBLE PRECISION NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 1,
+    counters JSONB,
+    PRIMARY KEY (run_id, table_name, stage)
+);
+
+-- DOWN
+DROP TABLE IF EXISTS sap.sync_run_stages;
+DROP TABLE IF EXISTS sap.sync_runs;
@@ -0,0 +1,7 @@
+-- UP
+-- Impronta della sonda di modifica (TableMapping.change_probe): se SAP restituisce
+-- la stessa impronta del sync precedente la tabella viene saltata
+ALTER TABLE sap.sync_state ADD COLUMN IF NOT EXISTS change_fingerprint VARCHAR(64);
+
+-- DOWN
+ALTER TABLE sap.sync_state DROP COLUMN IF EXISTS change_fingerprint;
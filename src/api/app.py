@@ -1,14 +1,16 @@
 """
 Mini Flask API for STM_SAP_Sync.
-Exposes endpoints to test the SAP MSSQL connection and trigger synchronization on demand.
+Exposes endpoints to test the SAP MSSQL connection, trigger synchronization on demand
+and publish sync metrics in Prometheus format.
 Runs on port SAP_API_PORT (default 5001) as a daemon thread alongside the sync process.
 """
 import os
+import json
 import time
 import logging
 import threading
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flasgger import Swagger
 from sqlalchemy import create_engine, text
@@ -16,6 +18,10 @@ from sqlalchemy.exc import SQLAlchemyError
 
 logger = logging.getLogger(__name__)
 
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds between keep-alive comments on the progress event stream
+SSE_KEEPALIVE_SECONDS = 15
+
 app = Flask(__name__)
 CORS(app, resources={r'/api/*': {'origins': '*', 'methods': ['GET', 'POST', 'OPTIONS']}})
 
@@ -55,6 +61,53 @@ _swagger_template = {
                 "latency_ms": {"type": "integer"},
             },
         },
+        "SyncRequest": {
+            "type": "object",
+            "properties": {
+                "tables": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "example": ["ordiniAcquisto", "ordiniAcquistoLines"],
+                    "description": "Tabelle del registro mapping (default: tutte)",
+                },
+                "table": {"type": "string", "example": "anagraficheArticoli"},
+                "force_full": {"type": "boolean", "default": False},
+            },
+        },
+        "TableProgress": {
+            "type": "object",
+            "properties": {
+                "table": {"type": "string"},
+                "status": {"type": "string", "enum": ["pending", "running", "done", "skipped", "failed", "cancelled"]},
+                "stage": {"type": "string", "example": "stream_rows"},
+                "mode": {"type": "string", "enum": ["full", "delta"]},
+                "rows_extracted": {"type": "integer"},
+                "rows_written": {"type": "integer"},
+                "expected_rows": {"type": "integer", "description": "Righe dell'ultima esecuzione nella stessa modalità"},
+                "elapsed_seconds": {"type": "number"},
+                "rows_per_second": {"type": "number"},
+                "eta_seconds": {"type": "number"},
+                "error": {"type": "string"},
+            },
+        },
+        "SyncProgress": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer"},
+                "version": {"type": "integer"},
+                "trigger": {"type": "string", "enum": ["scheduler", "api"]},
+                "force_full": {"type": "boolean"},
+                "status": {"type": "string", "enum": ["running", "done", "cancelled"]},
+                "cancel_requested": {"type": "boolean"},
+                "started_at": {"type": "string", "format": "date-time"},
+                "finished_at": {"type": "string", "format": "date-time"},
+                "rows_extracted": {"type": "integer"},
+                "rows_written": {"type": "integer"},
+                "current_tables": {"type": "array", "items": {"type": "string"}},
+                "eta_seconds": {"type": "number"},
+                "tables": {"type": "array", "items": {"$ref": "#/definitions/TableProgress"}},
+            },
+        },
         "SyncStatus": {
             "type": "object",
             "properties": {
@@ -63,10 +116,17 @@ _swagger_template = {
                     "type": "object",
                     "properties": {
                         "success": {"type": "boolean"},
+                        "cancelled": {"type": "boolean"},
                         "errors": {"type": "array", "items": {"type": "object"}},
+                        "skipped": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Tabelle saltate perché la sonda di modifica è invariata",
+                        },
                         "completed_at": {"type": "string", "format": "date-time"},
                     },
                 },
+                "progress": {"$ref": "#/definitions/SyncProgress"},
             },
         },
     },
@@ -188,46 +248,75 @@ def health():
             status:
               type: string
               example: ok
+            pools:
+              type: object
+              description: >
+                Connection pool statistics per database (size, checked_out,
+                checked_in, overflow, wait_count, wait_seconds_total, wait_seconds_max)
     """
-    return jsonify({'status': 'ok'}), 200
+    from ..config.database import get_pool_stats
+    return jsonify({'status': 'ok', 'pools': get_pool_stats()}), 200
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    Metriche del servizio in formato Prometheus.
+    ---
+    tags:
+      - Sistema
+    summary: Metriche Prometheus
+    description: >
+      Per tabella: istogrammi dei tempi di query SAP, trasformazione e scrittura
+      PostgreSQL e delle righe per sync, contatori di statement di fallback e righe
+      skippate, età dell'ultimo sync riuscito. Inoltre durata dei cicli e
+      statistiche dei pool di connessione.
+    produces:
+      - text/plain
+    responses:
+      200:
+        description: Metriche nel formato testo di Prometheus (0.0.4)
+    """
+    from ..utils.metrics import registry
+    return Response(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
 
 
 # ─── Sync trigger ────────────────────────────────────────────────────────────
 
 _sync_lock = threading.Lock()
 _sync_status = {'running': False, 'last_result': None}
-_reload_requested = False
 
 
-def _run_sync_background():
-    """Execute a full sync in a background thread, loading fresh credentials from DB."""
+def _run_sync_background(tables, force_full=False, progress=None):
+    """Execute a sync of `tables` in a background thread, loading fresh credentials from DB."""
     global _sync_status
+    from ..sync import progress as progress_tracking
+    progress = progress or progress_tracking.NULL_PROGRESS
     try:
-        from ..config.database import DatabaseConfig, get_postgres_setting
+        from ..config.database import refresh_database_config
         from ..sync.engine import SyncEngine
+        from ..sync.profiler import create_run_profiler
+        from ..sync.scheduler import DagScheduler, table_nodes
+
+        # Shared pools, rebuilt only if the credentials in settings changed
+        db_config = refresh_database_config()
+        profiler = create_run_profiler('api', force_full)
+
+        def run_table(table):
+            # One engine per node: nodes run on the scheduler's worker threads
+            engine = SyncEngine(db_config, profiler=profiler, progress=progress)
+            engine.sync_table(table, force_full=force_full)
+            return engine.skipped
 
-        db_config = DatabaseConfig()
-        sync_engine = SyncEngine(db_config)
-
-        tables = [
-            'anagraficheBusinessPartner',
-            'anagraficheArticoli',
-            'catalogoBusinessPartner',
-            'ordiniAcquisto',
-            'ordiniAcquistoLines',
-        ]
-        entrata_merci_tables = ['entrataMerci', 'entrataMerciLines']
-        errors = []
-        for table in tables + entrata_merci_tables:
-            try:
-                sync_engine.sync_table(table)
-            except Exception as e:
-                logger.error(f'Sync error for {table}: {e}')
-                errors.append({'table': table, 'error': str(e)})
+        results = DagScheduler(table_nodes(tables, run_table), logger=logger).run()
+        errors = [{'table': r['table'], 'error': r['error']} for r in results if not r['success']]
+        profiler.finish(not errors, logger, db_config)
 
         _sync_status['last_result'] = {
             'success': len(errors) == 0,
+            'cancelled': progress.cancel_requested,
             'errors': errors,
+            'skipped': [r['table'] for r in results if r['skipped']],
             'completed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
         }
         logger.info('Background sync completed')
@@ -239,21 +328,54 @@ def _run_sync_background():
             'completed_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
         }
     finally:
+        if progress.enabled:
+            progress.finish()
         _sync_status['running'] = False
 
 
+def _requested_tables(data: dict):
+    """
+    Tables requested in the /api/sync body ('tables' list or single 'table'),
+    in registry order. Returns (tables, error message).
+    """
+    from ..mappings.registry import MAPPINGS_REGISTRY
+
+    requested = data.get('tables')
+    if requested is None and data.get('table') is not None:
+        requested = [data['table']]
+    if requested is None:
+        return list(MAPPINGS_REGISTRY), None
+    if isinstance(requested, str):
+        requested = [requested]
+    if not isinstance(requested, list) or not requested or not all(isinstance(t, str) for t in requested):
+        return None, "'tables' deve essere una lista non vuota di nomi tabella"
+    unknown = [t for t in requested if t not in MAPPINGS_REGISTRY]
+    if unknown:
+        return None, f"Tabelle sconosciute: {', '.join(unknown)}. Disponibili: {', '.join(MAPPINGS_REGISTRY)}"
+    return [t for t in MAPPINGS_REGISTRY if t in requested], None
+
+
 @app.route('/api/sync', methods=['POST'])
 def trigger_sync():
     """
-    Avvia una sincronizzazione completa SAP → PostgreSQL.
+    Avvia una sincronizzazione SAP → PostgreSQL (tutte le tabelle o quelle indicate).
     ---
     tags:
       - Sincronizzazione
     summary: Avvia sync manuale
     description: >
       Lancia la sincronizzazione in background usando le credenziali SAP
-      salvate nella tabella `settings` di PostgreSQL. Risponde immediatamente;
-      usare `/api/sync/status` per monitorare l'avanzamento.
+      salvate nella tabella `settings` di PostgreSQL. Senza body sincronizza
+      tutte le tabelle del registro mapping; con `tables` (o `table`) solo
+      quelle indicate, nell'ordine delle dipendenze. Risponde immediatamente;
+      usare `/api/sync/status` o `/api/sync/events` per seguire l'avanzamento
+      e `/api/sync/cancel` per interromperla.
+    parameters:
+      - in: body
+        name: body
+        required: false
+        schema:
+          $ref: '#/definitions/SyncRequest'
     responses:
       202:
         description: Sincronizzazione avviata
@@ -266,6 +388,22 @@ def trigger_sync():
             message:
               type: string
               example: Sincronizzazione avviata
+            run_id:
+              type: integer
+            tables:
+              type: array
+              items:
+                type: string
+      400:
+        description: Tabelle sconosciute o body non valido
+        schema:
+          type: object
+          properties:
+            accepted:
+              type: boolean
+              example: false
+            message:
+              type: string
       409:
         description: Una sincronizzazione è già in corso
         schema:
@@ -278,15 +416,83 @@ def trigger_sync():
               type: string
               example: Sync già in corso
     """
-    if not _sync_lock.acquire(blocking=False):
-        return jsonify({'accepted': False, 'message': 'Sync già in corso'}), 409
-
-    _sync_status['running'] = True
-    t = threading.Thread(target=_run_sync_background, daemon=True, name='on-demand-sync')
+    from ..sync import progress as progress_tracking
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'accepted': False, 'message': 'Body JSON non valido'}), 400
+    tables, error = _requested_tables(data)
+    if error:
+        return jsonify({'accepted': False, 'message': error}), 400
+    force_full = bool(data.get('force_full', False))
+
+    with _sync_lock:
+        # Also covers the scheduler cycle, which sets the same flag
+        if _sync_status['running']:
+            return jsonify({'accepted': False, 'message': 'Sync già in corso'}), 409
+        _sync_status['running'] = True
+        progress = progress_tracking.start_run('api', tables, force_full)
+
+    t = threading.Thread(
+        target=_run_sync_background, args=(tables, force_full, progress), daemon=True, name='on-demand-sync'
+    )
     t.start()
-    _sync_lock.release()
 
-    return jsonify({'accepted': True, 'message': 'Sincronizzazione avviata'}), 202
+    return jsonify({
+        'accepted': True,
+        'message': 'Sincronizzazione avviata',
+        'run_id': progress.id,
+        'tables': tables,
+    }), 202
+
+
+@app.route('/api/sync/cancel', methods=['POST'])
+def cancel_sync():
+    """
+    Annulla la sincronizzazione in corso.
+    ---
+    tags:
+      - Sincronizzazione
+    summary: Annulla sync in corso
+    description: >
+      Vale per il sync on-demand e per il ciclo dello scheduler. Le tabelle in
+      corso si fermano al confine del batch successivo: la loro transazione
+      viene annullata (nessuna riga scritta, watermark invariato), mentre le
+      tabelle già completate restano committate. Le tabelle non ancora avviate
+      non partono.
+    responses:
+      202:
+        description: Annullamento richiesto
+        schema:
+          type: object
+          properties:
+            accepted:
+              type: boolean
+              example: true
+            message:
+              type: string
+              example: Annullamento richiesto
+            run_id:
+              type: integer
+      409:
+        description: Nessuna sincronizzazione in corso
+        schema:
+          type: object
+          properties:
+            accepted:
+              type: boolean
+              example: false
+            message:
+              type: string
+              example: Nessuna sincronizzazione in corso
+    """
+    from ..sync import progress as progress_tracking
+
+    progress = progress_tracking.latest()
+    if progress is None or not progress.cancel():
+        return jsonify({'accepted': False, 'message': 'Nessuna sincronizzazione in corso'}), 409
+    logger.info(f'Cancellation of sync run {progress.id} requested via API')
+    return jsonify({'accepted': True, 'message': 'Annullamento richiesto', 'run_id': progress.id}), 202
 
 
 @app.route('/api/sync/status', methods=['GET'])
@@ -303,12 +509,69 @@ def sync_status():
         schema:
           $ref: '#/definitions/SyncStatus'
     """
+    from ..sync import progress as progress_tracking
+
+    progress = progress_tracking.latest()
     return jsonify({
         'running': _sync_status['running'],
         'last_result': _sync_status['last_result'],
+        'progress': progress.snapshot() if progress is not None else None,
     }), 200
 
 
+def _progress_events(progress, keepalive: float):
+    """Server-sent events: one 'progress' event per update, until the run is finished."""
+    from ..sync import progress as progress_tracking
+
+    version = None
+    while True:
+        snapshot = progress.snapshot()
+        if snapshot['version'] != version:
+            version = snapshot['version']
+            yield f"event: progress\nid: {snapshot['id']}-{version}\ndata: {json.dumps(snapshot)}\n\n"
+        if snapshot['status'] != progress_tracking.RUNNING:
+            yield f"event: end\ndata: {json.dumps({'id': snapshot['id'], 'status': snapshot['status']})}\n\n"
+            return
+        if progress.wait(version, keepalive) == version:
+            # No update within the interval: comment line keeps proxies from closing the stream
+            yield ': keep-alive\n\n'
+
+
+@app.route('/api/sync/events', methods=['GET'])
+def sync_events():
+    """
+    Avanzamento in tempo reale della sincronizzazione (Server-Sent Events).
+    ---
+    tags:
+      - Sincronizzazione
+    summary: Stream avanzamento sync
+    description: >
+      Stream `text/event-stream`: un evento `progress` (JSON come `progress`
+      di `/api/sync/status`) a ogni aggiornamento, al più uno per batch per
+      tabella, e un evento `end` a esecuzione terminata. Se non c'è un sync in
+      corso invia lo stato dell'ultima esecuzione e chiude.
+    produces:
+      - text/event-stream
+    responses:
+      200:
+        description: Stream di eventi
+        schema:
+          $ref: '#/definitions/SyncProgress'
+      404:
+        description: Nessuna sincronizzazione eseguita dall'avvio del servizio
+    """
+    from ..sync import progress as progress_tracking
+
+    progress = progress_tracking.latest()
+    if progress is None:
+        return jsonify({'message': 'Nessuna sincronizzazione eseguita'}), 404
+    return Response(
+        stream_with_context(_progress_events(progress, SSE_KEEPALIVE_SECONDS)),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 @app.route('/api/reload-config', methods=['POST'])
 def reload_config():
     """
@@ -318,8 +581,8 @@ def reload_config():
       - Sistema
     summary: Ricarica configurazione
     description: >
-      Segnala al loop principale dello scheduler di ricaricare
-      l'intervallo di sincronizzazione dalla tabella `settings`.
+      Invalida la cache della tabella `settings` e sveglia subito il loop
+      principale dello scheduler, che ricarica l'intervallo di sincronizzazione.
     responses:
       200:
         description: Richiesta accettata
@@ -333,8 +596,9 @@ def reload_config():
               type: string
               example: Ricaricamento configurazione richiesto
     """
-    global _reload_requested
-    _reload_requested = True
+    from ..config.settings_cache import settings_cache
+    # Drops the cached settings and wakes the scheduler loop immediately
+    settings_cache.invalidate()
     logger.info('Reload config requested via API')
     return jsonify({'accepted': True, 'message': 'Ricaricamento configurazione richiesto'}), 200
 
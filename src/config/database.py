@@ -1,9 +1,16 @@
+import hashlib
 import os
+import threading
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 import logging
 
+from .settings import Settings
+from .settings_cache import SettingsCache, settings_cache
+
 logger = logging.getLogger(__name__)
 
 _SAP_SETTING_KEYS = [
@@ -138,44 +145,36 @@ def _load_mssql_url_from_env(prefix: str) -> str | None:
     )
 
 
+_url_settings_caches: dict = {}
+_url_settings_caches_lock = threading.Lock()
+
+
+def get_settings_cache(postgres_url: str | None = None) -> SettingsCache:
+    """Settings cache for postgres_url (the shared process cache for POSTGRES_URL)."""
+    if not postgres_url or postgres_url == settings_cache.postgres_url:
+        return settings_cache
+    with _url_settings_caches_lock:
+        cache = _url_settings_caches.get(postgres_url)
+        if cache is None:
+            cache = _url_settings_caches[postgres_url] = SettingsCache(postgres_url)
+        return cache
+
+
 def get_postgres_setting(key: str, default: str | None = None, postgres_url: str | None = None) -> str | None:
     """
-    Read a single value from the PostgreSQL settings table.
+    Read a single value from the PostgreSQL settings table (through the settings cache).
     Returns default if the key is not found or on error.
     """
-    try:
-        url = postgres_url or os.environ.get('POSTGRES_URL')
-        if not url:
-            return default
-        engine = create_engine(url)
-        with engine.connect() as conn:
-            row = conn.execute(
-                text("SELECT value FROM settings WHERE key = :key"),
-                {'key': key}
-            ).fetchone()
-        engine.dispose()
-        if row and row[0] is not None:
-            return str(row[0])
-    except Exception as e:
-        logger.warning(f'Could not read setting {key!r} from PostgreSQL: {e}')
-    return default
+    return get_settings_cache(postgres_url).get(key, default)
 
 
 def _load_sap_url_from_postgres(postgres_url: str) -> str | None:
     """
-    Query the PostgreSQL settings table for SAP credentials.
+    Read the SAP credentials from the PostgreSQL settings table (through the settings cache).
     Returns a complete SAP_DB_URL string or None if not configured.
     """
     try:
-        engine = create_engine(postgres_url)
-        with engine.connect() as conn:
-            rows = conn.execute(
-                text("SELECT key, value FROM settings WHERE key = ANY(:keys)"),
-                {'keys': _SAP_SETTING_KEYS}
-            ).fetchall()
-        engine.dispose()
-
-        settings = {row[0]: row[1] for row in rows}
+        settings = get_settings_cache(postgres_url).get_many(_SAP_SETTING_KEYS)
         server = settings.get('sap_db_server', '').strip()
         if not server:
             return None  # Not configured in DB
@@ -196,48 +195,125 @@ def _load_sap_url_from_postgres(postgres_url: str) -> str | None:
         return None
 
 
-class DatabaseConfig:
-    """Gestione configurazione e connessioni database"""
-
-    def __init__(self):
-        # Determina quale file .env caricare in base alla variabile ENV
-        env = os.getenv("ENV", "development")
-        env_file_map = {
-            "development": ".env",
-            "test": ".env.test",
-            "production": ".env.prod"
+class TimedQueuePool(QueuePool):
+    """QueuePool che misura il tempo di attesa per ottenere una connessione."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.wait_count += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def stats(self) -> dict:
+        """Statistiche correnti del pool."""
+        with self._stats_lock:
+            waits = {
+                'wait_count': self.wait_count,
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'wait_seconds_max': round(self.wait_seconds_max, 6),
+            }
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': max(0, self.overflow()),
+            **waits,
         }
 
-        env_file = env_file_map.get(env, ".env")
-        load_dotenv(env_file, encoding='utf-8-sig')
 
-        self.postgres_url = os.getenv("POSTGRES_URL")
-        self.environment = os.getenv("ENVIRONMENT", env)
+def _create_pooled_engine(url: str):
+    """Engine con pool dimensionato da Settings, pre-ping e recycle delle connessioni."""
+    return create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=Settings.get_db_pool_size(),
+        max_overflow=Settings.get_db_pool_max_overflow(),
+        pool_timeout=Settings.get_db_pool_timeout(),
+        pool_recycle=Settings.get_db_pool_recycle(),
+        pool_pre_ping=True,
+    )
 
-        # Try to read SAP connection from PostgreSQL settings table first
-        sap_url_from_db = None
-        if self.postgres_url:
-            sap_url_from_db = _load_sap_url_from_postgres(self.postgres_url)
 
-        if sap_url_from_db:
-            logger.info('SAP connection loaded from PostgreSQL settings table')
-            self.sap_db_url = sap_url_from_db
-        else:
-            logger.info('SAP connection loaded from .env file (fallback)')
-            self.sap_db_url = os.getenv("SAP_DB_URL")
+def _load_env_file() -> str:
+    """Carica il file .env dell'ambiente corrente (ENV). Restituisce il nome ambiente."""
+    env = os.getenv("ENV", "development")
+    env_file_map = {
+        "development": ".env",
+        "test": ".env.test",
+        "production": ".env.prod"
+    }
+
+    env_file = env_file_map.get(env, ".env")
+    load_dotenv(env_file, encoding='utf-8-sig')
+    return env
+
+
+def _resolve_database_urls() -> dict:
+    """Risolve gli URL di tutte le connessioni (.env + credenziali SAP da settings in cache)."""
+    env = _load_env_file()
+    postgres_url = os.getenv("POSTGRES_URL")
+
+    # Try to read SAP connection from PostgreSQL settings table first
+    sap_url_from_db = None
+    if postgres_url:
+        sap_url_from_db = _load_sap_url_from_postgres(postgres_url)
+
+    if sap_url_from_db:
+        logger.info('SAP connection loaded from PostgreSQL settings table')
+        sap_db_url = sap_url_from_db
+    else:
+        logger.info('SAP connection loaded from .env file (fallback)')
+        sap_db_url = os.getenv("SAP_DB_URL")
+
+    return {
+        'environment': os.getenv("ENVIRONMENT", env),
+        'postgres': postgres_url,
+        'sap': sap_db_url,
+        'deposyta': _load_mssql_url_from_env('DEPOSYTA'),
+        'modula': _load_mssql_url_from_env('MODULA'),
+    }
+
+
+def _urls_fingerprint(urls: dict) -> str:
+    """Impronta delle credenziali: cambia solo se cambia almeno un URL."""
+    payload = '\n'.join(f'{key}={urls.get(key) or ""}' for key in ('postgres', 'sap', 'deposyta', 'modula'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
-        self.deposyta_db_url = _load_mssql_url_from_env('DEPOSYTA')
-        self.modula_db_url = _load_mssql_url_from_env('MODULA')
+
+class DatabaseConfig:
+    """Gestione configurazione e connessioni database"""
+
+    def __init__(self, urls: dict | None = None):
+        urls = urls or _resolve_database_urls()
+        self.fingerprint = _urls_fingerprint(urls)
+
+        self.postgres_url = urls['postgres']
+        self.environment = urls['environment']
+        self.sap_db_url = urls['sap']
+        self.deposyta_db_url = urls['deposyta']
+        self.modula_db_url = urls['modula']
 
         # Crea engines
-        self.pg_engine = create_engine(self.postgres_url)
-        self.sap_engine = create_engine(self.sap_db_url)
+        self.pg_engine = _create_pooled_engine(self.postgres_url)
+        self.sap_engine = _create_pooled_engine(self.sap_db_url)
 
         self.deposyta_engine = (
-            create_engine(self.deposyta_db_url) if self.deposyta_db_url else None
+            _create_pooled_engine(self.deposyta_db_url) if self.deposyta_db_url else None
         )
         self.modula_engine = (
-            create_engine(self.modula_db_url) if self.modula_db_url else None
+            _create_pooled_engine(self.modula_db_url) if self.modula_db_url else None
         )
 
         # Crea session makers
@@ -262,6 +338,28 @@ class DatabaseConfig:
 
         print(f"Loaded configuration for environment: {self.environment}")
 
+    def _engines(self) -> dict:
+        return {
+            'postgres': self.pg_engine,
+            'sap': self.sap_engine,
+            'deposyta': self.deposyta_engine,
+            'modula': self.modula_engine,
+        }
+
+    def pool_stats(self) -> dict:
+        """Statistiche dei pool per connessione (checked out, overflow, attese)."""
+        return {
+            name: engine.pool.stats()
+            for name, engine in self._engines().items()
+            if engine is not None and isinstance(engine.pool, TimedQueuePool)
+        }
+
+    def dispose(self) -> None:
+        """Chiude le connessioni inattive di tutti i pool (quelle in uso vengono scartate al rilascio)."""
+        for engine in self._engines().values():
+            if engine is not None:
+                engine.dispose()
+
     def get_pg_session(self):
         """Ottieni una nuova sessione PostgreSQL"""
         return self.PGSession()
@@ -288,3 +386,58 @@ class DatabaseConfig:
             )
         return self.ModulaSession()
 
+
+
+# ─── Registry condiviso ──────────────────────────────────────────────────────
+# Una sola DatabaseConfig (e quindi un solo set di pool) per processo: gli
+# engine vengono ricreati solo se cambiano le credenziali (impronta degli URL).
+
+_registry_lock = threading.Lock()
+_shared_config: DatabaseConfig | None = None
+
+
+def get_database_config() -> DatabaseConfig:
+    """DatabaseConfig condivisa del processo, creata al primo utilizzo (thread-safe)."""
+    global _shared_config
+    config = _shared_config
+    if config is None:
+        with _registry_lock:
+            if _shared_config is None:
+                _shared_config = DatabaseConfig()
+            config = _shared_config
+    return config
+
+
+def refresh_database_config() -> DatabaseConfig:
+    """
+    Rilegge .env e credenziali SAP da settings; se l'impronta è cambiata crea
+    nuovi engine e chiude quelli precedenti, altrimenti mantiene i pool esistenti.
+    """
+    global _shared_config
+    previous = None
+    with _registry_lock:
+        current = _shared_config
+        urls = _resolve_database_urls()
+        if current is not None and current.fingerprint == _urls_fingerprint(urls):
+            return current
+        if current is not None:
+            logger.info('Database credentials changed: rebuilding connection pools')
+        previous = current
+        _shared_config = DatabaseConfig(urls)
+        config = _shared_config
+    if previous is not None:
+        previous.dispose()
+    return config
+
+
+def get_pool_stats() -> dict:
+    """Statistiche dei pool condivisi ({} se la configurazione non è ancora stata creata)."""
+    config = _shared_config
+    return config.pool_stats() if config is not None else {}
+
+
+def set_database_config(config: DatabaseConfig | None) -> None:
+    """Imposta (o azzera con None) la DatabaseConfig condivisa, es. per i test."""
+    global _shared_config
+    with _registry_lock:
+        _shared_config = config
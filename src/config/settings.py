@@ -9,6 +9,17 @@ class Settings:
     DEFAULT_BATCH_SIZE = 5000
     MAX_RETRIES = 3
     RETRY_DELAY_SECONDS = 5
+    DEFAULT_PIPELINE_QUEUE_SIZE = 4
+    DEFAULT_SHADOW_SWAP_LOCK_TIMEOUT_MS = 2000
+    DEFAULT_SHADOW_SWAP_RETRIES = 5
+    DEFAULT_SYNC_MAX_WORKERS = 3
+    DEFAULT_DB_POOL_SIZE = 5
+    DEFAULT_DB_POOL_MAX_OVERFLOW = 5
+    DEFAULT_DB_POOL_TIMEOUT = 30
+    DEFAULT_DB_POOL_RECYCLE = 1800
+    DEFAULT_SETTINGS_CACHE_TTL = 300
+    DEFAULT_CLEANUP_FULL_SWEEP_HOURS = 24
+    DEFAULT_HEADER_DELTA_FULL_RELOAD_HOURS = 24
     
     # Configurazioni logging
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -31,6 +42,73 @@ class Settings:
         """Ottieni numero massimo retry da env o default"""
         return int(os.getenv("MAX_RETRIES", cls.MAX_RETRIES))
     
+    @classmethod
+    def is_pipeline_enabled(cls) -> bool:
+        """Abilita la pipeline lettura SAP / trasformazione / scrittura PG su thread separati"""
+        return os.getenv("SYNC_PIPELINE", "false").lower() == "true"
+
+    @classmethod
+    def is_profiler_enabled(cls) -> bool:
+        """Profilo per stadio dei cicli salvato in sap.sync_runs / sap.sync_run_stages"""
+        return os.getenv("SYNC_PROFILER", "false").lower() == "true"
+
+    @classmethod
+    def get_pipeline_queue_size(cls) -> int:
+        """Numero massimo di blocchi in coda tra due stadi della pipeline"""
+        return max(1, int(os.getenv("SYNC_PIPELINE_QUEUE_SIZE", cls.DEFAULT_PIPELINE_QUEUE_SIZE)))
+
+    @classmethod
+    def get_sync_max_workers(cls) -> int:
+        """Thread dello scheduler a grafo (nodi eseguiti in parallelo)"""
+        return max(1, int(os.getenv("SYNC_MAX_WORKERS", cls.DEFAULT_SYNC_MAX_WORKERS)))
+
+    @classmethod
+    def get_db_pool_size(cls) -> int:
+        """Connessioni persistenti per pool (una per engine: PG, SAP, DEPOSYTA, MODULA)"""
+        return max(1, int(os.getenv("DB_POOL_SIZE", cls.DEFAULT_DB_POOL_SIZE)))
+
+    @classmethod
+    def get_db_pool_max_overflow(cls) -> int:
+        """Connessioni aggiuntive temporanee oltre DB_POOL_SIZE"""
+        return max(0, int(os.getenv("DB_POOL_MAX_OVERFLOW", cls.DEFAULT_DB_POOL_MAX_OVERFLOW)))
+
+    @classmethod
+    def get_db_pool_timeout(cls) -> int:
+        """Secondi di attesa massima per una connessione libera"""
+        return max(1, int(os.getenv("DB_POOL_TIMEOUT", cls.DEFAULT_DB_POOL_TIMEOUT)))
+
+    @classmethod
+    def get_db_pool_recycle(cls) -> int:
+        """Età massima (secondi) di una connessione prima di essere riaperta"""
+        return int(os.getenv("DB_POOL_RECYCLE", cls.DEFAULT_DB_POOL_RECYCLE))
+
+    @classmethod
+    def get_settings_cache_ttl(cls) -> int:
+        """Secondi dopo cui la cache della tabella settings viene comunque riletta (0 = mai)"""
+        return max(0, int(os.getenv("SETTINGS_CACHE_TTL", cls.DEFAULT_SETTINGS_CACHE_TTL)))
+
+    @classmethod
+    def get_shadow_swap_lock_timeout_ms(cls) -> int:
+        """lock_timeout (ms) di ogni tentativo di swap della tabella ombra"""
+        return max(1, int(os.getenv("SHADOW_SWAP_LOCK_TIMEOUT_MS", cls.DEFAULT_SHADOW_SWAP_LOCK_TIMEOUT_MS)))
+
+    @classmethod
+    def get_shadow_swap_retries(cls) -> int:
+        """Tentativi di swap prima di ripiegare su TRUNCATE + copia"""
+        return max(1, int(os.getenv("SHADOW_SWAP_RETRIES", cls.DEFAULT_SHADOW_SWAP_RETRIES)))
+
+    @classmethod
+    def get_cleanup_full_sweep_hours(cls) -> float:
+        """Ore tra due scansioni complete del cleanup orfani (negli altri cicli solo documenti toccati)"""
+        return max(0.0, float(os.getenv("CLEANUP_FULL_SWEEP_HOURS", cls.DEFAULT_CLEANUP_FULL_SWEEP_HOURS)))
+
+    @classmethod
+    def get_header_delta_full_reload_hours(cls) -> float:
+        """Ore tra due ricaricamenti completi delle righe HEADER_DELTA (negli altri cicli solo documenti modificati)"""
+        return max(0.0, float(os.getenv(
+            "HEADER_DELTA_FULL_RELOAD_HOURS", cls.DEFAULT_HEADER_DELTA_FULL_RELOAD_HOURS
+        )))
+    
     @classmethod
     def ensure_log_directory(cls) -> Path:
         """Assicura che la directory dei log esista"""
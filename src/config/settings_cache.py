@@ -0,0 +1,158 @@
+"""
+Cache in-process della tabella `settings` di PostgreSQL.
+
+Tutte le chiavi vengono caricate con una sola query e le letture successive
+sono lookup su dict. La cache viene invalidata:
+- da NOTIFY sul canale `settings_changed` (trigger della migrazione 008),
+  ascoltato da un thread dedicato con LISTEN;
+- da /api/reload-config (invalidate());
+- in ultima istanza dopo SETTINGS_CACHE_TTL secondi (es. trigger non installato).
+
+Ogni invalidazione segnala l'evento `changed`, su cui lo scheduler attende
+invece di controllare periodicamente la configurazione.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import select
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from .settings import Settings
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'settings_changed'
+
+
+class SettingsCache:
+    """Snapshot della tabella settings, ricaricato dopo ogni invalidazione."""
+
+    def __init__(self, postgres_url: Optional[str] = None, ttl: Optional[float] = None):
+        self._postgres_url = postgres_url
+        self.ttl = Settings.get_settings_cache_ttl() if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._values: Optional[Dict[str, Optional[str]]] = None
+        self._loaded_at = 0.0
+        self._engine = None
+        self._engine_url: Optional[str] = None
+        self._listener: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.changed = threading.Event()
+
+    @property
+    def postgres_url(self) -> Optional[str]:
+        return self._postgres_url or os.environ.get('POSTGRES_URL')
+
+    def _get_engine(self):
+        url = self.postgres_url
+        if self._engine is None or self._engine_url != url:
+            if self._engine is not None:
+                self._engine.dispose()
+            self._engine = create_engine(url, pool_size=1, max_overflow=1, pool_pre_ping=True)
+            self._engine_url = url
+        return self._engine
+
+    def _snapshot(self) -> Dict[str, Optional[str]]:
+        with self._lock:
+            expired = self.ttl and time.monotonic() - self._loaded_at > self.ttl
+            if self._values is None or expired:
+                with self._get_engine().connect() as conn:
+                    rows = conn.execute(text("SELECT key, value FROM settings")).fetchall()
+                self._values = {row[0]: None if row[1] is None else str(row[1]) for row in rows}
+                self._loaded_at = time.monotonic()
+            return self._values
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Valore di una chiave (default se assente, NULL o database non raggiungibile)."""
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Valori non NULL delle chiavi richieste presenti in settings."""
+        keys = list(keys)
+        if not self.postgres_url:
+            return {}
+        try:
+            values = self._snapshot()
+        except Exception as e:
+            logger.warning(f'Could not read settings {keys!r} from PostgreSQL: {e}')
+            return {}
+        return {key: values[key] for key in keys if values.get(key) is not None}
+
+    def invalidate(self) -> None:
+        """Scarta lo snapshot (riletto alla prossima lettura) e segnala il cambiamento."""
+        with self._lock:
+            self._values = None
+        self.changed.set()
+
+    def wake(self) -> None:
+        """Sveglia chi attende su wait_for_change senza invalidare (es. shutdown)."""
+        self.changed.set()
+
+    def wait_for_change(self, timeout: Optional[float] = None) -> bool:
+        """Attende un'invalidazione (o wake) per al più `timeout` secondi. True se avvenuta."""
+        if self.changed.wait(timeout):
+            self.changed.clear()
+            return True
+        return False
+
+    # ─── LISTEN/NOTIFY ───────────────────────────────────────────────────────
+
+    def start_listener(self) -> None:
+        """Avvia (una volta) il thread che ascolta NOTIFY settings_changed."""
+        if self._listener is not None and self._listener.is_alive():
+            return
+        self._stop.clear()
+        self._listener = threading.Thread(target=self._listen_loop, daemon=True, name='settings-listener')
+        self._listener.start()
+
+    def stop_listener(self) -> None:
+        self._stop.set()
+
+    def _listen_loop(self) -> None:
+        delay = 1.0
+        while not self._stop.is_set():
+            if not self.postgres_url:
+                # .env non ancora caricato (lo carica la prima DatabaseConfig)
+                self._stop.wait(delay)
+                continue
+            engine = create_engine(self.postgres_url, poolclass=NullPool)
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                connection = raw.driver_connection
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+                logger.info(f'Listening for settings changes on channel {NOTIFY_CHANNEL!r}')
+                # Notifiche perse durante la (ri)connessione: rileggi comunque
+                self.invalidate()
+                delay = 1.0
+                while not self._stop.is_set():
+                    if select.select([connection], [], [], 5.0) == ([], [], []):
+                        continue
+                    connection.poll()
+                    if connection.notifies:
+                        connection.notifies.clear()
+                        logger.info('Settings changed (NOTIFY): cache invalidated')
+                        self.invalidate()
+            except Exception as e:
+                logger.warning(f'Settings listener error, retry in {delay:.0f}s: {e}')
+                self._stop.wait(delay)
+                delay = min(delay * 2, 60.0)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+                engine.dispose()
+
+
+# Cache condivisa dal processo (scheduler, API, DatabaseConfig)
+settings_cache = SettingsCache()
@@ -1,13 +1,16 @@
-from .base import SyncStrategy, TableMapping
+from .base import LoadMethod, SyncStrategy, TableMapping
 from ..models.anagrafica_articoli import SAP_AnagraficheArticoli
 from ..utils.transformers import safe_datetime, safe_string, safe_float, safe_int
-from typing import Dict, Any, Optional, Set
+from typing import Dict, Any, List, Optional, Set
 from sqlalchemy import text
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 _sap_item_codes: Optional[Set[str]] = None
+# ItemCode scritti dal sync in corso (batch_callback), per il bootstrap magazzino incrementale
+_touched_item_codes: Set[str] = set()
 _debug_art_eq_stats: Dict[str, Any] = {
     "raw_nonempty": 0,
     "sanitized_ok": 0,
@@ -40,6 +43,7 @@ def _pre_sync_articoli(sap_session) -> None:
         "rejected_samples": [],
     }
     _reset_sap_item_codes_cache()
+    _touched_item_codes.clear()
     codes = _load_sap_item_codes(sap_session)
     # #region agent log
     from ..utils.debug_session_log import debug_log
@@ -120,8 +124,11 @@ def _post_transform_articoli(row: Dict[str, Any]) -> Dict[str, Any]:
     return row
 
 
-def _post_sync_articoli(pg_session, rows):
-    """Callback post-sync: associazioni macchina + bootstrap magazzino + stock DEPOSYTA e MODULA."""
+def _post_sync_articoli(pg_session, total_records, full_sync=True):
+    """
+    Callback post-sync: bootstrap magazzino + stock DEPOSYTA e MODULA.
+    Con sync delta il bootstrap riguarda solo gli articoli toccati dal ciclo.
+    """
     # #region agent log
     from ..utils.debug_session_log import debug_log
     pg_stats = pg_session.execute(
@@ -138,7 +145,7 @@ def _post_sync_articoli(pg_session, rows):
         "anagrafica_articoli.py:_post_sync_articoli",
         "art_equivalente sync stats",
         {
-            "delta_rows_processed": len(rows),
+            "delta_rows_processed": total_records,
             **_debug_art_eq_stats,
             "pg_total": int(pg_stats["total"] or 0),
             "pg_with_art_equivalente": int(pg_stats["with_art_eq"] or 0),
@@ -146,46 +153,99 @@ def _post_sync_articoli(pg_session, rows):
         hypothesis_id="H2,H4,H5",
     )
     # #endregion
-    _sync_assoc_articoli_macchina(pg_session, rows)
-    from ..config.database import DatabaseConfig
+    from ..config.database import get_database_config
     from ..sync.magazzino_bootstrap import bootstrap_magazzino_from_sap
     from ..sync.deposyta_enrichment import enrich_deposita_stock
     from ..sync.modula_enrichment import enrich_modula_stock
+    from ..sync.profiler import current
 
-    bootstrap_magazzino_from_sap(pg_session)
-    db_config = DatabaseConfig()
-    enrich_deposita_stock(pg_session, db_config)
-    enrich_modula_stock(pg_session, db_config)
+    profile = current()
+    with profile.stage('bootstrap_magazzino'):
+        bootstrap_magazzino_from_sap(pg_session, None if full_sync else sorted(_touched_item_codes))
+    _touched_item_codes.clear()
+    db_config = get_database_config()
+    with profile.stage('deposyta_enrichment'):
+        enrich_deposita_stock(pg_session, db_config)
+    with profile.stage('modula_enrichment'):
+        enrich_modula_stock(pg_session, db_config)
 
 
-def _sync_assoc_articoli_macchina(pg_session, rows):
+# Diff set-based delle coppie (articolo, macchina) degli articoli del blocco:
+# le coppie arrivano come due array paralleli (unnest), una sola query per DELETE e INSERT.
+_ASSOC_MACCHINA_DELETE_SQL = """
+DELETE FROM sap.assoc_articoli_macchina a
+WHERE a.id_articolo = ANY(CAST(:articoli AS text[]))
+  AND NOT EXISTS (
+      SELECT 1
+      FROM unnest(CAST(:pair_articoli AS text[]), CAST(:pair_macchine AS text[])) AS p(id_articolo, id_macchina)
+      WHERE p.id_articolo = a.id_articolo
+        AND p.id_macchina = a.id_macchina
+  )
+"""
+
+_ASSOC_MACCHINA_INSERT_SQL = """
+INSERT INTO sap.assoc_articoli_macchina (id_articolo, id_macchina)
+SELECT p.id_articolo, p.id_macchina
+FROM unnest(CAST(:pair_articoli AS text[]), CAST(:pair_macchine AS text[])) AS p(id_articolo, id_macchina)
+ON CONFLICT DO NOTHING
+"""
+
+
+def _parse_assoc_articoli_macchina(rows) -> Dict[str, List[str]]:
     """
-    Per ogni articolo nei raw SAP rows, aggiorna sap.assoc_articoli_macchina
-    splittando U_FamigliaLEV2 per '-'.
-    Usa DELETE + INSERT per articolo per supportare sia sync completo che delta.
+    Codici macchina per articolo, da U_FamigliaLEV2 splittato per '-'.
+    Gli articoli senza macchine restano con lista vuota (le coppie esistenti vanno rimosse);
+    se un articolo compare più volte vale l'ultima riga, come con DELETE + INSERT in sequenza.
     """
+    machines_by_item: Dict[str, List[str]] = {}
     for row in rows:
-        row_dict = dict(row._mapping)
-        item_code = row_dict.get("ItemCode")
+        row_map = row._mapping
+        item_code = row_map.get("ItemCode")
         if not item_code:
             continue
-        pg_session.execute(
-            text("DELETE FROM sap.assoc_articoli_macchina WHERE id_articolo = :id"),
-            {"id": item_code}
-        )
-        macchina_raw = row_dict.get("U_FamigliaLEV2")
+        machines: List[str] = []
+        macchina_raw = row_map.get("U_FamigliaLEV2")
         if macchina_raw and str(macchina_raw).strip():
             for m in str(macchina_raw).split('-'):
                 m = m.strip()
-                if m:
-                    pg_session.execute(
-                        text(
-                            "INSERT INTO sap.assoc_articoli_macchina (id_articolo, id_macchina) "
-                            "VALUES (:id_articolo, :id_macchina) ON CONFLICT DO NOTHING"
-                        ),
-                        {"id_articolo": item_code, "id_macchina": m}
-                    )
-    pg_session.flush()
+                if m and m not in machines:
+                    machines.append(m)
+        machines_by_item[item_code] = machines
+    return machines_by_item
+
+
+def _articoli_batch_callback(pg_session, rows):
+    """batch_callback: registra gli articoli toccati dal sync e allinea sap.assoc_articoli_macchina."""
+    for row in rows:
+        item_code = row._mapping.get("ItemCode")
+        if item_code:
+            _touched_item_codes.add(item_code)
+    _sync_assoc_articoli_macchina(pg_session, rows)
+
+
+def _sync_assoc_articoli_macchina(pg_session, rows):
+    """
+    Per gli articoli nel blocco di raw SAP rows, allinea sap.assoc_articoli_macchina
+    alle macchine di U_FamigliaLEV2 (split per '-'): un DELETE delle coppie non più
+    presenti e un INSERT delle nuove, limitati agli articoli del blocco.
+    Invocata come batch_callback dopo la scrittura di ogni blocco (FK verso anagrafica).
+    """
+    start = time.time()
+    machines_by_item = _parse_assoc_articoli_macchina(rows)
+    if not machines_by_item:
+        return
+    pairs = [(item, m) for item, machines in machines_by_item.items() for m in machines]
+    params = {
+        "articoli": list(machines_by_item),
+        "pair_articoli": [item for item, _ in pairs],
+        "pair_macchine": [m for _, m in pairs],
+    }
+    deleted = pg_session.execute(text(_ASSOC_MACCHINA_DELETE_SQL), params).rowcount
+    inserted = pg_session.execute(text(_ASSOC_MACCHINA_INSERT_SQL), params).rowcount
+    logger.info(
+        f"assoc_articoli_macchina: {len(machines_by_item)} articoli, {len(pairs)} coppie, "
+        f"{deleted} rimosse, {inserted} inserite in {time.time() - start:.2f}s"
+    )
 
 # Query su OITM (articoli).
 _ANAGRAFICA_ARTICOLI_QUERY = """
@@ -255,9 +315,12 @@ MAPPING_ANAGRAFICHE_ARTICOLI = TableMapping(
     },
     primary_key_sap="ItemCode",
     sync_strategy=SyncStrategy.UPSERT,
+    load_method=LoadMethod.COPY,
+    skip_unchanged=True,
     sap_query=_ANAGRAFICA_ARTICOLI_QUERY,
     sap_timestamp_prefix="o",
     pre_sync_callback=_pre_sync_articoli,
     post_transform=_post_transform_articoli,
     post_sync_callback=_post_sync_articoli,
+    batch_callback=_articoli_batch_callback,
 )
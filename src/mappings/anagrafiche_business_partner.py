@@ -1,5 +1,5 @@
 
-from .base import SyncStrategy, TableMapping
+from .base import LoadMethod, SyncStrategy, TableMapping
 from ..models.anagrafiche_business_partner import SAP_AnagraficheBusinessPartner
 from ..utils.transformers import safe_datetime, safe_string
 
@@ -21,5 +21,7 @@ MAPPING_ANAGRAFICHE_BUSINESS_PARTNER = TableMapping(
         "email": safe_string
     },
     primary_key_sap="CardCode",
-    sync_strategy=SyncStrategy.UPSERT
+    sync_strategy=SyncStrategy.UPSERT,
+    load_method=LoadMethod.COPY,
+    skip_unchanged=True,
 )
\ No newline at end of file
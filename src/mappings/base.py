@@ -1,11 +1,36 @@
-from typing import Dict, Any, Callable, Optional, Union, List
+from typing import Dict, Any, Callable, Optional, Sequence, Union, List
 from enum import Enum
-from ..utils.transformers import transform_sap_timestamp
+from datetime import date, datetime
+from ..utils.transformers import (
+    parse_update_ts,
+    safe_date,
+    safe_datetime,
+    safe_float,
+    safe_int,
+    safe_string,
+    transform_sap_timestamp,
+)
+
+# Trasformazioni che restituiscono il valore invariato quando è già del tipo
+# dichiarato dal driver (cursor.description): per quei tipi si salta la chiamata.
+_IDENTITY_TYPES = {
+    safe_string: (str,),
+    safe_float: (float,),
+    safe_int: (int,),
+    safe_datetime: (datetime, date),
+    safe_date: (date,),
+}
 
 class SyncStrategy(Enum):
     """Strategie di sincronizzazione disponibili"""
     UPSERT = "upsert"          # Aggiorna/inserisce (default)
     TRUNCATE_INSERT = "truncate_insert"  # Svuota e riempi
+    HEADER_DELTA = "header_delta"  # Righe documento: riscrive solo i documenti con testata modificata
+
+class LoadMethod(Enum):
+    """Modalità di scrittura dei batch su PostgreSQL"""
+    INSERT = "insert"  # INSERT multi-VALUES (default)
+    COPY = "copy"      # COPY FROM STDIN in staging + INSERT ... SELECT
 
 class TableMapping:
     """Gestisce il mapping tra tabelle SAP e modelli PostgreSQL"""
@@ -14,29 +39,71 @@ class TableMapping:
                  transformations: Optional[Dict[str, Callable]] = None,
                  primary_key_sap: Union[str, List[str]] = "ItemCode",
                  sync_strategy: SyncStrategy = SyncStrategy.UPSERT,
+                 load_method: LoadMethod = LoadMethod.INSERT,
+                 shadow_swap: bool = False,
+                 skip_unchanged: bool = False,
+                 depends_on: Optional[List[str]] = None,
                  sap_query: Optional[str] = None,
                  sap_timestamp_prefix: Optional[str] = None,
+                 header_query: Optional[str] = None,
+                 document_column: Optional[str] = None,
+                 document_filter: Optional[str] = None,
+                 reference_column: Optional[str] = None,
+                 change_probe: Optional[str] = None,
                  post_transform: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
                  post_sync_callback: Optional[Callable] = None,
                  pre_sync_callback: Optional[Callable] = None,
-                 pre_process_callback: Optional[Callable] = None):
+                 pre_process_callback: Optional[Callable] = None,
+                 batch_callback: Optional[Callable] = None):
         self.sap_table = sap_table
         self.pg_model = pg_model
         self.column_mappings = column_mappings  # sap_column -> pg_column
         self.transformations = transformations or {}
         self.sync_strategy = sync_strategy
+        # Modalità di scrittura dei batch (INSERT multi-VALUES o COPY via staging).
+        self.load_method = load_method
+        # TRUNCATE_INSERT (e ricaricamento completo HEADER_DELTA): carica in una tabella ombra e la scambia con l'originale
+        # a fine caricamento, invece di TRUNCATE (lettori bloccati solo durante lo swap).
+        self.shadow_swap = shadow_swap
+        # Solo UPSERT: su conflitto riscrive la riga solo se le colonne del payload
+        # sono cambiate (ON CONFLICT DO UPDATE ... WHERE ... IS DISTINCT FROM ...).
+        self.skip_unchanged = skip_unchanged
+        # Tabelle (nomi registry) da sincronizzare prima di questa nel ciclo a grafo.
+        self.depends_on = list(depends_on or [])
         # Query SQL custom (per JOIN multi-tabella). Se None, la query viene costruita automaticamente.
         self.sap_query = sap_query
         # Prefisso alias tabella per le colonne timestamp (UpdateDate, UpdateTS) nella query custom.
         self.sap_timestamp_prefix = sap_timestamp_prefix
+        # Solo HEADER_DELTA: query sulle testate della finestra che restituisce
+        # (id documento, UpdateDate, UpdateTS), colonna PG dell'id documento nelle righe
+        # ed espressione SAP dell'id documento in sap_query (filtro IN sui documenti modificati).
+        # document_column è ammessa anche per UPSERT: nei sync delta il motore registra
+        # i documenti scritti (SyncEngine.touched_documents) per il cleanup incrementale.
+        self.header_query = header_query
+        self.document_column = document_column
+        self.document_filter = document_filter
+        if sync_strategy == SyncStrategy.HEADER_DELTA and not (header_query and document_column and document_filter):
+            raise ValueError("HEADER_DELTA richiede header_query, document_column e document_filter")
+        # Colonna PG che referenzia un documento di un'altra tabella (es. l'ordine d'acquisto nelle
+        # righe entrata merci): i valori delle righe rimosse nel ciclo (documenti modificati, fuori
+        # finestra, orfane dello shadow swap della testata) vengono registrati in
+        # SyncEngine.released_references per il cleanup incrementale dei documenti referenziati.
+        self.reference_column = reference_column
+        # Query SAP economica (una riga di aggregati, es. COUNT_BIG + CHECKSUM_AGG sulle colonne
+        # sincronizzate) eseguita prima dell'estrazione: se la sua impronta coincide con quella
+        # salvata in sap.sync_state dall'ultimo sync senza errori, la tabella viene saltata.
+        self.change_probe = change_probe
         # Funzione opzionale di post-trasformazione: riceve la riga già mappata e la modifica.
         self.post_transform = post_transform
-        # Callback opzionale eseguita dopo il sync: riceve (pg_session, raw_sap_rows).
+        # Callback opzionale eseguita dopo il sync: riceve (pg_session, totale_righe_estratte, full_sync),
+        # full_sync=True se il ciclo ha letto tutte le righe (primo avvio, force_full, truncate).
         self.post_sync_callback = post_sync_callback
         # Callback opzionale eseguita prima del processing righe: riceve sap_session.
         self.pre_sync_callback = pre_sync_callback
         # Callback opzionale dopo truncate e prima del processing: riceve pg_session.
         self.pre_process_callback = pre_process_callback
+        # Callback opzionale dopo la scrittura di ogni blocco: riceve (pg_session, raw_sap_rows del blocco).
+        self.batch_callback = batch_callback
         # Normalizza primary_key_sap come lista
         if isinstance(primary_key_sap, str):
             self.primary_key_sap = [primary_key_sap]
@@ -55,6 +122,22 @@ class TableMapping:
         """Verifica se questa tabella richiede il truncate prima dell'inserimento"""
         return self.sync_strategy == SyncStrategy.TRUNCATE_INSERT
     
+    def uses_copy(self) -> bool:
+        """Verifica se i batch vanno caricati con COPY invece che con INSERT multi-VALUES"""
+        return self.load_method == LoadMethod.COPY
+
+    def uses_header_delta(self) -> bool:
+        """Verifica se le righe vengono sincronizzate per documento a partire dalle testate modificate"""
+        return self.sync_strategy == SyncStrategy.HEADER_DELTA
+
+    def inserts_only(self) -> bool:
+        """Verifica se i batch vengono scritti con INSERT (righe già rimosse) invece che con upsert"""
+        return self.sync_strategy in (SyncStrategy.TRUNCATE_INSERT, SyncStrategy.HEADER_DELTA)
+
+    def uses_shadow_swap(self) -> bool:
+        """Verifica se il ricaricamento completo passa da tabella ombra + swap"""
+        return self.inserts_only() and self.shadow_swap
+
     def transform_row(self, sap_row: Dict[str, Any]) -> Dict[str, Any]:
         """Trasforma una riga SAP in formato PostgreSQL"""
         pg_data = {}
@@ -87,3 +170,60 @@ class TableMapping:
         pg_data = {k: v for k, v in pg_data.items() if not k.startswith('_')}
 
         return pg_data
+
+    def compile_transformer(self, columns: Sequence[str], description: Optional[Sequence] = None) -> Callable:
+        """
+        Compila transform_row per un result set con le colonne `columns` (in ordine).
+        Restituisce una funzione riga (tupla/Row) -> dict con output identico a
+        transform_row, ma con posizioni delle colonne risolte una volta per query.
+        Se `description` (cursor.description DB-API) riporta il tipo Python della
+        colonna, le trasformazioni safe_* vengono saltate per i valori già di quel tipo.
+        """
+        # Stesse regole di transform_row: lookup case-insensitive, a parità vince l'ultima
+        index_ci = {name.lower(): i for i, name in enumerate(columns)}
+        index_exact = {name: i for i, name in enumerate(columns)}
+        type_codes = [entry[1] for entry in description] if description else []
+
+        namespace: Dict[str, Any] = {'parse_update_ts': parse_update_ts, 'post_transform': self.post_transform}
+        lines = ['def transform(row):']
+        items = []
+        for n, (sap_col, pg_col) in enumerate(self.column_mappings.items()):
+            idx = index_ci.get(sap_col.lower())
+            if idx is None:
+                continue
+            if pg_col.startswith('_') and not self.post_transform:
+                continue
+            var = f'v{n}'
+            lines.append(f'    {var} = row[{idx}]')
+            converter = self.transformations.get(pg_col)
+            if converter is not None:
+                namespace[f'c{n}'] = converter
+                type_code = type_codes[idx] if idx < len(type_codes) else None
+                if type_code in _IDENTITY_TYPES.get(converter, ()):
+                    namespace[f't{n}'] = type_code
+                    lines.append(f'    if {var}.__class__ is not t{n}: {var} = c{n}({var})')
+                else:
+                    lines.append(f'    {var} = c{n}({var})')
+            items.append(f'{pg_col!r}: {var}')
+        lines.append('    pg_data = {' + ', '.join(items) + '}')
+
+        mapped_pg_columns = list(self.column_mappings.values())
+        if '_update_date' in mapped_pg_columns and '_update_ts' in mapped_pg_columns:
+            # Come transform_sap_timestamp: legge UpdateDate/UpdateTS grezzi dalla riga
+            ts_args = []
+            for sap_col in ('UpdateDate', 'UpdateTS'):
+                if sap_col in self.column_mappings:
+                    idx = index_ci.get(sap_col.lower())
+                else:
+                    idx = index_exact.get(sap_col)
+                ts_args.append('None' if idx is None else f'row[{idx}]')
+            lines.append(f"    pg_data['last_synced_at'] = parse_update_ts({ts_args[0]}, {ts_args[1]})")
+
+        if self.post_transform:
+            lines.append('    pg_data = post_transform(pg_data)')
+            lines.append("    return {k: v for k, v in pg_data.items() if not k.startswith('_')}")
+        else:
+            lines.append('    return pg_data')
+
+        exec(compile('\n'.join(lines), f'<transform {self.sap_table}>', 'exec'), namespace)
+        return namespace['transform']
@@ -1,5 +1,5 @@
 from ..models.catalogo_business_partner import SAP_CatalogoBusinessPartner
-from .base import SyncStrategy, TableMapping
+from .base import LoadMethod, SyncStrategy, TableMapping
 from ..utils.transformers import safe_float, safe_string
 
 
@@ -21,6 +21,16 @@ OUTER APPLY (
 ) sp
 """.strip()
 
+# Sonda di modifica: conteggio e checksum di OSCN e SPP1 (tutte le righe, il prezzo
+# letto è la prima per LINENUM); letta al posto della query completa se nulla è cambiato.
+_CATALOGO_BUSINESS_PARTNER_PROBE = """
+SELECT
+    (SELECT COUNT_BIG(*) FROM dbo.OSCN) AS catalog_rows,
+    (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(ItemCode, CardCode, Substitute)) FROM dbo.OSCN) AS catalog_checksum,
+    (SELECT COUNT_BIG(*) FROM dbo.SPP1) AS price_rows,
+    (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(ItemCode, CardCode, LINENUM, Price)) FROM dbo.SPP1) AS price_checksum
+""".strip()
+
 
 MAPPING_CATALOGO_BUSINESS_PARTNER = TableMapping(
     sap_table="dbo.OSCN",
@@ -39,5 +49,8 @@ MAPPING_CATALOGO_BUSINESS_PARTNER = TableMapping(
     },
     primary_key_sap=["ItemCode", "CardCode", "Substitute"],
     sync_strategy=SyncStrategy.TRUNCATE_INSERT,
+    load_method=LoadMethod.COPY,
+    shadow_swap=True,
     sap_query=_CATALOGO_BUSINESS_PARTNER_QUERY,
+    change_probe=_CATALOGO_BUSINESS_PARTNER_PROBE,
 )
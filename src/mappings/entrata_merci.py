@@ -1,5 +1,5 @@
 from ..models.entrata_merci import SAP_EntrataMerci
-from .base import SyncStrategy, TableMapping
+from .base import LoadMethod, SyncStrategy, TableMapping
 from ..utils.transformers import safe_datetime, safe_int, safe_string
 
 
@@ -13,6 +13,16 @@ FROM dbo.OPDN
 WHERE DocDate >= DATEADD(year, -1, GETDATE())
 """.strip()
 
+# Sonda di modifica sulla stessa finestra della query: cambia anche quando un
+# documento esce dalla finestra di un anno
+_ENTRATA_MERCI_PROBE = """
+SELECT
+    COUNT_BIG(*) AS documents,
+    CHECKSUM_AGG(BINARY_CHECKSUM(DocEntry, DocDate, CardCode, DocStatus)) AS documents_checksum
+FROM dbo.OPDN
+WHERE DocDate >= DATEADD(year, -1, GETDATE())
+""".strip()
+
 
 def _map_doc_status(value):
     """Mappa DocStatus SAP (C/O) in status (CLOSED/OPEN)."""
@@ -38,5 +48,8 @@ MAPPING_ENTRATA_MERCI = TableMapping(
     },
     primary_key_sap=["DocEntry"],
     sync_strategy=SyncStrategy.TRUNCATE_INSERT,
+    load_method=LoadMethod.COPY,
+    shadow_swap=True,
     sap_query=_ENTRATA_MERCI_QUERY,
+    change_probe=_ENTRATA_MERCI_PROBE,
 )
@@ -1,7 +1,7 @@
 from sqlalchemy import text
 
 from ..models.entrata_merci_lines import SAP_EntrataMerciLine
-from .base import SyncStrategy, TableMapping
+from .base import LoadMethod, SyncStrategy, TableMapping
 from ..utils.transformers import safe_float, safe_int, safe_string
 
 _valid_order_ids = None
@@ -21,6 +21,17 @@ INNER JOIN dbo.OPDN h ON l.DocEntry = h.DocEntry
 WHERE h.DocDate >= DATEADD(year, -1, GETDATE())
 """.strip()
 
+# Testate della finestra: documenti da mantenere e, tramite UpdateDate/UpdateTS,
+# documenti modificati di cui riscrivere le righe (strategia HEADER_DELTA).
+_ENTRATA_MERCI_HEADERS_QUERY = """
+SELECT
+    DocEntry,
+    UpdateDate,
+    UpdateTS
+FROM dbo.OPDN
+WHERE DocDate >= DATEADD(year, -1, GETDATE())
+""".strip()
+
 
 def _map_line_status(value):
     """Mappa LineStatus SAP (C/O) in status (CLOSED/OPEN)."""
@@ -75,8 +86,17 @@ MAPPING_ENTRATA_MERCI_LINES = TableMapping(
         "status": _map_line_status,
     },
     primary_key_sap=["DocEntry", "LineNum"],
-    sync_strategy=SyncStrategy.TRUNCATE_INSERT,
+    sync_strategy=SyncStrategy.HEADER_DELTA,
+    load_method=LoadMethod.COPY,
+    shadow_swap=True,
+    # Testata per la FK cod_entrata_merci; ordini per _valid_order_ids
+    depends_on=["entrataMerci", "ordiniAcquisto"],
     sap_query=_ENTRATA_MERCI_LINES_QUERY,
+    header_query=_ENTRATA_MERCI_HEADERS_QUERY,
+    document_column="cod_entrata_merci",
+    document_filter="l.DocEntry",
+    # Le righe rimosse possono lasciare orfana la testata ordine referenziata
+    reference_column="cod_order_acquisto",
     pre_process_callback=_load_valid_order_ids,
     post_transform=_align_order_reference,
 )
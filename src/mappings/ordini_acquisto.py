@@ -1,5 +1,5 @@
 from ..models.ordini_acquisto import SAP_OrdiniAcquisto
-from .base import SyncStrategy, TableMapping
+from .base import LoadMethod, SyncStrategy, TableMapping
 from ..utils.transformers import safe_string, safe_int, safe_datetime
 
 
@@ -53,6 +53,9 @@ MAPPING_ORDINI_ACQUISTO = TableMapping(
     },
     primary_key_sap=["DocEntry"],
     sync_strategy=SyncStrategy.UPSERT,
+    load_method=LoadMethod.COPY,
+    skip_unchanged=True,
     sap_query=_ORDINI_ACQUISTO_QUERY,
+    document_column="id",
 )
 
@@ -1,5 +1,5 @@
 from ..models.ordini_acquisto_lines import SAP_OrdiniAcquistoLine
-from .base import SyncStrategy, TableMapping
+from .base import LoadMethod, SyncStrategy, TableMapping
 from ..utils.transformers import safe_date, safe_float, safe_string
 
 
@@ -18,6 +18,17 @@ WHERE o.DocDate >= DATEADD(year, -1, GETDATE())
   AND (i.QryGroup14 = 'Y' OR i.QryGroup15 = 'Y' OR i.QryGroup16 = 'Y')
 """.strip()
 
+# Testate della finestra: documenti da mantenere e, tramite UpdateDate/UpdateTS,
+# documenti modificati di cui riscrivere le righe (strategia HEADER_DELTA).
+_ORDINI_ACQUISTO_HEADERS_QUERY = """
+SELECT
+    DocEntry,
+    UpdateDate,
+    UpdateTS
+FROM dbo.OPOR
+WHERE DocDate >= DATEADD(year, -1, GETDATE())
+""".strip()
+
 
 def _map_line_status(value):
     """Mappa LineStatus SAP (C/O) in status leggibile (CHIUSO/APERTO)"""
@@ -44,7 +55,13 @@ MAPPING_ORDINI_ACQUISTO_LINES = TableMapping(
         "status": _map_line_status,
     },
     primary_key_sap=["LineNum", "DocEntry"],
-    sync_strategy=SyncStrategy.TRUNCATE_INSERT,
+    sync_strategy=SyncStrategy.HEADER_DELTA,
+    load_method=LoadMethod.COPY,
+    shadow_swap=True,
+    depends_on=["ordiniAcquisto"],
     sap_query=_ORDINI_ACQUISTO_LINES_QUERY,
+    header_query=_ORDINI_ACQUISTO_HEADERS_QUERY,
+    document_column="cod_documento",
+    document_filter="p.DocEntry",
 )
 
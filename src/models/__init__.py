@@ -7,6 +7,7 @@ from .ordini_acquisto import SAP_OrdiniAcquisto
 from .ordini_acquisto_lines import SAP_OrdiniAcquistoLine
 from .entrata_merci import SAP_EntrataMerci
 from .entrata_merci_lines import SAP_EntrataMerciLine
+from .sync_runs import SAP_SyncRun, SAP_SyncRunStage
 
 __all__ = ['Base', 
         'SAP_SyncState', 
@@ -16,4 +17,6 @@ __all__ = ['Base',
         'SAP_OrdiniAcquisto', 
         'SAP_OrdiniAcquistoLine',
         'SAP_EntrataMerci',
-        'SAP_EntrataMerciLine']
\ No newline at end of file
+        'SAP_EntrataMerciLine',
+        'SAP_SyncRun',
+        'SAP_SyncRunStage']
\ No newline at end of file
@@ -0,0 +1,39 @@
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Integer, String
+from sqlalchemy.dialects.postgresql import JSONB
+from .base import Base
+
+
+class SAP_SyncRun(Base):
+    """Ciclo di sincronizzazione profilato (SYNC_PROFILER=true)"""
+    __tablename__ = "sync_runs"
+    __table_args__ = {"schema": "sap"}
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+    duration_seconds = Column(Float)
+    trigger = Column(String(20))
+    force_full = Column(Boolean, nullable=False, default=False)
+    success = Column(Boolean)
+
+    def __repr__(self):
+        return f"<SAP_SyncRun(id={self.id}, started_at='{self.started_at}', duration_seconds={self.duration_seconds})>"
+
+
+class SAP_SyncRunStage(Base):
+    """Durata, chiamate e contatori di uno stadio di una tabella in un ciclo"""
+    __tablename__ = "sync_run_stages"
+    __table_args__ = {"schema": "sap"}
+
+    run_id = Column(BigInteger, ForeignKey("sap.sync_runs.id", ondelete="CASCADE"), primary_key=True)
+    table_name = Column(String(64), primary_key=True)
+    stage = Column(String(64), primary_key=True)
+    duration_seconds = Column(Float, nullable=False)
+    calls = Column(Integer, nullable=False, default=1)
+    counters = Column(JSONB)
+
+    def __repr__(self):
+        return (
+            f"<SAP_SyncRunStage(run_id={self.run_id}, table_name='{self.table_name}', "
+            f"stage='{self.stage}', duration_seconds={self.duration_seconds})>"
+        )
@@ -8,6 +8,8 @@ class SAP_SyncState(Base):
     
     table_name = Column(String, primary_key=True)
     last_synced_at = Column(DateTime, name="last_sync_timestamp")
+    # Impronta della sonda di modifica (TableMapping.change_probe) all'ultimo sync senza errori
+    change_fingerprint = Column(String(64))
     
     def __repr__(self):
         return f"<SAP_SyncState(table_name='{self.table_name}', last_synced_at='{self.last_synced_at}')>"
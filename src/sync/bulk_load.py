@@ -0,0 +1,275 @@
+"""
+Caricamento bulk verso PostgreSQL con COPY ... FROM STDIN (psycopg2).
+
+I record trasformati vengono serializzati nel formato testo di COPY e
+caricati in una tabella temporanea di staging (LIKE tabella destinazione),
+da cui un unico INSERT ... SELECT applica le regole di conflitto della
+tabella destinazione (es. ON CONFLICT DO NOTHING per truncate_insert).
+
+Lavora sulla connessione della sessione: staging e scrittura restano nella
+stessa transazione (e nello stesso savepoint) del sync.
+"""
+from __future__ import annotations
+
+import io
+from datetime import date, datetime
+from typing import Any, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import Table, text
+from sqlalchemy.orm import Session
+
+# Colonna bigserial della tabella di staging: ordine di accodamento delle righe
+# (assegnato da COPY riga per riga), indipendente dalla posizione fisica (ctid).
+STAGING_SEQUENCE_COLUMN = '_stage_seq'
+
+
+def copy_text_value(value: Any) -> str:
+    """Serializza un valore Python nel formato testo di COPY (NULL = \\N)."""
+    if value is None:
+        return r'\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    value = str(value)
+    return (
+        value.replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def format_copy_rows(records: Iterable[dict], columns: Sequence[str], defaults: dict | None = None) -> str:
+    """
+    Costruisce il payload COPY (una riga per record, colonne separate da TAB).
+    `defaults` fornisce il valore per le colonne assenti dal record.
+    """
+    defaults = defaults or {}
+    lines = [
+        '\t'.join(copy_text_value(rec.get(col, defaults.get(col))) for col in columns)
+        for rec in records
+    ]
+    if not lines:
+        return ''
+    return '\n'.join(lines) + '\n'
+
+
+def record_columns(records: Iterable[dict]) -> List[str]:
+    """Colonne presenti nei record, nell'ordine di prima apparizione."""
+    columns: dict[str, None] = {}
+    for rec in records:
+        for key in rec:
+            columns.setdefault(key, None)
+    return list(columns)
+
+
+def scalar_column_defaults(table: Table, columns: Sequence[str]) -> dict:
+    """
+    Default Python scalari (Column(default=...)) delle colonne non presenti nel payload.
+    insert() di SQLAlchemy li applica automaticamente; con COPY vanno inclusi a mano.
+    """
+    present = set(columns)
+    return {
+        col.name: col.default.arg
+        for col in table.columns
+        if col.name not in present and col.default is not None and col.default.is_scalar
+    }
+
+
+def quote_columns(columns: Sequence[str]) -> str:
+    return ', '.join(f'"{col}"' for col in columns)
+
+
+def staging_table_name(table: Table) -> str:
+    """Nome della tabella temporanea di staging associata a `table`."""
+    return f'_stage_{table.name}'
+
+
+def prepare_staging_table(session: Session, table: Table) -> str:
+    """
+    Crea (se assente) e svuota la tabella temporanea di staging per `table`.
+    La tabella ha le stesse colonne della destinazione, più la sequenza di
+    accodamento STAGING_SEQUENCE_COLUMN, ma nessun vincolo, e viene eliminata
+    al commit della transazione.
+    """
+    staging = staging_table_name(table)
+    session.execute(text(
+        f'CREATE TEMP TABLE IF NOT EXISTS {staging} '
+        f'(LIKE {table.fullname} INCLUDING DEFAULTS, "{STAGING_SEQUENCE_COLUMN}" bigserial) ON COMMIT DROP'
+    ))
+    session.execute(text(f'TRUNCATE {staging}'))
+    return staging
+
+
+def copy_into(
+    session: Session,
+    target: str,
+    columns: Sequence[str],
+    records: Iterable[dict],
+    defaults: dict | None = None,
+) -> None:
+    """Esegue COPY target (columns) FROM STDIN tramite la connessione psycopg2 della sessione."""
+    payload = format_copy_rows(records, columns, defaults)
+    if not payload:
+        return
+    dbapi_connection = session.connection().connection
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY {target} ({quote_columns(columns)}) FROM STDIN',
+            io.StringIO(payload),
+        )
+    finally:
+        cursor.close()
+
+
+def copy_insert_batch(session: Session, table: Table, records: List[dict]) -> int:
+    """
+    Inserisce un batch con COPY in staging + INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    Equivale a insert(table).values(records).on_conflict_do_nothing().
+    Restituisce il numero di righe effettivamente inserite.
+    """
+    if not records:
+        return 0
+    columns = record_columns(records)
+    defaults = scalar_column_defaults(table, columns)
+    columns += list(defaults)
+    staging = prepare_staging_table(session, table)
+    copy_into(session, staging, columns, records, defaults)
+    cols = quote_columns(columns)
+    result = session.execute(text(
+        f'INSERT INTO {table.fullname} ({cols}) '
+        f'SELECT {cols} FROM {staging} '
+        f'ON CONFLICT DO NOTHING'
+    ))
+    return result.rowcount or 0
+
+
+class StagingMerge:
+    """
+    Staging COPY + merge set-based per le tabelle UPSERT.
+
+    I batch vengono accodati con COPY nella tabella temporanea di staging;
+    merge() applica tutto con un unico INSERT ... SELECT ... ON CONFLICT DO UPDATE
+    che aggiorna solo le colonne presenti nel payload (le colonne arricchite
+    altrove, es. art_equivalente/qta_x_conf, non vengono toccate).
+
+    Con skip_unchanged le righe già identiche in destinazione non vengono
+    riscritte (niente tuple morte, WAL e aggiornamenti indice per righe invariate).
+    """
+
+    def __init__(self, session: Session, table: Table, pk_columns: Sequence[str], skip_unchanged: bool = False):
+        self.session = session
+        self.table = table
+        self.pk_columns = list(pk_columns)
+        self.skip_unchanged = skip_unchanged
+        self.staging: str | None = None
+        self.payload_columns: List[str] | None = None
+        self.columns: List[str] = []
+        self.defaults: dict = {}
+        self.pending = 0
+
+    def accepts(self, records: List[dict]) -> bool:
+        """True se i record hanno le stesse colonne di quelli già in staging."""
+        return self.payload_columns is None or record_columns(records) == self.payload_columns
+
+    def stage(self, records: List[dict]) -> None:
+        """Accoda un batch in staging con COPY."""
+        if not records:
+            return
+        created = self.staging is None
+        if created:
+            self.payload_columns = record_columns(records)
+            self.defaults = scalar_column_defaults(self.table, self.payload_columns)
+            self.columns = self.payload_columns + list(self.defaults)
+            self.staging = prepare_staging_table(self.session, self.table)
+        try:
+            copy_into(self.session, self.staging, self.columns, records, self.defaults)
+        except Exception:
+            # Il chiamante annulla il savepoint: la tabella creata qui non esiste più.
+            if created:
+                self._clear()
+            raise
+        self.pending += len(records)
+
+    def update_columns(self) -> List[str]:
+        """Colonne non-PK aggiornate su conflitto: solo quelle del payload sync."""
+        return [
+            col.name for col in self.table.columns
+            if col.name not in self.pk_columns and col.name in (self.payload_columns or [])
+        ]
+
+    def merge_sql(self) -> str:
+        """
+        Merge con conteggio delle righe scritte: restituisce una riga
+        (staged, inserted, updated). RETURNING (xmax = 0) distingue le righe
+        inserite da quelle aggiornate; le righe sorgente non restituite sono
+        invariate (skip_unchanged) o già presenti (DO NOTHING).
+        """
+        cols = quote_columns(self.columns)
+        pk = quote_columns(self.pk_columns)
+        # DISTINCT ON: a parità di chiave vince l'ultima riga accodata,
+        # come nell'esecuzione sequenziale dei batch.
+        select = (
+            f'SELECT DISTINCT ON ({pk}) {cols} FROM {self.staging} '
+            f'ORDER BY {pk}, "{STAGING_SEQUENCE_COLUMN}" DESC'
+        )
+        update_columns = self.update_columns()
+        if update_columns:
+            conflict = 'DO UPDATE SET ' + ', '.join(
+                f'"{col}" = EXCLUDED."{col}"' for col in update_columns
+            )
+            if self.skip_unchanged:
+                current = ', '.join(f'target."{col}"' for col in update_columns)
+                incoming = ', '.join(f'EXCLUDED."{col}"' for col in update_columns)
+                conflict += f' WHERE ({current}) IS DISTINCT FROM ({incoming})'
+        else:
+            conflict = 'DO NOTHING'
+        return (
+            f'WITH source AS ({select}), '
+            f'written AS ('
+            f'INSERT INTO {self.table.fullname} AS target ({cols}) SELECT {cols} FROM source '
+            f'ON CONFLICT ({pk}) {conflict} '
+            f'RETURNING (xmax = 0) AS inserted) '
+            f'SELECT (SELECT count(*) FROM source), '
+            f'count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) '
+            f'FROM written'
+        )
+
+    def merge(self) -> Tuple[int, int, int]:
+        """
+        Applica le righe in staging alla tabella destinazione.
+        Restituisce (inserite, aggiornate, invariate) sulle chiavi distinte in staging.
+        """
+        if not self.pending:
+            return 0, 0, 0
+        staged, inserted, updated = self.session.execute(text(self.merge_sql())).one()
+        return inserted, updated, staged - inserted - updated
+
+    def iter_staged(self, batch_size: int):
+        """Rilegge le righe in staging (ordine di accodamento) a blocchi di dict."""
+        if not self.pending:
+            return
+        result = self.session.execute(text(
+            f'SELECT {quote_columns(self.payload_columns)} FROM {self.staging} '
+            f'ORDER BY "{STAGING_SEQUENCE_COLUMN}"'
+        ))
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(row._mapping) for row in rows]
+
+    def reset(self) -> None:
+        """Svuota lo staging dopo merge o fallback."""
+        if self.staging is not None:
+            self.session.execute(text(f'TRUNCATE {self.staging}'))
+        self._clear()
+
+    def _clear(self) -> None:
+        self.staging = None
+        self.payload_columns = None
+        self.columns = []
+        self.defaults = {}
+        self.pending = 0
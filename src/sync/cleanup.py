@@ -0,0 +1,200 @@
+"""
+Cleanup delle righe orfane dopo il ciclo di sincronizzazione.
+
+- Testate ordine senza righe ordine e senza righe entrata merci che le referenziano.
+- Righe entrata merci senza testata (con la FK ON DELETE CASCADE e lo swap della
+  tabella ombra non dovrebbero esistere: resta come rete di sicurezza).
+
+Il cleanup è limitato ai documenti toccati nel ciclo (CleanupScope, alimentato da
+SyncEngine.touched_documents) e, per le testate ordine, agli ordini referenziati
+dalle righe entrata merci rimosse (SyncEngine.released_references: documenti
+modificati o fuori finestra, righe orfane dello swap di entrata_merci e del
+cleanup stesso); la scansione completa avviene con force_full,
+quando una tabella sorgente è stata ricaricata per intero e comunque ogni
+CLEANUP_FULL_SWEEP_HOURS ore (ultimo sweep in sap.sync_state). Entrambe le
+DELETE girano in un'unica transazione sulla sessione del pool condiviso.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..config.settings import Settings
+from .services import SyncStateService
+
+# Chiave di sap.sync_state con l'ultimo sweep completo
+FULL_SWEEP_STATE = 'cleanupOrfani'
+
+# Ordini referenziati dalle righe entrata merci rimosse nel ciclo (TableMapping.reference_column)
+RELEASED_ORDERS = 'entrataMerciLines.cod_order_acquisto'
+
+# Tabelle del ciclo i cui documenti possono lasciare testate ordine o righe entrata merci orfane
+ORDER_SOURCES = ('ordiniAcquisto', 'ordiniAcquistoLines', RELEASED_ORDERS)
+ENTRATA_MERCI_LINE_SOURCES = ('entrataMerciLines',)
+
+
+_ORDER_HEADERS_SQL = """
+WITH examined AS (
+    SELECT o.id FROM sap.ordini_acquisto o {scope}
+),
+removed AS (
+    DELETE FROM sap.ordini_acquisto o
+    USING examined e
+    WHERE o.id = e.id
+      AND NOT EXISTS (
+          SELECT 1 FROM sap.ordini_acquisto_lines l
+          WHERE l.cod_documento = o.id
+      )
+      AND NOT EXISTS (
+          SELECT 1 FROM sap.entrata_merci_lines em
+          WHERE em.cod_order_acquisto = o.id
+      )
+    RETURNING 1
+)
+SELECT (SELECT COUNT(*) FROM examined), (SELECT COUNT(*) FROM removed)
+"""
+
+_ENTRATA_MERCI_LINES_SQL = """
+WITH examined AS (
+    SELECT l.cod_entrata_merci, l.line_num FROM sap.entrata_merci_lines l {scope}
+),
+removed AS (
+    DELETE FROM sap.entrata_merci_lines l
+    USING examined e
+    WHERE l.cod_entrata_merci = e.cod_entrata_merci
+      AND l.line_num = e.line_num
+      AND NOT EXISTS (
+          SELECT 1 FROM sap.entrata_merci h WHERE h.id = l.cod_entrata_merci
+      )
+    RETURNING l.cod_order_acquisto
+)
+SELECT (SELECT COUNT(*) FROM examined), (SELECT COUNT(*) FROM removed),
+       ARRAY(SELECT DISTINCT cod_order_acquisto FROM removed WHERE cod_order_acquisto IS NOT NULL)
+"""
+
+
+class CleanupScope:
+    """
+    Documenti toccati nel ciclo, registrati per tabella dai nodi dello scheduler
+    (thread diversi). None per una tabella = ricaricata per intero o fallita
+    (letto anche dalla riconciliazione RFQ, che per le tabelle fallite non
+    avanza il watermark ordini).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents: Dict[str, Optional[Set[int]]] = {}
+        self._failed: Set[str] = set()
+
+    def record(self, table_name: str, documents: Optional[Iterable[int]]) -> None:
+        with self._lock:
+            current = self._documents.get(table_name, set())
+            if documents is None or current is None:
+                self._documents[table_name] = None
+            else:
+                self._documents[table_name] = current | set(documents)
+
+    def record_failure(self, table_name: str) -> None:
+        """Tabella fallita o annullata: documenti scritti non noti (None)."""
+        self.record(table_name, None)
+        with self._lock:
+            self._failed.add(table_name)
+
+    def failed(self, table_names: Iterable[str]) -> bool:
+        """True se almeno una delle tabelle indicate non è stata sincronizzata nel ciclo."""
+        with self._lock:
+            return any(name in self._failed for name in table_names)
+
+    def documents(self, table_names: Iterable[str]) -> Optional[Set[int]]:
+        """Unione dei documenti delle tabelle indicate; None se una è stata ricaricata per intero."""
+        with self._lock:
+            result: Set[int] = set()
+            for name in table_names:
+                documents = self._documents.get(name, set())
+                if documents is None:
+                    return None
+                result |= documents
+            result.discard(None)
+            return result
+
+
+def _empty_stats() -> dict:
+    return {
+        'full_sweep': False,
+        'orders_examined': 0,
+        'orders_removed': 0,
+        'lines_examined': 0,
+        'lines_removed': 0,
+        'duration': 0.0,
+    }
+
+
+def _full_sweep_due(pg_session: Session, now: datetime) -> bool:
+    last_sweep = SyncStateService.get_last_sync(pg_session, FULL_SWEEP_STATE)
+    interval = timedelta(hours=Settings.get_cleanup_full_sweep_hours())
+    return last_sweep is None or now - last_sweep >= interval
+
+
+def _delete_orphans(pg_session: Session, sql: str, column: str, documents: Optional[Set[int]]):
+    """
+    Esegue la DELETE sui documenti indicati (tutta la tabella se None).
+    Restituisce la riga di risultato della query (esaminate, rimosse[, ...]).
+    """
+    if documents is None:
+        return tuple(pg_session.execute(text(sql.format(scope=''))).one())
+    if not documents:
+        return 0, 0, []
+    return tuple(pg_session.execute(
+        text(sql.format(scope=f'WHERE {column} = ANY(:ids)')),
+        {'ids': sorted(documents)},
+    ).one())
+
+
+def cleanup_orphans(pg_session: Session, scope: CleanupScope, logger, full: bool = False) -> dict:
+    """
+    Rimuove righe entrata merci e testate ordine orfane dei documenti toccati nel ciclo
+    (tutte le righe con sweep completo). Errori non bloccanti: rollback e warning.
+    Restituisce le statistiche (righe esaminate/rimosse per tabella, durata).
+    """
+    stats = _empty_stats()
+    start = time.time()
+    try:
+        now = datetime.now()
+        sweep = full or _full_sweep_due(pg_session, now)
+        order_ids = None if sweep else scope.documents(ORDER_SOURCES)
+        line_ids = None if sweep else scope.documents(ENTRATA_MERCI_LINE_SOURCES)
+        stats['full_sweep'] = order_ids is None and line_ids is None
+
+        # Prima le righe entrata merci: quelle rimosse non trattengono più le testate ordine
+        stats['lines_examined'], stats['lines_removed'], released = _delete_orphans(
+            pg_session, _ENTRATA_MERCI_LINES_SQL, 'l.cod_entrata_merci', line_ids
+        )
+        if order_ids is not None:
+            order_ids |= set(released)
+        stats['orders_examined'], stats['orders_removed'] = _delete_orphans(
+            pg_session, _ORDER_HEADERS_SQL, 'o.id', order_ids
+        )[:2]
+        if stats['full_sweep']:
+            SyncStateService.update_last_sync(pg_session, FULL_SWEEP_STATE, now)
+        pg_session.commit()
+        stats['duration'] = time.time() - start
+
+        logger.info(
+            "Cleanup orfani%s: ordini %d esaminati / %d rimossi, "
+            "righe entrata merci %d esaminate / %d rimosse in %.2fs",
+            ' (sweep completo)' if stats['full_sweep'] else '',
+            stats['orders_examined'],
+            stats['orders_removed'],
+            stats['lines_examined'],
+            stats['lines_removed'],
+            stats['duration'],
+        )
+    except Exception as e:
+        pg_session.rollback()
+        logger.warning(f"Cleanup orfani fallito (non bloccante): {e}")
+    return stats
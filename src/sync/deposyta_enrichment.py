@@ -10,36 +10,69 @@ Non inserisce righe in magazzino: aggiorna solo ciò creato da bootstrap_magazzi
 
 Join DEPOSYTA: dbo.Oggetti.Codice3 = codice articolo SAP (sap.anagrafica_articoli.id).
 Si considera solo v_objects_locations.Location = 'Magazzino'.
+
+Le due tabelle DEPOSYTA vengono lette con semplici proiezioni (nessuna funzione
+sulle colonne di join lato SQL Server); normalizzazione e join avvengono in
+memoria, e i valori per articolo vengono applicati in blocco (stock_enrichment).
 """
 from __future__ import annotations
 
 import logging
+import time
 from typing import Any
 
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from ..config.database import DatabaseConfig
+from ..config.database import DatabaseConfig, get_database_config
 from ..utils.transformers import safe_float
+from .stock_enrichment import stage_stock, update_magazzino_quantita
 
 logger = logging.getLogger(__name__)
 
 # Per ogni Code3 possono esistere più righe in v_objects_locations:
-# si usa solo quella con Location = 'Magazzino'.
+# si usa solo quella con Location = 'Magazzino' (confronto dopo trim in Python, senza
+# distinzione maiuscole/minuscole come la collation di DEPOSYTA; il LIKE riduce solo
+# le righe trasferite).
 # Join: v_objects_locations.Code3 = Oggetti.Codice3 (codice articolo SAP).
-_DEPOSYTA_STOCK_QUERY = """
+_DEPOSYTA_LOCATIONS_QUERY = """
+SELECT
+    Code3,
+    Location,
+    MinQuantity,
+    Quantity
+FROM dbo.v_objects_locations
+WHERE Location LIKE '%Magazzino%'
+""".strip()
+
+_DEPOSYTA_OGGETTI_QUERY = """
 SELECT
-    LTRIM(RTRIM(vol.Code3)) AS codice_articolo,
-    vol.MinQuantity AS min_quantity_confezioni,
-    vol.Quantity AS quantity_confezioni,
-    o.QtaConfezione AS qta_confezione
-FROM dbo.v_objects_locations vol
-INNER JOIN dbo.Oggetti o
-    ON LTRIM(RTRIM(o.Codice3)) = LTRIM(RTRIM(vol.Code3))
-WHERE LTRIM(RTRIM(vol.Code3)) <> ''
-  AND LTRIM(RTRIM(vol.Location)) = 'Magazzino'
+    Codice3,
+    QtaConfezione
+FROM dbo.Oggetti
 """.strip()
 
+_STAGE_TABLE = '_stage_deposyta_stock'
+_STAGE_COLUMNS = [
+    ('articolo', 'text'),
+    ('qta_x_conf', 'double precision'),
+    ('scorta_minima', 'double precision'),
+    ('quantita', 'double precision'),
+]
+
+_UPDATE_ANAGRAFICA_SQL = f"""
+UPDATE sap.anagrafica_articoli sa
+SET qta_x_conf = s.qta_x_conf,
+    scorta_minima = COALESCE(s.scorta_minima, sa.scorta_minima)
+FROM {_STAGE_TABLE} s
+WHERE sa.id = s.articolo
+  AND sa.categoria = 'DEPOSITA'
+  AND (
+      sa.qta_x_conf IS DISTINCT FROM s.qta_x_conf
+      OR (s.scorta_minima IS NOT NULL AND sa.scorta_minima IS DISTINCT FROM s.scorta_minima)
+  )
+"""
+
 def normalizza_qta_confezione(qta_confezione: Any) -> float:
     """Restituisce QtaConfezione DEPOSYTA; default 1 se assente o non valida."""
     conf = safe_float(qta_confezione)
@@ -56,23 +89,66 @@ def pezzi_da_confezioni(quantity_confezioni: Any, qta_confezione: Any) -> float
     return qty * normalizza_qta_confezione(qta_confezione)
 
 
+def join_deposyta_stock(location_rows, oggetti_rows, deposita_ids: set, stats: dict) -> dict[str, dict]:
+    """
+    Hash join in memoria di v_objects_locations e Oggetti sul codice normalizzato
+    (trim, senza distinzione maiuscole/minuscole come la collation di DEPOSYTA).
+    Produce le righe del join SQL precedente (una per coppia location/oggetto) e le
+    riduce per articolo DEPOSITA (vince l'ultima, come negli UPDATE in sequenza),
+    con il codice come in anagrafica PG per l'UPDATE.
+    Incrementa stats['skipped'] per le righe di articoli non DEPOSITA.
+    """
+    articoli = {articolo.strip().casefold(): articolo for articolo in deposita_ids}
+    qta_by_code: dict[str, list] = {}
+    for codice3, qta_confezione in oggetti_rows:
+        codice = (codice3 or '').strip().casefold()
+        if codice:
+            qta_by_code.setdefault(codice, []).append(qta_confezione)
+
+    by_articolo: dict[str, dict] = {}
+    for code3, location, min_quantity, quantity in location_rows:
+        codice = (code3 or '').strip().casefold()
+        if not codice or (location or '').strip().casefold() != 'magazzino':
+            continue
+        for qta_confezione in qta_by_code.get(codice, ()):
+            articolo = articoli.get(codice)
+            if articolo is None:
+                stats['skipped'] += 1
+                continue
+            quantita_pezzi = pezzi_da_confezioni(quantity, qta_confezione)
+            by_articolo[articolo] = {
+                'articolo': articolo,
+                'qta_x_conf': normalizza_qta_confezione(qta_confezione),
+                # Senza giacenza la scorta non viene aggiornata (come magazzino)
+                'scorta_minima': (
+                    pezzi_da_confezioni(min_quantity, qta_confezione)
+                    if quantita_pezzi is not None else None
+                ),
+                'quantita': quantita_pezzi,
+            }
+    return by_articolo
+
+
 def enrich_deposita_stock(pg_session: Session, db_config: DatabaseConfig | None = None) -> dict:
     """
     Aggiorna scorta_minima e magazzino per gli articoli con categoria DEPOSITA
     leggendo i dati da DEPOSYTA.
 
     Returns:
-        dict con statistiche (updated_anagrafica, updated_magazzino, skipped, errors).
+        dict con statistiche: updated_anagrafica / updated_magazzino (righe effettivamente
+        modificate), unchanged (righe già allineate, non riscritte), removed_placeholders,
+        skipped (righe non DEPOSITA, senza giacenza o senza riga magazzino), errors.
     """
     stats = {
         'updated_anagrafica': 0,
         'updated_magazzino': 0,
+        'unchanged': 0,
         'removed_placeholders': 0,
         'skipped': 0,
         'errors': 0,
     }
 
-    config = db_config or DatabaseConfig()
+    config = db_config or get_database_config()
     if not config.deposyta_db_url:
         logger.info('DEPOSYTA non configurato: skip arricchimento stock DEPOSITA')
         return stats
@@ -109,116 +185,54 @@ def enrich_deposita_stock(pg_session: Session, db_config: DatabaseConfig | None
             stats['removed_placeholders'],
         )
 
+    start = time.time()
     deposyta_session = config.get_deposyta_session()
     try:
-        rows = deposyta_session.execute(text(_DEPOSYTA_STOCK_QUERY)).fetchall()
+        location_rows = deposyta_session.execute(text(_DEPOSYTA_LOCATIONS_QUERY)).fetchall()
+        oggetti_rows = deposyta_session.execute(text(_DEPOSYTA_OGGETTI_QUERY)).fetchall()
     except Exception as e:
         logger.error('Lettura stock DEPOSYTA fallita: %s', e)
         stats['errors'] += 1
         return stats
     finally:
         deposyta_session.close()
+    fetch_duration = time.time() - start
 
-    for row in rows:
-        row_map = dict(row._mapping)
-        codice = (row_map.get('codice_articolo') or '').strip()
-        if not codice or codice not in deposita_ids:
-            stats['skipped'] += 1
-            continue
-
-        qta_x_conf = normalizza_qta_confezione(row_map.get('qta_confezione'))
-        scorta_pezzi = pezzi_da_confezioni(
-            row_map.get('min_quantity_confezioni'),
-            row_map.get('qta_confezione'),
-        )
-        quantita_pezzi = pezzi_da_confezioni(
-            row_map.get('quantity_confezioni'),
-            row_map.get('qta_confezione'),
-        )
+    by_articolo = join_deposyta_stock(location_rows, oggetti_rows, deposita_ids, stats)
+    with_quantita = sum(1 for rec in by_articolo.values() if rec['quantita'] is not None)
+    stats['skipped'] += len(by_articolo) - with_quantita
 
+    if by_articolo:
+        savepoint = pg_session.begin_nested()
         try:
-            pg_session.execute(
-                text(
-                    """
-                    UPDATE sap.anagrafica_articoli
-                    SET qta_x_conf = :qta_x_conf
-                    WHERE id = :id AND categoria = 'DEPOSITA'
-                    """
-                ),
-                {'id': codice, 'qta_x_conf': qta_x_conf},
+            stage_stock(pg_session, _STAGE_TABLE, _STAGE_COLUMNS, by_articolo.values())
+            updated_anagrafica = pg_session.execute(text(_UPDATE_ANAGRAFICA_SQL)).rowcount or 0
+            matched, updated_magazzino = update_magazzino_quantita(
+                pg_session, _STAGE_TABLE, 'DEPOSITA', 'DEPOSYTA'
             )
-            stats['updated_anagrafica'] += 1
-        except Exception as e:
-            logger.error('Aggiornamento qta_x_conf %s fallito: %s', codice, e)
-            stats['errors'] += 1
-
-        if quantita_pezzi is None:
-            stats['skipped'] += 1
-            continue
-
-        try:
-            result = pg_session.execute(
-                text(
-                    """
-                    UPDATE magazzino m
-                    SET quantita = :quantita,
-                        data_aggiornamento = CURRENT_TIMESTAMP,
-                        note = CASE
-                            WHEN m.note IS NULL OR TRIM(m.note) = ''
-                            THEN :note
-                            WHEN m.note NOT LIKE '%DEPOSYTA%'
-                            THEN m.note || ' - ' || :note
-                            ELSE m.note
-                        END
-                    FROM sap.anagrafica_articoli sa
-                    WHERE m.articolo = sa.id
-                      AND sa.id = :articolo
-                      AND sa.categoria = 'DEPOSITA'
-                      AND m.posizione = COALESCE(NULLIF(TRIM(sa.ubicazione), ''), 'NON_SPECIFICATA')
-                    """
-                ),
-                {
-                    'articolo': codice,
-                    'quantita': quantita_pezzi,
-                    'note': 'Arricchito da DEPOSYTA',
-                },
-            )
-            if result.rowcount:
-                stats['updated_magazzino'] += 1
-            else:
-                stats['skipped'] += 1
-                logger.debug(
-                    'Nessuna riga magazzino per %s (bootstrap_magazzino_from_sap?)',
-                    codice,
-                )
+            savepoint.commit()
         except Exception as e:
-            logger.error('Aggiornamento magazzino %s fallito: %s', codice, e)
+            savepoint.rollback()
+            logger.error('Aggiornamento stock DEPOSYTA fallito: %s', e)
             stats['errors'] += 1
+        else:
+            stats['updated_anagrafica'] = updated_anagrafica
+            stats['updated_magazzino'] = updated_magazzino
+            stats['unchanged'] = (len(by_articolo) - updated_anagrafica) + (matched - updated_magazzino)
+            # Articoli con giacenza ma senza riga magazzino (bootstrap_magazzino_from_sap?)
+            stats['skipped'] += with_quantita - matched
 
-        if scorta_pezzi is not None:
-            try:
-                pg_session.execute(
-                    text(
-                        """
-                        UPDATE sap.anagrafica_articoli
-                        SET scorta_minima = :scorta_minima
-                        WHERE id = :id AND categoria = 'DEPOSITA'
-                        """
-                    ),
-                    {'id': codice, 'scorta_minima': scorta_pezzi},
-                )
-            except Exception as e:
-                logger.error('Aggiornamento scorta_minima %s fallito: %s', codice, e)
-                stats['errors'] += 1
-
-    pg_session.flush()
     logger.info(
-        'Arricchimento DEPOSYTA completato: anagrafica=%s magazzino=%s '
-        'removed=%s skipped=%s errors=%s',
+        'Arricchimento DEPOSYTA completato: anagrafica=%s magazzino=%s unchanged=%s '
+        'removed=%s skipped=%s errors=%s (%s righe DEPOSYTA, lettura %.2fs, totale %.2fs)',
         stats['updated_anagrafica'],
         stats['updated_magazzino'],
+        stats['unchanged'],
         stats['removed_placeholders'],
         stats['skipped'],
         stats['errors'],
+        len(location_rows),
+        fetch_duration,
+        time.time() - start,
     )
     return stats
@@ -1,22 +1,121 @@
+import hashlib
+import json
+import queue
+import re
+import threading
 import time
-from sqlalchemy import text
+from contextlib import closing
+from datetime import datetime
+from sqlalchemy import literal_column, text, tuple_
 from sqlalchemy.dialects.postgresql import insert
-from ..config.database import DatabaseConfig
+from ..config.database import DatabaseConfig, get_database_config
 from ..config.settings import Settings
-from ..mappings.registry import get_mapping
+from ..mappings.registry import MAPPINGS_REGISTRY, get_mapping
 from ..mappings.base import SyncStrategy
 from ..utils.logger import setup_sync_logger, setup_error_logger, log_performance, log_database_error, log_sync_stats
+from ..utils import metrics
 from .services import SyncStateService
+from .bulk_load import StagingMerge, copy_insert_batch
+from .shadow_swap import ShadowTable
+from . import profiler as profiling
+from . import progress as progress_tracking
+from .progress import SyncCancelled
+from .header_delta import (
+    MAX_CHANGED_DOCUMENTS,
+    delete_documents,
+    full_reload_due,
+    full_reload_state,
+    read_document_headers,
+    table_is_empty,
+)
+
+# Sotto questa soglia un INSERT multi-VALUES costa meno dello staging COPY
+# (es. retry riga per riga nel fallback).
+_COPY_MIN_ROWS = 50
+
+# Marcatore di fine stream tra gli stadi della pipeline.
+_PIPELINE_DONE = object()
+
+
+def _empty_upsert_counts() -> dict:
+    return {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+
+def _empty_stage_seconds() -> dict:
+    return {'sap_query': 0.0, 'transform': 0.0, 'pg_write': 0.0}
+
+
+def _has_top_level_where(query: str) -> bool:
+    """True se la query ha un WHERE fuori da subquery/APPLY (profondità di parentesi 0)."""
+    depth = 0
+    for token in re.findall(r"[()]|\bWHERE\b", query, flags=re.IGNORECASE):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            return True
+    return False
+
+
+class _PipelineError:
+    """Eccezione sollevata in uno stadio della pipeline, inoltrata al writer."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _qualified_name(table) -> str:
+    return f"{table.schema or 'public'}.{table.name}"
+
+
+def _reference_tables(table) -> dict:
+    """
+    Tabelle con reference_column coinvolte nel ricaricamento di `table`: la tabella
+    stessa e quelle che la referenziano con una FK (righe orfane rimosse dallo swap o
+    dal TRUNCATE ... CASCADE). schema.nome -> (sorgente '<mapping>.<colonna>', colonna).
+    """
+    tables = {}
+    for name, mapping in MAPPINGS_REGISTRY.items():
+        if not mapping.reference_column:
+            continue
+        pg_table = mapping.pg_model.__table__
+        if pg_table is table or any(fk.references(table) for fk in pg_table.foreign_keys):
+            tables[_qualified_name(pg_table)] = (f'{name}.{mapping.reference_column}', mapping.reference_column)
+    return tables
+
 
 class SyncEngine:
     """Engine principale per la sincronizzazione dati SAP"""
     
-    def __init__(self, db_config: DatabaseConfig = None):
-        self.db_config = db_config or DatabaseConfig()
+    def __init__(self, db_config: DatabaseConfig = None, pipelined: bool = None, profiler=None, progress=None):
+        self.db_config = db_config or get_database_config()
         self.logger = setup_sync_logger("Engine")
         self.error_logger = setup_error_logger()
         self.sync_state_service = SyncStateService()
         self.batch_size = Settings.get_batch_size()
+        # Pipeline lettura SAP / trasformazione / scrittura PG su thread separati
+        self.pipelined = Settings.is_pipeline_enabled() if pipelined is None else pipelined
+        # Statement emessi dal fallback a bisezione nell'ultimo sync_table
+        self.fallback_statements = 0
+        # Esito delle righe upsert nell'ultimo sync_table
+        self.upsert_counts = _empty_upsert_counts()
+        # Documenti (document_column) scritti o rimossi nell'ultimo sync_table,
+        # per il cleanup incrementale; None = tutta la tabella (ricaricamento o full resync)
+        self.touched_documents = None
+        # Valori di reference_column delle righe rimosse nell'ultimo sync_table, per sorgente
+        # '<mapping>.<colonna>' (None = tabella svuotata o sostituita, valori non noti)
+        self.released_references = {}
+        # Tempi per stadio dell'ultimo sync_table (query SAP, trasformazione, scrittura PG)
+        self.stage_seconds = _empty_stage_seconds()
+        # Profilo per stadio del ciclo (profiler.RunProfiler); nullo se disattivato
+        self.profiler = profiler or profiling.NULL_PROFILER
+        # Avanzamento e annullamento (progress.SyncProgress); nullo se non monitorato
+        self.progress = progress or progress_tracking.NULL_PROGRESS
+        # Avanzamento della tabella dell'ultimo sync_table
+        self.table_progress = progress_tracking.NULL_TABLE_PROGRESS
+        # True se l'ultimo sync_table è stato saltato perché la sonda di modifica era invariata
+        self.skipped = False
     
     def sync_table(self, table_name: str, force_full: bool = False) -> None:
         """Sincronizza una tabella specifica usando il mapping"""
@@ -25,6 +124,13 @@ class SyncEngine:
         total_records = 0
         processed_records = 0
         error_count = 0
+        shadow = None
+        self.fallback_statements = 0
+        self.upsert_counts = _empty_upsert_counts()
+        self.touched_documents = None
+        self.released_references = {}
+        self.stage_seconds = _empty_stage_seconds()
+        self.skipped = False
         
         try:
             mapping = get_mapping(table_name)
@@ -35,10 +141,46 @@ class SyncEngine:
         
         pg_session = self.db_config.get_pg_session()
         sap_session = self.db_config.get_sap_session()
+        profile = self.profiler.table(table_name)
+        # Le callback del mapping raggiungono il profilo con profiler.current()
+        profiling.set_current(profile)
+        tracker = self.table_progress = self.progress.table(table_name)
+
+        def stage(name):
+            # Stadio corrente pubblicato nell'avanzamento e misurato nel profilo
+            tracker.set_stage(name)
+            return profile.stage(name)
 
         try:
+            # Annullamento chiesto prima che la tabella parta: nessun lavoro
+            self.progress.check_cancelled()
+            tracker.start()
+
+            # Sonda di modifica: con impronta invariata non si legge nulla da SAP
+            fingerprint = None
+            if mapping.change_probe:
+                with stage('change_probe'):
+                    fingerprint = self._probe_fingerprint(sap_session, mapping, table_logger)
+                if (
+                    fingerprint is not None
+                    and not force_full
+                    and fingerprint == self.sync_state_service.get_fingerprint(pg_session, table_name)
+                ):
+                    self._skip_unchanged(pg_session, mapping, table_name, table_logger, stage, start_time)
+                    return
+
+            headers = None
+            full_reload = mapping.requires_truncate()
+            if mapping.uses_header_delta():
+                # Righe documento: watermark e documenti modificati dalle testate
+                last_sync = None
+                reload_started = datetime.now()
+                with stage('header_delta'):
+                    headers, full_reload = self._plan_header_delta(
+                        sap_session, pg_session, mapping, table_name, force_full, table_logger, reload_started
+                    )
             # Per truncate_insert non consideriamo il last_sync
-            if mapping.requires_truncate():
+            elif mapping.requires_truncate():
                 last_sync = None
                 table_logger.info("Modalità TRUNCATE_INSERT: recupero tutti i dati")
             elif force_full:
@@ -49,19 +191,49 @@ class SyncEngine:
                 last_sync = self.sync_state_service.get_last_sync(pg_session, table_name)
                 table_logger.info(f"Modalità UPSERT: ultima sincronizzazione: {last_sync}")
 
-            # Costruisci e esegui query
+            # Eseguita prima della query: durante lo streaming la connessione SAP
+            # resta occupata dal cursore aperto e non accetta altre query.
+            if mapping.pre_sync_callback:
+                with stage('pre_sync_callback'):
+                    mapping.pre_sync_callback(sap_session)
+
+            if headers is not None and not full_reload:
+                with stage('delete_documents'):
+                    changed_rows, trimmed_rows = delete_documents(pg_session, mapping, headers)
+                profile.count('delete_documents', rows=changed_rows + trimmed_rows)
+                table_logger.info(
+                    f"Rimosse {changed_rows} righe di documenti modificati e "
+                    f"{trimmed_rows} righe di documenti fuori finestra"
+                )
+                self.touched_documents = set(headers.changed) | set(headers.trimmed)
+                if mapping.reference_column:
+                    self.released_references[f'{table_name}.{mapping.reference_column}'] = set(headers.released)
+            elif mapping.document_column and not mapping.inserts_only() and last_sync is not None:
+                self.touched_documents = set()
+
+            # Costruisci e esegui query (streaming a blocchi di batch_size righe)
             query_start = time.time()
-            query = self._build_sync_query(mapping, last_sync)
-            table_logger.debug(f"Query SAP: {query}")
-            
-            result = sap_session.execute(text(query))
-            rows = result.fetchall()
-            total_records = len(rows)
-            
-            query_duration = time.time() - query_start
-            log_performance(table_logger, f"Query SAP per {table_name}", query_duration, total_records)
-            
-            if not rows:
+            if headers is not None and not full_reload:
+                query, query_params = self._build_document_query(mapping, headers.changed)
+            else:
+                query, query_params = self._build_sync_query(mapping, last_sync)
+            tracker.set_mode(full_reload or (headers is None and last_sync is None))
+
+            result = None
+            first_chunk = []
+            if query is not None:
+                tracker.set_stage('sap_query')
+                table_logger.debug(f"Query SAP: {query} {query_params}")
+                result = sap_session.execute(text(query).execution_options(stream_results=True), query_params)
+                first_chunk = result.fetchmany(self.batch_size)
+
+                query_duration = time.time() - query_start
+                self.stage_seconds['sap_query'] = query_duration
+                log_performance(table_logger, f"Query SAP per {table_name} (primo blocco)", query_duration, len(first_chunk))
+
+            if not first_chunk:
+                if result is not None:
+                    result.close()
                 table_logger.info("Nessuna riga da sincronizzare")
             else:
                 # #region agent log
@@ -73,24 +245,53 @@ class SyncEngine:
                         {
                             "last_sync": last_sync.isoformat() if last_sync else None,
                             "is_delta": bool(last_sync and not mapping.requires_truncate()),
-                            "rows_fetched": total_records,
+                            "first_chunk_rows": len(first_chunk),
                         },
                         hypothesis_id="H5",
                     )
                 # #endregion
                 # Se richiesto, truncate la tabella prima di inserire i nuovi dati
-                if mapping.requires_truncate():
-                    self._truncate_table(pg_session, mapping, table_logger)
-
-                if mapping.pre_sync_callback:
-                    mapping.pre_sync_callback(sap_session)
+                # (o, con shadow_swap, carica in una tabella ombra scambiata a fine caricamento)
+                pg_table = mapping.pg_model.__table__
+                reloaded = _reference_tables(pg_table) if full_reload else {}
+                if full_reload and mapping.uses_shadow_swap():
+                    with stage('shadow_prepare'):
+                        shadow = ShadowTable.prepare(
+                            pg_session, pg_table, table_logger,
+                            references={name: column for name, (_, column) in reloaded.items()},
+                        )
+                if full_reload and shadow is None:
+                    with stage('truncate'):
+                        self._truncate_table(pg_session, mapping, table_logger)
 
                 if mapping.pre_process_callback:
-                    mapping.pre_process_callback(pg_session)
+                    with stage('pre_process_callback'):
+                        mapping.pre_process_callback(pg_session)
 
-                # Processa i dati
-                processed_records, error_count, max_ts = self._process_rows(
-                    rows, mapping, pg_session, table_logger
+                # Processa i dati mentre SAP continua a inviare i blocchi successivi
+                tracker.set_stage('stream_rows')
+                chunks = self._iter_sap_chunks(result, first_chunk)
+                transformer = self._compile_transformer(result, mapping)
+                total_records, processed_records, error_count, max_ts = self._process_rows(
+                    chunks, mapping, pg_session, table_logger, transformer,
+                    target_table=shadow.table if shadow else None,
+                )
+                if shadow is not None:
+                    # Prima di post_sync_callback: le callback vedono già i dati nuovi
+                    with stage('shadow_swap'):
+                        shadow.finalize()
+                        shadow.swap()
+                for name, (source, _) in reloaded.items():
+                    # Tabella ricaricata o svuotata dal CASCADE: riferimenti rilasciati non noti
+                    if shadow is None or name == _qualified_name(pg_table):
+                        self.released_references[source] = None
+                    else:
+                        self.released_references[source] = shadow.released.get(name, set())
+                log_performance(
+                    table_logger,
+                    f"Estrazione e scrittura {table_name}",
+                    time.time() - query_start,
+                    total_records,
                 )
 
                 # Aggiorna stato sincronizzazione solo se non è truncate_insert
@@ -98,24 +299,63 @@ class SyncEngine:
                     self.sync_state_service.update_last_sync(pg_session, table_name, max_ts)
                     table_logger.info(f"Aggiornato timestamp sincronizzazione: {max_ts}")
                 elif mapping.requires_truncate():
-                    from datetime import datetime
                     current_ts = datetime.now()
                     self.sync_state_service.update_last_sync(pg_session, table_name, current_ts)
                     table_logger.info(
                         f"Aggiornato timestamp sincronizzazione (truncate_insert): {current_ts}"
                     )
 
+            if headers is not None and headers.watermark:
+                self.sync_state_service.update_last_sync(pg_session, table_name, headers.watermark)
+                table_logger.info(f"Aggiornato watermark testate: {headers.watermark}")
+            if headers is not None and full_reload:
+                self.sync_state_service.update_last_sync(pg_session, full_reload_state(table_name), reload_started)
+
+            if mapping.change_probe:
+                # Con righe skippate l'impronta viene azzerata: il ciclo successivo riprova
+                self.sync_state_service.update_fingerprint(
+                    pg_session, table_name, fingerprint if not error_count else None
+                )
+
             # Callback anche senza delta SAP (es. arricchimento stock DEPOSYTA)
             if mapping.post_sync_callback:
                 table_logger.info("Esecuzione post_sync_callback...")
-                mapping.post_sync_callback(pg_session, rows)
+                full_sync = full_reload or (not mapping.inserts_only() and last_sync is None)
+                with stage('post_sync_callback'):
+                    mapping.post_sync_callback(pg_session, total_records, full_sync)
                 table_logger.info("post_sync_callback completato")
 
-            pg_session.commit()
+            with stage('commit'):
+                pg_session.commit()
+            if shadow is not None:
+                with stage('validate_foreign_keys'):
+                    shadow.validate_foreign_keys()
             
+            tracker.finish(progress_tracking.DONE)
+
             # Log statistiche finali
             total_duration = time.time() - start_time
+            if profile.enabled:
+                self._profile_rows(profile, total_records, processed_records, error_count)
+                profile.add('total', total_duration)
+            metrics.observe_table_sync(
+                table_name,
+                self.stage_seconds['sap_query'],
+                self.stage_seconds['transform'],
+                self.stage_seconds['pg_write'],
+                total_records,
+                self.fallback_statements,
+                error_count,
+            )
             log_sync_stats(table_logger, table_name, total_records, processed_records, error_count, total_duration)
+            if self.fallback_statements:
+                table_logger.info(f"Fallback a bisezione: {self.fallback_statements} statement")
+            if any(self.upsert_counts.values()):
+                table_logger.info(
+                    f"Righe upsert: {self.upsert_counts['inserted']} inserite, "
+                    f"{self.upsert_counts['updated']} aggiornate, "
+                    f"{self.upsert_counts['unchanged']} invariate"
+                )
             if error_count:
                 table_logger.warning(
                     f"Sincronizzazione {table_name} completata con {error_count} righe skippate"
@@ -123,15 +363,82 @@ class SyncEngine:
             else:
                 table_logger.info(f"Sincronizzazione {table_name} completata con successo")
 
+        except SyncCancelled:
+            # Stop al confine di un batch: nulla di questa tabella viene committato
+            pg_session.rollback()
+            profile.add('total', time.time() - start_time, cancelled=1)
+            tracker.finish(progress_tracking.CANCELLED)
+            table_logger.warning("Sincronizzazione annullata su richiesta: modifiche annullate, watermark invariato")
+            raise
         except Exception as e:
             pg_session.rollback()
+            metrics.observe_table_failure(table_name)
             error_duration = time.time() - start_time
+            profile.add('total', error_duration, failed=1)
+            tracker.finish(progress_tracking.FAILED, str(e))
             log_database_error(self.error_logger, "Sincronizzazione", e, table_name)
             table_logger.error(f"Errore durante sincronizzazione: {str(e)}")
             raise
         finally:
+            profiling.set_current(None)
             pg_session.close()
             sap_session.close()
+
+    def _probe_fingerprint(self, sap_session, mapping, logger):
+        """
+        Impronta (sha256) del risultato di mapping.change_probe e della definizione
+        del mapping (query e colonne), così una modifica al mapping forza un nuovo
+        sync. None se la sonda fallisce: la tabella viene sincronizzata comunque.
+        """
+        try:
+            row = sap_session.execute(text(mapping.change_probe)).first()
+        except Exception as e:
+            sap_session.rollback()
+            logger.warning(f"Sonda di modifica fallita, sync completo: {type(e).__name__}: {e}")
+            return None
+        payload = json.dumps(
+            [
+                mapping.sap_query,
+                sorted(mapping.column_mappings.items()),
+                [str(value) for value in (row or ())],
+            ],
+            default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _skip_unchanged(self, pg_session, mapping, table_name, logger, stage, start_time):
+        """
+        Tabella invariata secondo la sonda: niente query, truncate né callback legate
+        alle righe (pre_sync, pre_process, batch). post_sync_callback gira comunque,
+        come in un delta senza righe: può dipendere da dati esterni a SAP (es. stock).
+        """
+        self.skipped = True
+        # Nessun documento scritto o rimosso: nulla da ripulire per questa tabella
+        self.touched_documents = set()
+        logger.info("Sonda di modifica invariata: estrazione saltata")
+        if mapping.post_sync_callback:
+            with stage('post_sync_callback'):
+                mapping.post_sync_callback(pg_session, 0, False)
+        with stage('commit'):
+            pg_session.commit()
+        duration = time.time() - start_time
+        self.profiler.table(table_name).add('total', duration, skipped_unchanged=1)
+        self.table_progress.finish(progress_tracking.SKIPPED)
+        metrics.observe_table_skipped(table_name)
+        logger.info(f"Sincronizzazione {table_name} saltata (invariata) in {duration:.2f}s")
+
+    def _profile_rows(self, profile, extracted, processed, errors):
+        """Stadi misurati nel loop righe (anche su thread della pipeline) e contatori del sync."""
+        profile.add('sap_query', self.stage_seconds['sap_query'])
+        profile.add('transform', self.stage_seconds['transform'], rows=extracted)
+        profile.add(
+            'pg_write',
+            self.stage_seconds['pg_write'],
+            rows=processed,
+            skipped=errors,
+            fallback_statements=self.fallback_statements,
+            **self.upsert_counts,
+        )
     
     def _truncate_table(self, session, mapping, logger):
         """Svuota completamente una tabella PostgreSQL"""
@@ -159,95 +466,372 @@ class SyncEngine:
             log_database_error(logger, f"Truncate tabella {table_name}", e)
             raise
     
-    def _build_sync_query(self, mapping, last_sync):
-        """Costruisce la query di sincronizzazione"""
+    def _plan_header_delta(self, sap_session, pg_session, mapping, table_name, force_full, logger, now):
+        """
+        Legge le testate della finestra e decide tra sync per documento e ricaricamento
+        completo (primo avvio, tabella vuota, troppi documenti modificati, ricaricamento
+        periodico scaduto). Restituisce (DocumentHeaders, full_reload).
+        """
+        last_sync = None if force_full else self.sync_state_service.get_last_sync(pg_session, table_name)
+        headers = read_document_headers(sap_session, mapping, last_sync)
+        logger.info(
+            f"Modalità HEADER_DELTA: {len(headers.changed)} documenti modificati su "
+            f"{len(headers.window)} nella finestra (watermark: {last_sync})"
+        )
+        if last_sync is None:
+            reason = "full resync forzato o primo avvio"
+        elif table_is_empty(pg_session, mapping.pg_model.__table__):
+            reason = "tabella destinazione vuota"
+        elif len(headers.changed) > MAX_CHANGED_DOCUMENTS:
+            reason = f"oltre {MAX_CHANGED_DOCUMENTS} documenti modificati"
+        elif full_reload_due(
+            self.sync_state_service.get_last_sync(pg_session, full_reload_state(table_name)), now
+        ):
+            reason = f"ricaricamento periodico (ogni {Settings.get_header_delta_full_reload_hours():g} ore)"
+        else:
+            return headers, False
+        logger.info(f"Ricaricamento completo delle righe: {reason}")
+        return headers, True
+
+    @staticmethod
+    def _build_document_query(mapping, document_ids):
+        """
+        Query delle righe dei soli documenti indicati (sap_query + filtro IN con
+        parametri bound). Restituisce (None, {}) se non ci sono documenti.
+        """
+        if not document_ids:
+            return None, {}
+        placeholders = ", ".join(f":document_{i}" for i in range(len(document_ids)))
+        connector = "AND" if _has_top_level_where(mapping.sap_query) else "WHERE"
+        query = f"{mapping.sap_query} {connector} {mapping.document_filter} IN ({placeholders})"
+        params = {f"document_{i}": doc_id for i, doc_id in enumerate(document_ids)}
+        return query, params
+
+    @staticmethod
+    def _build_sync_query(mapping, last_sync):
+        """
+        Costruisce la query di sincronizzazione e i relativi parametri.
+
+        Il filtro delta usa parametri bound (piano riusabile da SQL Server tra i
+        cicli) e confronta UpdateDate senza funzioni sulla colonna, così da
+        poter usare un indice su UpdateDate:
+
+            UpdateDate >= :last_sync_date
+            AND (UpdateDate > :last_sync_date OR UpdateTS > :last_sync_ts)
+
+        equivalente a "giorno successivo, oppure stesso giorno e UpdateTS maggiore"
+        perché in SAP UpdateDate non ha componente oraria. Restituisce (query, params).
+        """
         if mapping.sap_query:
             # Usa la query custom (es. JOIN multi-tabella)
             query = mapping.sap_query
-            # Applica il filtro temporale se necessario
-            if last_sync and not mapping.requires_truncate():
-                prefix = f"{mapping.sap_timestamp_prefix}." if mapping.sap_timestamp_prefix else ""
-                last_sync_date = last_sync.strftime("%Y%m%d")
-                last_sync_ts = last_sync.hour * 10000 + last_sync.minute * 100 + last_sync.second
-                connector = "AND" if "WHERE" in query.upper() else "WHERE"
-                query += (
-                    f" {connector} (CONVERT(date, {prefix}UpdateDate) > CONVERT(date, '{last_sync_date}')"
-                    f" OR (CONVERT(date, {prefix}UpdateDate) = CONVERT(date, '{last_sync_date}')"
-                    f" AND {prefix}UpdateTS > {last_sync_ts}))"
-                )
+            prefix = f"{mapping.sap_timestamp_prefix}." if mapping.sap_timestamp_prefix else ""
         else:
             # Costruisci la query automaticamente dalle chiavi del mapping
             sap_columns = list(mapping.column_mappings.keys())
             columns_str = ", ".join(sap_columns)
             query = f"SELECT {columns_str} FROM {mapping.sap_table}"
-            # Solo per UPSERT aggiungiamo il filtro temporale
-            if last_sync and not mapping.requires_truncate():
-                last_sync_date = last_sync.strftime("%Y%m%d")
-                last_sync_ts = last_sync.hour * 10000 + last_sync.minute * 100 + last_sync.second
-                query += (
-                    f" WHERE CONVERT(date, UpdateDate) > CONVERT(date, '{last_sync_date}')"
-                    f" OR (CONVERT(date, UpdateDate) = CONVERT(date, '{last_sync_date}')"
-                    f" AND UpdateTS > {last_sync_ts})"
-                )
+            prefix = ""
+
+        # Solo per UPSERT aggiungiamo il filtro temporale
+        if not last_sync or mapping.inserts_only():
+            return query, {}
 
-        return query
+        connector = "AND" if _has_top_level_where(query) else "WHERE"
+        query += (
+            f" {connector} ({prefix}UpdateDate >= :last_sync_date"
+            f" AND ({prefix}UpdateDate > :last_sync_date OR {prefix}UpdateTS > :last_sync_ts))"
+        )
+        params = {
+            # date (non datetime): SQL Server converte il parametro al tipo della
+            # colonna invece del contrario, e il confronto resta sargable
+            "last_sync_date": last_sync.date(),
+            "last_sync_ts": last_sync.hour * 10000 + last_sync.minute * 100 + last_sync.second,
+        }
+        return query, params
     
-    def _process_rows(self, rows, mapping, pg_session, logger):
-        """Processa le righe dalla query SAP"""
+    def _iter_sap_chunks(self, result, first_chunk):
+        """Restituisce i blocchi di righe SAP letti dal cursore con fetchmany."""
+        try:
+            chunk = first_chunk
+            while chunk:
+                yield chunk
+                chunk = result.fetchmany(self.batch_size)
+        finally:
+            result.close()
+
+    def _compile_transformer(self, result, mapping):
+        """Compila il transformer del mapping per le colonne (e i tipi) del result set SAP."""
+        cursor = getattr(result, 'cursor', None)
+        description = getattr(cursor, 'description', None)
+        return mapping.compile_transformer(list(result.keys()), description)
+
+    def _transform_chunk(self, chunk, mapping, logger, first_row_num, transformer=None):
+        """
+        Trasforma un blocco di righe SAP.
+        Con `transformer` (da _compile_transformer) le righe sono trasformate per
+        posizione; altrimenti passano da dict e TableMapping.transform_row.
+        Restituisce (record_pg, righe_in_errore, max_ts del blocco).
+        """
         max_ts = None
-        processed = 0
         error_count = 0
         batch_records = []
-
-        for row_num, row in enumerate(rows, 1):
+        transform_start = time.perf_counter()
+        for row_num, row in enumerate(chunk, first_row_num):
             try:
-                # Converti row in dizionario
-                row_dict = dict(row._mapping)
-                
                 # Trasforma usando il mapping
-                pg_data = mapping.transform_row(row_dict)
+                if transformer is not None:
+                    pg_data = transformer(row)
+                else:
+                    pg_data = mapping.transform_row(dict(row._mapping))
                 batch_records.append(pg_data)
-                
+
                 # Traccia timestamp massimo solo per UPSERT
                 if not mapping.requires_truncate() and 'last_synced_at' in pg_data and pg_data['last_synced_at']:
                     if max_ts is None or pg_data['last_synced_at'] > max_ts:
                         max_ts = pg_data['last_synced_at']
-                
-                # Quando il batch è pieno, esegui l'operazione
-                if len(batch_records) >= self.batch_size:
+
+            except Exception as e:
+                error_count += 1
+                log_database_error(logger, f"Elaborazione riga {row_num}", e)
+                # Continua con la prossima riga
+        # Un solo thread trasforma per sync: somma senza lock
+        self.stage_seconds['transform'] += time.perf_counter() - transform_start
+        return batch_records, error_count, max_ts
+
+    def _iter_transformed(self, chunks, mapping, logger, transformer=None):
+        """Lettura e trasformazione sequenziali: (chunk, record, errori, max_ts) per blocco."""
+        extracted = 0
+        for chunk in chunks:
+            yield (chunk,) + self._transform_chunk(chunk, mapping, logger, extracted + 1, transformer)
+            extracted += len(chunk)
+
+    def _iter_transformed_pipelined(self, chunks, mapping, logger, transformer=None):
+        """
+        Come _iter_transformed, ma lettura SAP e trasformazione girano su due thread
+        collegati al writer (thread chiamante) da code limitate: mentre PG scrive un
+        batch, SAP invia il successivo. La dimensione delle code limita la memoria.
+        La sessione PG resta usata solo dal thread chiamante (una sola transazione).
+        """
+        queue_size = Settings.get_pipeline_queue_size()
+        raw_queue = queue.Queue(maxsize=queue_size)
+        out_queue = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+
+        def put(target, item):
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read_stage():
+            try:
+                for chunk in chunks:
+                    if not put(raw_queue, chunk):
+                        return
+                put(raw_queue, _PIPELINE_DONE)
+            except BaseException as e:
+                put(raw_queue, _PipelineError(e))
+            finally:
+                chunks.close()
+
+        def transform_stage():
+            extracted = 0
+            while True:
+                item = raw_queue.get()
+                if item is _PIPELINE_DONE or isinstance(item, _PipelineError):
+                    put(out_queue, item)
+                    return
+                try:
+                    transformed = self._transform_chunk(item, mapping, logger, extracted + 1, transformer)
+                except BaseException as e:
+                    put(out_queue, _PipelineError(e))
+                    return
+                extracted += len(item)
+                if not put(out_queue, (item,) + transformed):
+                    return
+
+        threads = [
+            threading.Thread(target=read_stage, daemon=True, name='sync-sap-reader'),
+            threading.Thread(target=transform_stage, daemon=True, name='sync-transformer'),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = out_queue.get()
+                if item is _PIPELINE_DONE:
+                    return
+                if isinstance(item, _PipelineError):
+                    raise item.error
+                yield item
+        finally:
+            # Il writer ha finito (o è fallito): sblocca gli stadi e attende la
+            # chiusura del cursore SAP prima che il chiamante chiuda la sessione.
+            stop.set()
+            for stage_queue in (raw_queue, out_queue):
+                while True:
+                    try:
+                        stage_queue.get_nowait()
+                    except queue.Empty:
+                        break
+            if threads[1].is_alive():
+                try:
+                    raw_queue.put_nowait(_PIPELINE_DONE)
+                except queue.Full:
+                    pass  # il transformer ha ancora un elemento da consumare e poi esce
+            for thread in threads:
+                thread.join()
+
+    def _process_rows(self, chunks, mapping, pg_session, logger, transformer=None, target_table=None):
+        """
+        Processa i blocchi di righe letti dalla query SAP.
+        Ogni blocco viene trasformato e scritto prima di leggere il successivo
+        (o, in modalità pipeline, mentre il successivo viene letto e trasformato),
+        così in memoria restano al più pochi batch alla volta.
+        `target_table` sostituisce la tabella del modello (es. tabella ombra dello shadow swap).
+        Restituisce (righe_estratte, righe_ok, righe_in_errore, max_ts).
+        """
+        max_ts = None
+        extracted = 0
+        processed = 0
+        error_count = 0
+        if mapping.inserts_only():
+            operation_name = "Batch COPY" if mapping.uses_copy() else "Batch insert"
+        else:
+            operation_name = "Batch upsert"
+
+        # UPSERT con COPY: i batch vanno in staging e il merge avviene una volta
+        # per tabella (o per blocco, se una batch_callback deve vedere le righe già scritte).
+        stager = None
+        stage_duration = 0.0
+        if mapping.uses_copy() and not mapping.inserts_only():
+            stager = StagingMerge(
+                pg_session, mapping.pg_model.__table__, mapping.get_pg_primary_key_columns(),
+                skip_unchanged=mapping.skip_unchanged,
+            )
+
+        if self.pipelined:
+            transformed = self._iter_transformed_pipelined(chunks, mapping, logger, transformer)
+        else:
+            transformed = self._iter_transformed(chunks, mapping, logger, transformer)
+
+        # Chiuso anche in caso di errore o annullamento: ferma subito i thread della pipeline
+        with closing(transformed):
+            for chunk, batch_records, chunk_errors, chunk_max_ts in transformed:
+                # Confine di batch: l'annullamento interrompe prima di scrivere il blocco
+                self.progress.check_cancelled()
+                write_start = time.perf_counter()
+                extracted += len(chunk)
+                error_count += chunk_errors
+                if chunk_max_ts is not None and (max_ts is None or chunk_max_ts > max_ts):
+                    max_ts = chunk_max_ts
+                if self.touched_documents is not None and mapping.document_column:
+                    self.touched_documents.update(rec.get(mapping.document_column) for rec in batch_records)
+
+                if stager is not None and batch_records:
+                    if not stager.accepts(batch_records):
+                        batch_ok, batch_err = self._apply_staged(pg_session, mapping, stager, logger, stage_duration)
+                        processed += batch_ok
+                        error_count += batch_err
+                        stage_duration = 0.0
+                    stage_start = time.time()
+                    if self._stage_batch(pg_session, stager, batch_records, logger):
+                        stage_duration += time.time() - stage_start
+                        logger.info(f"In staging {stager.pending} righe ({extracted} estratte)...")
+                    else:
+                        batch_ok, batch_err = self._execute_batch_with_fallback(
+                            pg_session, mapping, batch_records, logger, operation_name
+                        )
+                        processed += batch_ok
+                        error_count += batch_err
+                    if mapping.batch_callback:
+                        batch_ok, batch_err = self._apply_staged(pg_session, mapping, stager, logger, stage_duration)
+                        processed += batch_ok
+                        error_count += batch_err
+                        stage_duration = 0.0
+                elif batch_records:
                     batch_start = time.time()
-                    operation_name = "Batch insert" if mapping.requires_truncate() else "Batch upsert"
                     batch_ok, batch_err = self._execute_batch_with_fallback(
-                        pg_session, mapping, batch_records, logger, operation_name
+                        pg_session, mapping, batch_records, logger, operation_name, target_table
                     )
                     batch_duration = time.time() - batch_start
                     processed += batch_ok
                     error_count += batch_err
                     if batch_ok:
                         log_performance(logger, operation_name, batch_duration, batch_ok)
-                        logger.info(f"Processate {processed}/{len(rows)} righe...")
-                    batch_records = []
-                    
-            except Exception as e:
-                error_count += 1
-                log_database_error(logger, f"Elaborazione riga {row_num}", e)
-                # Continua con la prossima riga
+                        logger.info(f"Processate {processed}/{extracted} righe estratte...")
 
-        # Processa l'ultimo batch se ci sono record rimanenti
-        if batch_records:
-            operation_name = "Final batch insert" if mapping.requires_truncate() else "Final batch upsert"
-            batch_start = time.time()
-            batch_ok, batch_err = self._execute_batch_with_fallback(
-                pg_session, mapping, batch_records, logger, operation_name
-            )
-            batch_duration = time.time() - batch_start
+                if mapping.batch_callback:
+                    mapping.batch_callback(pg_session, chunk)
+                self.stage_seconds['pg_write'] += time.perf_counter() - write_start
+                self.table_progress.update(extracted, processed + (stager.pending if stager is not None else 0))
+
+        if stager is not None and stager.pending:
+            write_start = time.perf_counter()
+            batch_ok, batch_err = self._apply_staged(pg_session, mapping, stager, logger, stage_duration)
             processed += batch_ok
             error_count += batch_err
-            if batch_ok:
-                log_performance(logger, operation_name, batch_duration, batch_ok)
+            self.stage_seconds['pg_write'] += time.perf_counter() - write_start
+            self.table_progress.update(extracted, processed)
+
+        return extracted, processed, error_count, max_ts
+
+    def _stage_batch(self, session, stager, records, logger) -> bool:
+        """Accoda un batch in staging sotto savepoint. False se il COPY fallisce."""
+        savepoint = session.begin_nested()
+        try:
+            stager.stage(records)
+            savepoint.commit()
+            return True
+        except Exception as e:
+            savepoint.rollback()
+            logger.warning(
+                f"Staging COPY fallito su {len(records)} righe, scrittura diretta: "
+                f"{type(e).__name__}: {e}"
+            )
+            return False
+
+    def _apply_staged(self, session, mapping, stager, logger, stage_duration):
+        """
+        Applica lo staging con un unico merge set-based sotto savepoint.
+        Se il merge fallisce, rilegge lo staging e ripiega sui batch upsert con fallback.
+        Restituisce (righe_ok, righe_skippate).
+        """
+        staged = stager.pending
+        if not staged:
+            return 0, 0
+        log_performance(logger, "Staging COPY (load)", stage_duration, staged)
+
+        merge_start = time.time()
+        savepoint = session.begin_nested()
+        try:
+            counts = stager.merge()
+            savepoint.commit()
+            self._count_upserts(*counts)
+            log_performance(logger, "Merge set-based (merge)", time.time() - merge_start, staged)
+            stager.reset()
+            return staged, 0
+        except Exception as merge_e:
+            savepoint.rollback()
+            logger.warning(
+                f"Merge set-based fallito su {staged} righe, retry a batch: "
+                f"{type(merge_e).__name__}: {merge_e}"
+            )
+
+        ok, err = 0, 0
+        for records in stager.iter_staged(self.batch_size):
+            batch_ok, batch_err = self._execute_batch_with_fallback(
+                session, mapping, records, logger, "Batch upsert"
+            )
+            ok += batch_ok
+            err += batch_err
+        stager.reset()
+        return ok, err
 
-        return processed, error_count, max_ts
-    
     def _record_label(self, mapping, record: dict) -> str:
         """Identificativo leggibile di una riga per i log."""
         pk_cols = mapping.get_pg_primary_key_columns()
@@ -256,72 +840,113 @@ class SyncEngine:
         parts = [str(record.get(col, '')) for col in pk_cols]
         return '/'.join(parts) or '?'
 
-    def _execute_batch_with_fallback(self, session, mapping, records, logger, operation_name):
+    def _execute_batch_with_fallback(self, session, mapping, records, logger, operation_name, table=None):
         """
-        Esegue un batch; se fallisce, riprova riga per riga skippando quelle in errore.
+        Esegue un batch; se fallisce, lo divide a metà e riprova ogni metà
+        (bisezione ricorsiva) fino a isolare le singole righe in errore, che
+        vengono skippate: k righe errate costano O(k log n) statement invece di n.
         Usa savepoint per non annullare i batch già applicati nella stessa transazione.
+        Gli statement emessi dal fallback si sommano in self.fallback_statements.
         Restituisce (righe_ok, righe_skippate).
         """
         if not records:
             return 0, 0
 
+        batch_e = self._write_batch(session, mapping, records, table)
+        if batch_e is None:
+            return len(records), 0
+        logger.warning(
+            f"{operation_name} fallito su {len(records)} righe, retry per bisezione: "
+            f"{type(batch_e).__name__}: {batch_e}"
+        )
+        if len(records) == 1:
+            self._log_skipped_row(mapping, records[0], batch_e, logger)
+            return 0, 1
+
+        fallback_start = time.perf_counter()
+        ok, err, statements = self._bisect_batch(session, mapping, records, logger, table)
+        profiling.current().add(
+            'fallback', time.perf_counter() - fallback_start, statements=statements, skipped=err
+        )
+        self.fallback_statements += statements
+        if err:
+            logger.warning(
+                f"{operation_name}: {ok} righe salvate, {err} skippate "
+                f"({statements} statement di fallback)"
+            )
+        return ok, err
+
+    def _bisect_batch(self, session, mapping, records, logger, table=None):
+        """
+        Riprova le due metà di un batch fallito, scendendo ricorsivamente solo
+        nelle metà che falliscono. Restituisce (righe_ok, righe_skippate, statement).
+        """
+        mid = len(records) // 2
+        ok, err, statements = 0, 0, 0
+        for half in (records[:mid], records[mid:]):
+            statements += 1
+            error = self._write_batch(session, mapping, half, table)
+            if error is None:
+                ok += len(half)
+            elif len(half) == 1:
+                err += 1
+                self._log_skipped_row(mapping, half[0], error, logger)
+            else:
+                half_ok, half_err, half_statements = self._bisect_batch(
+                    session, mapping, half, logger, table
+                )
+                ok += half_ok
+                err += half_err
+                statements += half_statements
+        return ok, err, statements
+
+    def _write_batch(self, session, mapping, records, table=None):
+        """Scrive un batch sotto savepoint. Restituisce l'eccezione se fallisce, altrimenti None."""
         savepoint = session.begin_nested()
         try:
-            if mapping.requires_truncate():
-                self._execute_insert_batch(session, mapping, records)
+            if mapping.inserts_only():
+                self._execute_insert_batch(session, mapping, records, table)
             else:
                 self._execute_upsert_batch(session, mapping, records)
             savepoint.commit()
-            return len(records), 0
-        except Exception as batch_e:
+            return None
+        except Exception as e:
             savepoint.rollback()
-            logger.warning(
-                f"{operation_name} fallito su {len(records)} righe, retry singolo: "
-                f"{type(batch_e).__name__}: {batch_e}"
-            )
+            return e
 
-        ok, err = 0, 0
-        for rec in records:
-            row_sp = session.begin_nested()
-            try:
-                if mapping.requires_truncate():
-                    self._execute_insert_batch(session, mapping, [rec])
-                else:
-                    self._execute_upsert_batch(session, mapping, [rec])
-                row_sp.commit()
-                ok += 1
-            except Exception as row_e:
-                row_sp.rollback()
-                err += 1
-                # #region agent log
-                if rec.get("art_equivalente"):
-                    from ..utils.debug_session_log import debug_log
-                    debug_log(
-                        "engine.py:_execute_batch_with_fallback",
-                        "row skipped with art_equivalente",
-                        {
-                            "record_id": self._record_label(mapping, rec),
-                            "art_equivalente": rec.get("art_equivalente"),
-                            "error": f"{type(row_e).__name__}: {row_e}",
-                        },
-                        hypothesis_id="H3,H4",
-                    )
-                # #endregion
-                log_database_error(
-                    logger,
-                    f"Riga skippata ({self._record_label(mapping, rec)})",
-                    row_e,
-                )
-        if err:
-            logger.warning(f"{operation_name}: {ok} righe salvate, {err} skippate")
-        return ok, err
+    def _log_skipped_row(self, mapping, rec, row_e, logger):
+        # #region agent log
+        if rec.get("art_equivalente"):
+            from ..utils.debug_session_log import debug_log
+            debug_log(
+                "engine.py:_execute_batch_with_fallback",
+                "row skipped with art_equivalente",
+                {
+                    "record_id": self._record_label(mapping, rec),
+                    "art_equivalente": rec.get("art_equivalente"),
+                    "error": f"{type(row_e).__name__}: {row_e}",
+                },
+                hypothesis_id="H3,H4",
+            )
+        # #endregion
+        log_database_error(
+            logger,
+            f"Riga skippata ({self._record_label(mapping, rec)})",
+            row_e,
+        )
     
-    def _execute_insert_batch(self, session, mapping, records):
+    def _execute_insert_batch(self, session, mapping, records, table=None):
         """Esegue insert semplice di un batch di record (per truncate_insert)"""
         if not records:
             return
-        
-        stmt = insert(mapping.pg_model).values(records).on_conflict_do_nothing()
+        if table is None:
+            table = mapping.pg_model.__table__
+
+        if mapping.uses_copy() and len(records) >= _COPY_MIN_ROWS:
+            copy_insert_batch(session, table, records)
+            return
+
+        stmt = insert(table).values(records).on_conflict_do_nothing()
         session.execute(stmt)
         session.flush()  # Libera la memoria senza fare commit
     
@@ -330,13 +955,14 @@ class SyncEngine:
         if not records:
             return
         
-        stmt = insert(mapping.pg_model).values(records)
+        table = mapping.pg_model.__table__
+        stmt = insert(table).values(records)
         
         # Usa le colonne della chiave primaria PostgreSQL per il conflict
         pg_primary_keys = mapping.get_pg_primary_key_columns()
         
         # Trova le colonne che NON sono primary key
-        non_pk_columns = [col.name for col in mapping.pg_model.__table__.columns
+        non_pk_columns = [col.name for col in table.columns
                         if col.name not in pg_primary_keys]
         # Aggiorna solo colonne presenti nel payload sync (es. art_equivalente non mappato da SAP)
         synced_columns = set()
@@ -346,13 +972,29 @@ class SyncEngine:
 
         # Se ci sono colonne non-PK, usa ON CONFLICT DO UPDATE
         if update_columns:
+            where = None
+            if mapping.skip_unchanged:
+                # Riscrive solo le righe con almeno una colonna cambiata
+                where = tuple_(*(table.c[col] for col in update_columns)).is_distinct_from(
+                    tuple_(*(stmt.excluded[col] for col in update_columns))
+                )
             stmt = stmt.on_conflict_do_update(
                 index_elements=pg_primary_keys,
-                set_={col_name: stmt.excluded[col_name] for col_name in update_columns}
+                set_={col_name: stmt.excluded[col_name] for col_name in update_columns},
+                where=where,
             )
         else:
             # Se tutte le colonne sono PK, usa ON CONFLICT DO NOTHING
             stmt = stmt.on_conflict_do_nothing(index_elements=pg_primary_keys)
         
-        session.execute(stmt)
+        # xmax = 0 solo per le righe appena inserite; le righe non restituite sono invariate
+        stmt = stmt.returning(literal_column('(xmax = 0)').label('inserted'))
+        written = session.execute(stmt).scalars().all()
+        inserted = sum(1 for flag in written if flag)
+        self._count_upserts(inserted, len(written) - inserted, len(records) - len(written))
         session.flush()  # Libera la memoria senza fare commit
+
+    def _count_upserts(self, inserted: int, updated: int, unchanged: int) -> None:
+        self.upsert_counts['inserted'] += inserted
+        self.upsert_counts['updated'] += updated
+        self.upsert_counts['unchanged'] += unchanged
@@ -0,0 +1,118 @@
+"""
+Sincronizzazione delle righe documento guidata dalle testate (strategia HEADER_DELTA).
+
+Una sola query sulle testate della finestra (id documento, UpdateDate, UpdateTS)
+fornisce:
+- i documenti modificati dopo il watermark, di cui cancellare e reinserire le righe;
+- i documenti ancora nella finestra: le righe degli altri documenti vengono rimosse;
+- il nuovo watermark (UpdateDate/UpdateTS massimi tra le testate).
+
+Il costo di un ciclo dipende quindi dal numero di documenti modificati e non
+dalle righe dell'intera finestra. Il ricaricamento completo (come TRUNCATE_INSERT)
+resta per il primo avvio, la tabella vuota, i cicli con troppi documenti modificati
+e, ogni HEADER_DELTA_FULL_RELOAD_HOURS ore, per le righe la cui presenza o i cui
+valori dipendono da dati esterni alla testata senza cambiarne UpdateDate/UpdateTS
+(filtro QryGroup14/15/16 di OITM sulle righe ordine, riferimento a un ordine
+arrivato in PG dopo la riga entrata merci). L'ultimo ricaricamento completo è in
+sap.sync_state con chiave full_reload_state(tabella).
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Table, text
+from sqlalchemy.orm import Session
+
+from ..config.settings import Settings
+from ..utils.transformers import parse_update_ts
+
+# Oltre questa soglia conviene il ricaricamento completo; resta anche sotto il
+# limite di 2100 parametri per statement di SQL Server (filtro IN sui documenti).
+MAX_CHANGED_DOCUMENTS = 2000
+
+
+@dataclass
+class DocumentHeaders:
+    """Testate della finestra SAP lette all'inizio del sync delle righe."""
+    window: List[int] = field(default_factory=list)
+    changed: List[int] = field(default_factory=list)
+    watermark: Optional[datetime] = None
+    # Documenti usciti dalla finestra con righe rimosse (valorizzato da delete_documents)
+    trimmed: List[int] = field(default_factory=list)
+    # Valori di mapping.reference_column delle righe cancellate (valorizzato da delete_documents)
+    released: Set[int] = field(default_factory=set)
+
+
+def split_headers(rows: Iterable[Tuple], last_sync: Optional[datetime]) -> DocumentHeaders:
+    """
+    Classifica le righe (id documento, UpdateDate, UpdateTS) della query testate.
+    Senza last_sync tutti i documenti sono modificati; una testata senza
+    timestamp viene considerata modificata.
+    """
+    headers = DocumentHeaders()
+    for doc_id, update_date, update_ts in rows:
+        headers.window.append(doc_id)
+        updated_at = parse_update_ts(update_date, update_ts)
+        if last_sync is None or updated_at is None or updated_at > last_sync:
+            headers.changed.append(doc_id)
+        if updated_at is not None and (headers.watermark is None or updated_at > headers.watermark):
+            headers.watermark = updated_at
+    return headers
+
+
+def read_document_headers(sap_session: Session, mapping, last_sync: Optional[datetime]) -> DocumentHeaders:
+    """Esegue header_query su SAP e classifica i documenti rispetto a last_sync."""
+    rows = sap_session.execute(text(mapping.header_query)).fetchall()
+    return split_headers(rows, last_sync)
+
+
+def full_reload_state(table_name: str) -> str:
+    """Chiave di sap.sync_state con l'ultimo ricaricamento completo delle righe di `table_name`."""
+    return f'{table_name}.ricaricamentoCompleto'
+
+
+def full_reload_due(last_reload: Optional[datetime], now: datetime) -> bool:
+    interval = timedelta(hours=Settings.get_header_delta_full_reload_hours())
+    return last_reload is None or now - last_reload >= interval
+
+
+def table_is_empty(session: Session, table: Table) -> bool:
+    return not session.execute(text(f'SELECT EXISTS (SELECT 1 FROM {table.fullname})')).scalar()
+
+
+def delete_documents(session: Session, mapping, headers: DocumentHeaders) -> Tuple[int, int]:
+    """
+    Cancella le righe dei documenti modificati (reinserite dal sync) e quelle dei
+    documenti usciti dalla finestra, registrati in headers.trimmed. Con
+    mapping.reference_column i valori referenziati dalle righe cancellate finiscono
+    in headers.released.
+    Restituisce (righe_modificate, righe_fuori_finestra).
+    """
+    table = mapping.pg_model.__table__
+    column = f'"{mapping.document_column}"'
+    reference = f'"{mapping.reference_column}"' if mapping.reference_column else 'NULL'
+    changed = 0
+    if headers.changed:
+        removed = session.execute(
+            text(
+                f'WITH removed AS (DELETE FROM {table.fullname} WHERE {column} = ANY(:ids) '
+                f'RETURNING {reference} AS reference) '
+                f'SELECT reference, COUNT(*) FROM removed GROUP BY reference'
+            ),
+            {'ids': headers.changed},
+        ).fetchall()
+        changed = sum(count for _, count in removed)
+        headers.released.update(ref for ref, _ in removed if ref is not None)
+    removed = session.execute(
+        text(
+            f'WITH removed AS (DELETE FROM {table.fullname} WHERE {column} <> ALL(:ids) '
+            f'RETURNING {column} AS document, {reference} AS reference) '
+            f'SELECT document, reference, COUNT(*) FROM removed GROUP BY document, reference'
+        ),
+        {'ids': headers.window},
+    ).fetchall()
+    headers.trimmed = sorted({doc_id for doc_id, _, _ in removed})
+    headers.released.update(ref for _, ref, _ in removed if ref is not None)
+    return changed, sum(count for _, _, count in removed)
@@ -7,14 +7,24 @@ Logica allineata a STM_Scheduler.services.magazzino_service.sync_magazzino_from_
 from __future__ import annotations
 
 import logging
+from typing import Iterable, Optional
 
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
 
+# Nota su conflitto: EXCLUDED.note contiene già 'Sincronizzato da SAP - <descrizione>'
+# della riga sorgente (nessuna subquery correlata su anagrafica_articoli).
+_MERGED_NOTE = """CASE
+        WHEN magazzino.note NOT LIKE '%Sincronizzato da SAP%'
+        THEN CONCAT(magazzino.note, ' - ', EXCLUDED.note)
+        ELSE EXCLUDED.note
+    END"""
+
 # Mantenere allineata a magazzino_service.sync_magazzino_from_sap (STM_Scheduler).
-_BOOTSTRAP_MAGAZZINO_SQL = """
+# Le righe la cui nota non cambierebbe non vengono riscritte (data_aggiornamento invariata).
+_BOOTSTRAP_MAGAZZINO_TEMPLATE = """
 INSERT INTO magazzino (articolo, posizione, quantita, note)
 SELECT
     sa.id AS articolo,
@@ -22,29 +32,43 @@ SELECT
     0 AS quantita,
     CONCAT('Sincronizzato da SAP - ', COALESCE(sa.description, '')) AS note
 FROM sap.anagrafica_articoli sa
-WHERE sa.id IS NOT NULL AND TRIM(sa.id) != ''
+WHERE sa.id IS NOT NULL AND TRIM(sa.id) != ''{scope}
 ON CONFLICT (articolo, posizione)
 DO UPDATE SET
-    note = CASE
-        WHEN magazzino.note NOT LIKE '%Sincronizzato da SAP%'
-        THEN CONCAT(magazzino.note, ' - Sincronizzato da SAP - ',
-             COALESCE((SELECT description FROM sap.anagrafica_articoli WHERE id = EXCLUDED.articolo), ''))
-        ELSE CONCAT('Sincronizzato da SAP - ',
-             COALESCE((SELECT description FROM sap.anagrafica_articoli WHERE id = EXCLUDED.articolo), ''))
-    END,
+    note = {merged_note},
     data_aggiornamento = CURRENT_TIMESTAMP
+WHERE magazzino.note IS DISTINCT FROM {merged_note}
 """.strip()
 
+_BOOTSTRAP_MAGAZZINO_SQL = _BOOTSTRAP_MAGAZZINO_TEMPLATE.format(scope='', merged_note=_MERGED_NOTE)
+
+# Solo gli articoli toccati dal ciclo corrente (sync delta).
+_BOOTSTRAP_MAGAZZINO_ARTICOLI_SQL = _BOOTSTRAP_MAGAZZINO_TEMPLATE.format(
+    scope='\n  AND sa.id = ANY(CAST(:articoli AS text[]))',
+    merged_note=_MERGED_NOTE,
+)
+
 
-def bootstrap_magazzino_from_sap(pg_session: Session) -> int:
+def bootstrap_magazzino_from_sap(pg_session: Session, article_ids: Optional[Iterable[str]] = None) -> int:
     """
-    Inserisce righe magazzino (quantita=0) per tutti gli articoli SAP.
-    Su conflitto aggiorna solo note e data_aggiornamento, mai quantita.
+    Inserisce righe magazzino (quantita=0) per gli articoli SAP: tutti se
+    article_ids è None (bootstrap completo), altrimenti solo quelli indicati.
+    Su conflitto aggiorna solo note e data_aggiornamento, mai quantita,
+    e solo se la nota cambia.
 
     Returns:
         Numero di righe inserite/aggiornate (rowcount).
     """
-    result = pg_session.execute(text(_BOOTSTRAP_MAGAZZINO_SQL))
+    if article_ids is None:
+        result = pg_session.execute(text(_BOOTSTRAP_MAGAZZINO_SQL))
+        scope = 'completo'
+    else:
+        article_ids = list(article_ids)
+        if not article_ids:
+            logger.info('Bootstrap magazzino da SAP: nessun articolo toccato dal sync')
+            return 0
+        result = pg_session.execute(text(_BOOTSTRAP_MAGAZZINO_ARTICOLI_SQL), {'articoli': article_ids})
+        scope = f'{len(article_ids)} articoli'
     rowcount = result.rowcount or 0
-    logger.info('Bootstrap magazzino da SAP: %s righe inserite/aggiornate', rowcount)
+    logger.info('Bootstrap magazzino da SAP (%s): %s righe inserite/aggiornate', scope, rowcount)
     return rowcount
@@ -9,17 +9,23 @@ Non inserisce righe in magazzino: aggiorna solo ciò creato da bootstrap_magazzi
 
 Join MODULA: ART_ARTICOLO / SCO_ARTICOLO = descrizione articolo SAP
 (sap.anagrafica_articoli.description, da OITM.ItemName).
+
+Descrizione -> id articolo viene risolta in memoria; scorta e giacenza per articolo
+sono caricate con un solo COPY e applicate con due UPDATE set-based (stock_enrichment),
+indipendentemente dal numero di articoli MODULA.
 """
 from __future__ import annotations
 
 import logging
+import time
 from collections import defaultdict
 
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from ..config.database import DatabaseConfig
+from ..config.database import DatabaseConfig, get_database_config
 from ..utils.transformers import safe_float
+from .stock_enrichment import stage_stock, update_magazzino_quantita
 
 logger = logging.getLogger(__name__)
 
@@ -60,50 +66,59 @@ def _load_modula_by_description(pg_session: Session) -> dict[str, list[str]]:
     return dict(index)
 
 
-def _update_modula_magazzino(
-    pg_session: Session,
-    articolo_id: str,
-    quantita: float,
+_STAGE_TABLE = '_stage_modula_stock'
+_STAGE_COLUMNS = [
+    ('articolo', 'text'),
+    ('scorta_minima', 'double precision'),
+    ('quantita', 'double precision'),
+]
+
+_UPDATE_SCORTA_SQL = f"""
+UPDATE sap.anagrafica_articoli sa
+SET scorta_minima = s.scorta_minima
+FROM {_STAGE_TABLE} s
+WHERE sa.id = s.articolo
+  AND sa.categoria = 'MODULA'
+  AND s.scorta_minima IS NOT NULL
+  AND sa.scorta_minima IS DISTINCT FROM s.scorta_minima
+"""
+
+
+def resolve_modula_stock(
+    scorta_rows,
+    giacenza_rows,
+    modula_by_descr: dict[str, list[str]],
     stats: dict,
-) -> None:
-    try:
-        result = pg_session.execute(
-            text(
-                """
-                UPDATE magazzino m
-                SET quantita = :quantita,
-                    data_aggiornamento = CURRENT_TIMESTAMP,
-                    note = CASE
-                        WHEN m.note IS NULL OR TRIM(m.note) = ''
-                        THEN :note
-                        WHEN m.note NOT LIKE '%MODULA%'
-                        THEN m.note || ' - ' || :note
-                        ELSE m.note
-                    END
-                FROM sap.anagrafica_articoli sa
-                WHERE m.articolo = sa.id
-                  AND sa.id = :articolo
-                  AND sa.categoria = 'MODULA'
-                  AND m.posizione = COALESCE(NULLIF(TRIM(sa.ubicazione), ''), 'NON_SPECIFICATA')
-                """
-            ),
-            {
-                'articolo': articolo_id,
-                'quantita': quantita,
-                'note': 'Arricchito da MODULA',
-            },
-        )
-        if result.rowcount:
-            stats['updated_magazzino'] += 1
-        else:
-            stats['skipped'] += 1
-            logger.debug(
-                'Nessuna riga magazzino per %s (bootstrap_magazzino_from_sap?)',
-                articolo_id,
-            )
-    except Exception as e:
-        logger.error('Aggiornamento magazzino %s fallito: %s', articolo_id, e)
-        stats['errors'] += 1
+) -> dict[str, dict]:
+    """
+    Valori per id articolo (scorta_minima, quantita) dalle righe MODULA per descrizione,
+    con fan-out sugli articoli SAP che condividono la stessa descrizione.
+    Incrementa stats['skipped'] per righe senza articolo corrispondente o senza valore.
+    """
+    by_articolo: dict[str, dict] = {}
+
+    def assign(rows, column):
+        for row in rows:
+            row_map = row._mapping
+            descr = (row_map.get('articolo_descr') or '').strip()
+            articolo_ids = modula_by_descr.get(descr)
+            if not descr or not articolo_ids:
+                stats['skipped'] += 1
+                continue
+            value = safe_float(row_map.get(column))
+            if value is None:
+                stats['skipped'] += 1
+                continue
+            for articolo_id in articolo_ids:
+                record = by_articolo.setdefault(
+                    articolo_id,
+                    {'articolo': articolo_id, 'scorta_minima': None, 'quantita': None},
+                )
+                record[column] = value
+
+    assign(scorta_rows, 'scorta_minima')
+    assign(giacenza_rows, 'quantita')
+    return by_articolo
 
 
 def enrich_modula_stock(pg_session: Session, db_config: DatabaseConfig | None = None) -> dict:
@@ -112,16 +127,18 @@ def enrich_modula_stock(pg_session: Session, db_config: DatabaseConfig | None =
     leggendo i dati da SYSTOREDB.
 
     Returns:
-        dict con statistiche (updated_anagrafica, updated_magazzino, skipped, errors).
+        dict con statistiche: updated_anagrafica / updated_magazzino (righe effettivamente
+        modificate), unchanged (righe già allineate, non riscritte), skipped, errors.
     """
     stats = {
         'updated_anagrafica': 0,
         'updated_magazzino': 0,
+        'unchanged': 0,
         'skipped': 0,
         'errors': 0,
     }
 
-    config = db_config or DatabaseConfig()
+    config = db_config or get_database_config()
     if not config.modula_db_url:
         logger.info('MODULA non configurato: skip arricchimento stock MODULA')
         return stats
@@ -142,58 +159,40 @@ def enrich_modula_stock(pg_session: Session, db_config: DatabaseConfig | None =
     finally:
         modula_session.close()
 
-    for row in scorta_rows:
-        row_map = dict(row._mapping)
-        descr = (row_map.get('articolo_descr') or '').strip()
-        articolo_ids = modula_by_descr.get(descr)
-        if not descr or not articolo_ids:
-            stats['skipped'] += 1
-            continue
-
-        scorta = safe_float(row_map.get('scorta_minima'))
-        if scorta is None:
-            stats['skipped'] += 1
-            continue
-
-        for articolo_id in articolo_ids:
-            try:
-                pg_session.execute(
-                    text(
-                        """
-                        UPDATE sap.anagrafica_articoli
-                        SET scorta_minima = :scorta_minima
-                        WHERE id = :id AND categoria = 'MODULA'
-                        """
-                    ),
-                    {'id': articolo_id, 'scorta_minima': scorta},
-                )
-                stats['updated_anagrafica'] += 1
-            except Exception as e:
-                logger.error('Aggiornamento scorta_minima %s fallito: %s', articolo_id, e)
-                stats['errors'] += 1
-
-    for row in giacenza_rows:
-        row_map = dict(row._mapping)
-        descr = (row_map.get('articolo_descr') or '').strip()
-        articolo_ids = modula_by_descr.get(descr)
-        if not descr or not articolo_ids:
-            stats['skipped'] += 1
-            continue
-
-        quantita = safe_float(row_map.get('quantita'))
-        if quantita is None:
-            stats['skipped'] += 1
-            continue
-
-        for articolo_id in articolo_ids:
-            _update_modula_magazzino(pg_session, articolo_id, quantita, stats)
-
-    pg_session.flush()
+    start = time.time()
+    by_articolo = resolve_modula_stock(scorta_rows, giacenza_rows, modula_by_descr, stats)
+    with_scorta = sum(1 for rec in by_articolo.values() if rec['scorta_minima'] is not None)
+    with_quantita = sum(1 for rec in by_articolo.values() if rec['quantita'] is not None)
+
+    if by_articolo:
+        savepoint = pg_session.begin_nested()
+        try:
+            stage_stock(pg_session, _STAGE_TABLE, _STAGE_COLUMNS, by_articolo.values())
+            updated_anagrafica = pg_session.execute(text(_UPDATE_SCORTA_SQL)).rowcount or 0
+            matched, updated_magazzino = update_magazzino_quantita(
+                pg_session, _STAGE_TABLE, 'MODULA', 'MODULA'
+            )
+            savepoint.commit()
+        except Exception as e:
+            savepoint.rollback()
+            logger.error('Aggiornamento stock MODULA fallito: %s', e)
+            stats['errors'] += 1
+        else:
+            stats['updated_anagrafica'] = updated_anagrafica
+            stats['updated_magazzino'] = updated_magazzino
+            stats['unchanged'] = (with_scorta - updated_anagrafica) + (matched - updated_magazzino)
+            # Articoli con giacenza ma senza riga magazzino (bootstrap_magazzino_from_sap?)
+            stats['skipped'] += with_quantita - matched
+
     logger.info(
-        'Arricchimento MODULA completato: anagrafica=%s magazzino=%s skipped=%s errors=%s',
+        'Arricchimento MODULA completato: anagrafica=%s magazzino=%s unchanged=%s '
+        'skipped=%s errors=%s (%s articoli, %.2fs)',
         stats['updated_anagrafica'],
         stats['updated_magazzino'],
+        stats['unchanged'],
         stats['skipped'],
         stats['errors'],
+        len(by_articolo),
+        time.time() - start,
     )
     return stats
@@ -0,0 +1,227 @@
+"""
+Profiler per stadio del ciclo di sincronizzazione.
+
+Un RunProfiler raccoglie, per ogni tabella (o job del grafo) del ciclo, timer
+nominati (durata cumulata e numero di chiamate) e contatori per stadio, e a fine
+ciclo scrive una riga in sap.sync_runs e una riga per (tabella, stadio) in
+sap.sync_run_stages (migrazione 011).
+
+Ogni TableProfile è aggiornato solo dal thread che esegue il nodo; il codice
+annidato (es. callback post_sync) lo raggiunge con current(). Con
+SYNC_PROFILER=false si usano gli oggetti nulli: stage() restituisce un context
+manager condiviso che non misura nulla, quindi il costo resta una chiamata a
+metodo per stadio.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ..config.settings import Settings
+
+# Nome "tabella" degli stadi del ciclo non legati a una tabella (es. refresh dei pool)
+CYCLE = '_ciclo'
+
+
+class _StageTimer:
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile: 'TableProfile', name: str):
+        self.profile = profile
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profile.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class TableProfile:
+    """Stadi di una tabella: {stadio: [secondi, chiamate, contatori]}."""
+
+    enabled = True
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.stages: Dict[str, list] = {}
+
+    def _stage(self, name: str) -> list:
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = [0.0, 0, {}]
+        return stage
+
+    def stage(self, name: str) -> _StageTimer:
+        """Context manager che somma la durata del blocco allo stadio `name`."""
+        return _StageTimer(self, name)
+
+    def add(self, name: str, seconds: float, calls: int = 1, **counters) -> None:
+        """Somma una durata già misurata (e contatori) allo stadio `name`."""
+        stage = self._stage(name)
+        stage[0] += seconds
+        stage[1] += calls
+        if counters:
+            self.count(name, **counters)
+
+    def count(self, name: str, **counters) -> None:
+        """Somma contatori allo stadio `name` (righe, statement, ...)."""
+        values = self._stage(name)[2]
+        for key, value in counters.items():
+            if value:
+                values[key] = values.get(key, 0) + value
+
+    def records(self) -> List[dict]:
+        return [
+            {
+                'table_name': self.table_name,
+                'stage': name,
+                'duration_seconds': seconds,
+                'calls': calls,
+                'counters': counters or None,
+            }
+            for name, (seconds, calls, counters) in self.stages.items()
+        ]
+
+
+class _NullStageTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullStageTimer()
+
+
+class NullTableProfile:
+    """TableProfile inattivo: nessuna misura, nessuna allocazione per stadio."""
+
+    enabled = False
+    table_name = None
+
+    def stage(self, name: str) -> _NullStageTimer:
+        return _NULL_TIMER
+
+    def add(self, name: str, seconds: float, calls: int = 1, **counters) -> None:
+        pass
+
+    def count(self, name: str, **counters) -> None:
+        pass
+
+    def records(self) -> List[dict]:
+        return []
+
+
+NULL_TABLE_PROFILE = NullTableProfile()
+
+_local = threading.local()
+
+
+def current():
+    """TableProfile attivo nel thread corrente (nullo se nessuno)."""
+    return getattr(_local, 'profile', None) or NULL_TABLE_PROFILE
+
+
+def set_current(profile) -> None:
+    """Attiva `profile` per il thread corrente (None per disattivare)."""
+    _local.profile = profile
+
+
+class RunProfiler:
+    """Profilo di un ciclo: un TableProfile per nodo, persistito da finish()."""
+
+    enabled = True
+
+    def __init__(self, trigger: str = 'scheduler', force_full: bool = False):
+        self.trigger = trigger
+        self.force_full = force_full
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._tables: Dict[str, TableProfile] = {}
+        self.run_id: Optional[int] = None
+
+    def table(self, table_name: str) -> TableProfile:
+        with self._lock:
+            profile = self._tables.get(table_name)
+            if profile is None:
+                profile = self._tables[table_name] = TableProfile(table_name)
+            return profile
+
+    def records(self) -> List[dict]:
+        with self._lock:
+            profiles = list(self._tables.values())
+        return [record for profile in profiles for record in profile.records()]
+
+    def finish(self, success: bool, logger=None, db_config=None) -> Optional[int]:
+        """
+        Scrive il ciclo e i suoi stadi su PostgreSQL. Non solleva: un errore di
+        scrittura viene solo segnalato. Restituisce l'id del ciclo.
+        """
+        from ..models.sync_runs import SAP_SyncRun, SAP_SyncRunStage
+
+        duration = time.perf_counter() - self._start
+        session = None
+        try:
+            if db_config is None:
+                from ..config.database import get_database_config
+                db_config = get_database_config()
+            session = db_config.get_pg_session()
+            run = SAP_SyncRun(
+                started_at=self.started_at,
+                finished_at=datetime.now(),
+                duration_seconds=duration,
+                trigger=self.trigger,
+                force_full=self.force_full,
+                success=success,
+            )
+            session.add(run)
+            session.flush()
+            session.add_all(SAP_SyncRunStage(run_id=run.id, **record) for record in self.records())
+            session.commit()
+            self.run_id = run.id
+            return run.id
+        except Exception as e:
+            if session is not None:
+                session.rollback()
+            if logger is not None:
+                logger.warning(f"Profilo del ciclo non salvato: {type(e).__name__}: {e}")
+            return None
+        finally:
+            if session is not None:
+                session.close()
+
+
+class NullProfiler:
+    """Profiler inattivo (SYNC_PROFILER=false)."""
+
+    enabled = False
+    run_id = None
+
+    def table(self, table_name: str) -> NullTableProfile:
+        return NULL_TABLE_PROFILE
+
+    def records(self) -> List[dict]:
+        return []
+
+    def finish(self, success: bool, logger=None, db_config=None) -> None:
+        return None
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def create_run_profiler(trigger: str = 'scheduler', force_full: bool = False):
+    """RunProfiler se SYNC_PROFILER è attivo, altrimenti il profiler nullo."""
+    if Settings.is_profiler_enabled():
+        return RunProfiler(trigger, force_full)
+    return NULL_PROFILER
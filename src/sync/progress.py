@@ -0,0 +1,300 @@
+"""
+Avanzamento in tempo reale e annullamento dei sync.
+
+Un SyncProgress descrive un'esecuzione (ciclo dello scheduler o sync on-demand
+via API): per ogni tabella stato, stadio corrente, righe estratte e scritte,
+righe/s ed ETA. Il motore lo aggiorna a ogni batch dal thread di scrittura;
+/api/sync/status e /api/sync/events ne leggono uno snapshot.
+
+cancel() chiede l'interruzione: il motore la controlla al confine di ogni batch
+e solleva SyncCancelled, così la transazione della tabella viene annullata
+(rollback, watermark invariato) e le tabelle non ancora avviate non partono.
+
+L'ETA di una tabella si basa sulle righe estratte dall'ultima esecuzione
+completata della stessa tabella e modalità (full o delta), tenute in memoria
+nel processo: senza storico resta None.
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+SKIPPED = 'skipped'  # sonda di modifica invariata (TableMapping.change_probe)
+
+
+class SyncCancelled(Exception):
+    """Sync interrotto su richiesta (SyncProgress.cancel) al confine di un batch."""
+
+    def __init__(self, message: str = 'Sincronizzazione annullata su richiesta'):
+        super().__init__(message)
+
+
+class RowHistory:
+    """Righe estratte dall'ultima esecuzione completata per (tabella, full)."""
+
+    def __init__(self):
+        self._rows: Dict[Tuple[str, bool], int] = {}
+        self._lock = threading.Lock()
+
+    def expected(self, table_name: str, full: bool) -> Optional[int]:
+        with self._lock:
+            return self._rows.get((table_name, full))
+
+    def record(self, table_name: str, full: bool, rows: int) -> None:
+        with self._lock:
+            self._rows[(table_name, full)] = rows
+
+
+# Storico condiviso dal processo (scheduler loop e sync on-demand via API)
+row_history = RowHistory()
+
+
+class TableProgress:
+    """Avanzamento di una tabella; aggiornato dal thread che la sincronizza."""
+
+    enabled = True
+
+    def __init__(self, run: 'SyncProgress', table_name: str):
+        self.run = run
+        self.table_name = table_name
+        self.status = PENDING
+        self.stage: Optional[str] = None
+        self.full: Optional[bool] = None
+        self.rows_extracted = 0
+        self.rows_written = 0
+        self.expected_rows: Optional[int] = None
+        self.error: Optional[str] = None
+        self._start: Optional[float] = None
+        self._end: Optional[float] = None
+
+    def start(self) -> None:
+        with self.run._changed:
+            self.status = RUNNING
+            self.stage = None
+            self.rows_extracted = self.rows_written = 0
+            self.error = None
+            self._start = time.perf_counter()
+            self._end = None
+            self.run._touch()
+
+    def set_stage(self, stage: str) -> None:
+        with self.run._changed:
+            self.stage = stage
+            self.run._touch()
+
+    def set_mode(self, full: bool) -> None:
+        """Modalità del sync (ricaricamento completo o delta): sceglie lo storico per l'ETA."""
+        with self.run._changed:
+            self.full = full
+            self.expected_rows = self.run.history.expected(self.table_name, full)
+            self.run._touch()
+
+    def update(self, extracted: int, written: int) -> None:
+        with self.run._changed:
+            self.rows_extracted = extracted
+            self.rows_written = written
+            self.run._touch()
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        with self.run._changed:
+            self.status = status
+            self.error = error
+            self._end = time.perf_counter()
+            self.run._touch()
+        if status == DONE and self.full is not None:
+            self.run.history.record(self.table_name, self.full, self.rows_extracted)
+
+    def snapshot(self) -> dict:
+        """Stato corrente; da chiamare con il lock dell'esecuzione acquisito."""
+        elapsed = None
+        rows_per_second = None
+        eta = None
+        if self._start is not None:
+            elapsed = (self._end or time.perf_counter()) - self._start
+            if elapsed > 0 and self.rows_extracted:
+                rows_per_second = self.rows_extracted / elapsed
+        if (
+            self.status == RUNNING
+            and rows_per_second
+            and self.expected_rows
+            and self.rows_extracted < self.expected_rows
+        ):
+            eta = (self.expected_rows - self.rows_extracted) / rows_per_second
+        return {
+            'table': self.table_name,
+            'status': self.status,
+            'stage': self.stage,
+            'mode': None if self.full is None else ('full' if self.full else 'delta'),
+            'rows_extracted': self.rows_extracted,
+            'rows_written': self.rows_written,
+            'expected_rows': self.expected_rows,
+            'elapsed_seconds': None if elapsed is None else round(elapsed, 2),
+            'rows_per_second': None if rows_per_second is None else round(rows_per_second, 1),
+            'eta_seconds': None if eta is None else round(eta, 1),
+            'error': self.error,
+        }
+
+
+class SyncProgress:
+    """Avanzamento di un'esecuzione: un TableProgress per tabella e la richiesta di annullamento."""
+
+    enabled = True
+    _ids = itertools.count(1)
+
+    def __init__(
+        self,
+        trigger: str,
+        tables: Iterable[str] = (),
+        force_full: bool = False,
+        history: Optional[RowHistory] = None,
+    ):
+        self.id = next(self._ids)
+        self.trigger = trigger
+        self.force_full = force_full
+        self.history = history or row_history
+        self.started_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.status = RUNNING
+        self.version = 0
+        self._changed = threading.Condition()
+        self._cancel = threading.Event()
+        self._tables: Dict[str, TableProgress] = {name: TableProgress(self, name) for name in tables}
+
+    def _touch(self) -> None:
+        # Chiamato con il lock acquisito: sveglia i lettori in attesa (SSE)
+        self.version += 1
+        self._changed.notify_all()
+
+    def table(self, table_name: str) -> TableProgress:
+        with self._changed:
+            progress = self._tables.get(table_name)
+            if progress is None:
+                progress = self._tables[table_name] = TableProgress(self, table_name)
+            return progress
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self) -> bool:
+        """Chiede l'annullamento. False se l'esecuzione è già terminata."""
+        with self._changed:
+            if self.status != RUNNING:
+                return False
+            self._cancel.set()
+            self._touch()
+            return True
+
+    def check_cancelled(self) -> None:
+        """Solleva SyncCancelled se è stato chiesto l'annullamento."""
+        if self._cancel.is_set():
+            raise SyncCancelled()
+
+    def finish(self) -> None:
+        """Chiude l'esecuzione: le tabelle mai avviate restano pending (o cancelled se annullata)."""
+        with self._changed:
+            cancelled = self._cancel.is_set()
+            if cancelled:
+                for progress in self._tables.values():
+                    if progress.status == PENDING:
+                        progress.status = CANCELLED
+            self.status = CANCELLED if cancelled else DONE
+            self.finished_at = datetime.now()
+            self._touch()
+
+    def wait(self, version: int, timeout: float) -> int:
+        """Attende un aggiornamento successivo a `version` (al più `timeout` secondi)."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def snapshot(self) -> dict:
+        with self._changed:
+            tables = [progress.snapshot() for progress in self._tables.values()]
+            version = self.version
+            status = self.status
+        finished_at = self.finished_at
+        running_etas = [t['eta_seconds'] for t in tables if t['status'] == RUNNING]
+        return {
+            'id': self.id,
+            'version': version,
+            'trigger': self.trigger,
+            'force_full': self.force_full,
+            'status': status,
+            'cancel_requested': self.cancel_requested,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'finished_at': finished_at.isoformat(timespec='seconds') if finished_at else None,
+            'rows_extracted': sum(t['rows_extracted'] for t in tables),
+            'rows_written': sum(t['rows_written'] for t in tables),
+            'current_tables': [t['table'] for t in tables if t['status'] == RUNNING],
+            # Tabelle in corso: l'esecuzione non termina prima della più lenta
+            'eta_seconds': max(running_etas) if running_etas and None not in running_etas else None,
+            'tables': tables,
+        }
+
+
+class NullTableProgress:
+    """TableProgress inattivo: nessun aggiornamento."""
+
+    enabled = False
+    table_name = None
+
+    def start(self) -> None:
+        pass
+
+    def set_stage(self, stage: str) -> None:
+        pass
+
+    def set_mode(self, full: bool) -> None:
+        pass
+
+    def update(self, extracted: int, written: int) -> None:
+        pass
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        pass
+
+
+NULL_TABLE_PROGRESS = NullTableProgress()
+
+
+class NullSyncProgress:
+    """SyncProgress inattivo (sync senza monitoraggio, es. benchmark): mai annullato."""
+
+    enabled = False
+    cancel_requested = False
+
+    def table(self, table_name: str) -> NullTableProgress:
+        return NULL_TABLE_PROGRESS
+
+    def check_cancelled(self) -> None:
+        pass
+
+
+NULL_PROGRESS = NullSyncProgress()
+
+_current_lock = threading.Lock()
+_latest: Optional[SyncProgress] = None
+
+
+def start_run(trigger: str, tables: Iterable[str] = (), force_full: bool = False) -> SyncProgress:
+    """Crea l'avanzamento di una nuova esecuzione e lo rende quello pubblicato dall'API."""
+    global _latest
+    progress = SyncProgress(trigger, tables, force_full)
+    with _current_lock:
+        _latest = progress
+    return progress
+
+
+def latest() -> Optional[SyncProgress]:
+    """Esecuzione in corso o, se nessuna, l'ultima terminata (None se mai avviata)."""
+    with _current_lock:
+        return _latest
@@ -1,17 +1,55 @@
 """
 Riconciliazione RFQ con ordini di acquisto SAP.
 
-Per ogni richiesta di offerta con stato IN ('NEW', 'PROCESSED'), cerca il primo
-ordine di acquisto SAP con:
+Per ogni richiesta di offerta ancora aperta (ordine_acquisto_id NULL), cerca il
+primo ordine di acquisto SAP con:
   - stesso cod_business_partner
   - almeno una riga con lo stesso cod_articolo
   - doc_date > created_at della RFQ
 
-Se trovato, imposta stato='COMPLETED' e ordine_acquisto_id sull'intera batch
-di RFQ aperte per quella coppia (cod_articolo, cod_business_partner).
+Se trovato, imposta ordine_acquisto_id sull'intera batch di RFQ aperte per
+quella coppia (cod_articolo, cod_business_partner).
+
+La riconciliazione è incrementale, con due watermark in sap.sync_state:
+  - RFQ nuove (created_at >= watermark RFQ - RFQ_WATERMARK_OVERLAP): confrontate
+    con tutti gli ordini. created_at non segue l'ordine di commit (una RFQ
+    committata dopo il ciclo può avere created_at precedente al massimo letto):
+    il margine le rilegge, rivalutare una RFQ aperta è innocuo;
+  - RFQ già valutate e ancora aperte: confrontate solo con gli ordini
+    inseriti o aggiornati dopo il watermark ordini (last_synced_at). Nei sync
+    per documento (HEADER_DELTA) le righe ordine vengono riscritte solo con la
+    testata modificata, quindi il watermark delle testate copre anche le righe.
+Senza watermark (primo avvio), con full=True o se nel ciclo le righe ordine sono
+state ricaricate per intero (scope: nuove righe anche sotto ordini invariati)
+tutte le RFQ aperte vengono confrontate con tutti gli ordini.
+Se nel ciclo testate o righe ordine non sono state sincronizzate (nodo fallito o
+annullato) il watermark ordini non avanza: le testate già scritte possono avere
+righe mancanti, caricate al ciclo successivo sotto testate non più modificate.
 """
+from __future__ import annotations
+
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .cleanup import CleanupScope
+from .services import SyncStateService
+
+# Chiavi di sap.sync_state (stesso nome del nodo job nel grafo di sincronizzazione)
+ORDERS_WATERMARK = 'riconciliazioneRfq'
+RFQ_WATERMARK = 'riconciliazioneRfq.richieste'
+
+# Margine di rilettura delle RFQ prima del watermark (commit tardivi con created_at precedente)
+RFQ_WATERMARK_OVERLAP = timedelta(hours=1)
+
+# Tabelle del ciclo il cui ricaricamento completo (CleanupScope None) richiede la riconciliazione completa
+FULL_RELOAD_SOURCES = ('ordiniAcquistoLines',)
 
-from sqlalchemy import create_engine, text
+# Tabelle del ciclo il cui fallimento blocca l'avanzamento del watermark ordini
+ORDERS_WATERMARK_SOURCES = ('ordiniAcquisto', 'ordiniAcquistoLines')
 
 
 _RECONCILE_SQL = text("""
@@ -20,15 +58,20 @@ WITH open_rfq AS (
         r.id,
         r.cod_articolo,
         r.cod_business_partner,
-        r.created_at
+        r.created_at,
+        (CAST(:rfq_since AS timestamp) IS NULL OR r.created_at >= :rfq_since) AS is_new
     FROM sap.richieste_offerte r
     WHERE r.ordine_acquisto_id IS NULL
 ),
-best_order AS (
-    SELECT DISTINCT ON (r.cod_articolo, r.cod_business_partner)
-        r.cod_articolo,
-        r.cod_business_partner,
-        o.id AS ordine_acquisto_id
+changed_orders AS (
+    SELECT o.id, o.code, o.cod_business_partner, o.doc_date
+    FROM sap.ordini_acquisto o
+    WHERE CAST(:orders_since AS timestamp) IS NULL
+       OR o.last_synced_at IS NULL
+       OR o.last_synced_at >= :orders_since
+),
+candidates AS (
+    SELECT r.cod_articolo, r.cod_business_partner, o.id AS ordine_acquisto_id, o.doc_date
     FROM open_rfq r
     JOIN sap.ordini_acquisto o
         ON o.cod_business_partner = r.cod_business_partner
@@ -36,36 +79,117 @@ best_order AS (
     JOIN sap.ordini_acquisto_lines ol
         ON ol.cod_documento = o.code
         AND ol.cod_articolo = r.cod_articolo
-    ORDER BY r.cod_articolo, r.cod_business_partner, o.doc_date ASC
+    WHERE r.is_new
+    UNION ALL
+    SELECT r.cod_articolo, r.cod_business_partner, o.id AS ordine_acquisto_id, o.doc_date
+    FROM open_rfq r
+    JOIN changed_orders o
+        ON o.cod_business_partner = r.cod_business_partner
+        AND o.doc_date > r.created_at
+    JOIN sap.ordini_acquisto_lines ol
+        ON ol.cod_documento = o.code
+        AND ol.cod_articolo = r.cod_articolo
+    WHERE NOT r.is_new
+),
+best_order AS (
+    SELECT DISTINCT ON (c.cod_articolo, c.cod_business_partner)
+        c.cod_articolo,
+        c.cod_business_partner,
+        c.ordine_acquisto_id
+    FROM candidates c
+    ORDER BY c.cod_articolo, c.cod_business_partner, c.doc_date ASC
+),
+updated AS (
+    UPDATE sap.richieste_offerte r
+    SET
+        ordine_acquisto_id = b.ordine_acquisto_id
+    FROM best_order b
+    WHERE r.cod_articolo = b.cod_articolo
+      AND r.cod_business_partner = b.cod_business_partner
+      AND r.ordine_acquisto_id IS NULL
+    RETURNING r.id
 )
-UPDATE sap.richieste_offerte r
-SET
-    ordine_acquisto_id = b.ordine_acquisto_id
-FROM best_order b
-WHERE r.cod_articolo = b.cod_articolo
-  AND r.cod_business_partner = b.cod_business_partner
-  AND r.ordine_acquisto_id IS NULL
+SELECT
+    (SELECT COUNT(*) FROM open_rfq) AS rfq_open,
+    (SELECT COUNT(*) FROM open_rfq WHERE is_new) AS rfq_new,
+    (SELECT COUNT(*) FROM changed_orders) AS orders_changed,
+    (SELECT COUNT(*) FROM candidates) AS candidates,
+    (SELECT COUNT(*) FROM updated) AS closed,
+    (SELECT MAX(last_synced_at) FROM sap.ordini_acquisto) AS orders_watermark,
+    (SELECT MAX(created_at) FROM sap.richieste_offerte) AS rfq_watermark
 """)
 
 
-def reconcile_rfq_with_orders(postgres_url: str, logger) -> int:
+def _empty_stats() -> dict:
+    return {
+        'rfq_open': 0,
+        'rfq_new': 0,
+        'orders_changed': 0,
+        'candidates': 0,
+        'closed': 0,
+        'full': False,
+        'duration': 0.0,
+    }
+
+
+def reconcile_rfq_with_orders(
+    pg_session: Session, logger, full: bool = False, scope: Optional[CleanupScope] = None,
+) -> dict:
     """
-    Esegue la riconciliazione RFQ → ordini di acquisto.
-    Ritorna il numero di RFQ chiuse (passate a COMPLETED).
+    Esegue la riconciliazione RFQ → ordini di acquisto e aggiorna i watermark
+    nella stessa transazione. Con `scope` (documenti toccati nel ciclo) la
+    riconciliazione è completa se le righe ordine sono state ricaricate per intero
+    e il watermark ordini resta invariato se testate o righe non sono state sincronizzate.
+    Ritorna le statistiche del ciclo:
+    rfq_open/rfq_new (RFQ aperte lette, di cui nuove), orders_changed (ordini
+    modificati dopo il watermark), candidates (coppie RFQ-riga ordine valutate),
+    closed (RFQ riconciliate).
     """
+    stats = _empty_stats()
+    start = time.time()
     try:
-        engine = create_engine(postgres_url)
-        with engine.begin() as conn:
-            result = conn.execute(_RECONCILE_SQL)
-            closed = result.rowcount
-        engine.dispose()
-
-        if closed > 0:
-            logger.info(f"Riconciliate {closed} RFQ → stato=COMPLETED")
-        else:
-            logger.debug("Riconciliazione RFQ: nessuna corrispondenza trovata")
-
-        return closed
+        state = SyncStateService()
+        orders_since: Optional[datetime] = None
+        rfq_since: Optional[datetime] = None
+        if scope is not None and scope.documents(FULL_RELOAD_SOURCES) is None:
+            full = True
+        if not full:
+            orders_since = state.get_last_sync(pg_session, ORDERS_WATERMARK)
+            rfq_since = state.get_last_sync(pg_session, RFQ_WATERMARK)
+            if rfq_since is not None:
+                rfq_since -= RFQ_WATERMARK_OVERLAP
+        # Senza watermark RFQ ogni RFQ aperta è "nuova": confronto con tutti gli ordini
+        stats['full'] = rfq_since is None
+
+        row = pg_session.execute(
+            _RECONCILE_SQL,
+            {'orders_since': orders_since, 'rfq_since': rfq_since},
+        ).one()
+        for key in ('rfq_open', 'rfq_new', 'orders_changed', 'candidates', 'closed'):
+            stats[key] = getattr(row, key)
+
+        if scope is not None and scope.failed(ORDERS_WATERMARK_SOURCES):
+            logger.warning("Riconciliazione RFQ: ordini non sincronizzati nel ciclo, watermark ordini invariato")
+        elif row.orders_watermark is not None:
+            state.update_last_sync(pg_session, ORDERS_WATERMARK, row.orders_watermark)
+        if row.rfq_watermark is not None:
+            state.update_last_sync(pg_session, RFQ_WATERMARK, row.rfq_watermark)
+        pg_session.commit()
+        stats['duration'] = time.time() - start
+
+        logger.info(
+            "Riconciliazione RFQ%s: %d RFQ aperte (%d nuove), %d ordini modificati, "
+            "%d candidati, %d riconciliate in %.2fs",
+            ' (completa)' if stats['full'] else '',
+            stats['rfq_open'],
+            stats['rfq_new'],
+            stats['orders_changed'],
+            stats['candidates'],
+            stats['closed'],
+            stats['duration'],
+        )
+        return stats
     except Exception as e:
+        pg_session.rollback()
         logger.error(f"Errore riconciliazione RFQ: {e}")
-        return 0
+        return stats
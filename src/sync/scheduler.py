@@ -0,0 +1,206 @@
+"""
+Scheduler a grafo (DAG) per il ciclo di sincronizzazione.
+
+Ogni nodo (sync di una tabella o job successivo, es. cleanup e riconciliazione
+RFQ) dichiara i nodi da cui dipende e parte appena questi sono terminati.
+Tra i nodi pronti viene avviato prima quello con il percorso critico più lungo
+(durata attesa del nodo + catena più lunga dei discendenti), stimata dalle
+durate delle esecuzioni precedenti (media mobile esponenziale in memoria).
+
+Il fallimento di un nodo non blocca i discendenti: come nella sequenza fissa
+precedente, le righe vengono sincronizzate anche se la testata è fallita
+(restano i dati del ciclo precedente).
+"""
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from ..config.settings import Settings
+from ..mappings.registry import get_mapping
+from ..utils import metrics
+from ..utils.logger import setup_sync_logger
+
+
+@dataclass
+class SyncNode:
+    """
+    Nodo del grafo: `run` solleva un'eccezione se il nodo fallisce e restituisce
+    True se il nodo è stato saltato (es. tabella invariata per la sonda di modifica).
+    """
+    name: str
+    run: Callable[[], None]
+    depends_on: Sequence[str] = ()
+    kind: str = 'table'  # 'table' | 'job'
+
+
+class DurationHistory:
+    """Durate attese per nodo (media mobile esponenziale), condivise tra i cicli."""
+
+    def __init__(self, alpha: float = 0.3, default: float = 1.0):
+        self.alpha = alpha
+        self.default = default
+        self._durations: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def expected(self, name: str) -> float:
+        with self._lock:
+            return self._durations.get(name, self.default)
+
+    def record(self, name: str, duration: float) -> None:
+        with self._lock:
+            previous = self._durations.get(name)
+            if previous is None:
+                self._durations[name] = duration
+            else:
+                self._durations[name] = self.alpha * duration + (1 - self.alpha) * previous
+
+
+# Storico condiviso dal processo (scheduler loop e sync on-demand via API)
+duration_history = DurationHistory()
+
+
+def table_nodes(table_names: Iterable[str], run_table: Callable[[str], None]) -> List[SyncNode]:
+    """
+    Nodi per le tabelle indicate, con le dipendenze dichiarate in TableMapping.depends_on
+    (limitate alle tabelle presenti nell'elenco).
+    """
+    table_names = list(table_names)
+    present = set(table_names)
+    return [
+        SyncNode(
+            name,
+            lambda name=name: run_table(name),
+            tuple(dep for dep in get_mapping(name).depends_on if dep in present),
+        )
+        for name in table_names
+    ]
+
+
+class DagScheduler:
+    """Esegue i nodi di un DAG su un pool di thread rispettando le dipendenze."""
+
+    def __init__(
+        self,
+        nodes: Sequence[SyncNode],
+        max_workers: Optional[int] = None,
+        history: Optional[DurationHistory] = None,
+        logger=None,
+        error_logger=None,
+    ):
+        self.nodes = {node.name: node for node in nodes}
+        if len(self.nodes) != len(nodes):
+            raise ValueError("Nomi nodo duplicati nel grafo di sincronizzazione")
+        self.order = [node.name for node in nodes]
+        self.history = history or duration_history
+        self.max_workers = max(1, min(max_workers or Settings.get_sync_max_workers(), len(nodes) or 1))
+        self.logger = logger or setup_sync_logger("Scheduler")
+        self.error_logger = error_logger or self.logger
+        self.children: Dict[str, List[str]] = {name: [] for name in self.nodes}
+        for node in nodes:
+            for dep in node.depends_on:
+                if dep not in self.nodes:
+                    raise ValueError(f"Dipendenza sconosciuta per {node.name}: {dep}")
+                self.children[dep].append(node.name)
+        self._check_acyclic()
+
+    def _check_acyclic(self) -> None:
+        state: Dict[str, int] = {}  # 1 = in visita, 2 = completato
+
+        def visit(name, path):
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"Ciclo nel grafo di sincronizzazione: {' -> '.join(path + [name])}")
+            state[name] = 1
+            for child in self.children[name]:
+                visit(child, path + [name])
+            state[name] = 2
+
+        for name in self.order:
+            visit(name, [])
+
+    def critical_paths(self) -> Dict[str, float]:
+        """Durata attesa del percorso più lungo da ciascun nodo alla fine del grafo."""
+        paths: Dict[str, float] = {}
+
+        def path(name):
+            if name not in paths:
+                tail = max((path(child) for child in self.children[name]), default=0.0)
+                paths[name] = self.history.expected(name) + tail
+            return paths[name]
+
+        for name in self.order:
+            path(name)
+        return paths
+
+    def run(self) -> List[dict]:
+        """
+        Esegue il grafo e restituisce i risultati in ordine di completamento:
+        {'table', 'kind', 'success', 'skipped', 'duration', 'error'}.
+        """
+        priority = self.critical_paths()
+        waiting = {name: len(set(node.depends_on)) for name, node in self.nodes.items()}
+        ready = [name for name in self.order if waiting[name] == 0]
+        failed = set()
+        results = []
+        start = time.time()
+        self.logger.info(
+            f"Avvio grafo di sincronizzazione: {len(self.nodes)} nodi, {self.max_workers} thread"
+        )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sync-dag') as executor:
+            running = {}
+            while ready or running:
+                # A parità di slot liberi parte il nodo con il percorso critico più lungo
+                ready.sort(key=lambda name: (-priority[name], self.order.index(name)))
+                while ready and len(running) < self.max_workers:
+                    name = ready.pop(0)
+                    node = self.nodes[name]
+                    failed_parents = [dep for dep in node.depends_on if dep in failed]
+                    if failed_parents:
+                        self.logger.warning(
+                            f"{name}: avvio nonostante il fallimento di {', '.join(failed_parents)}"
+                        )
+                    running[executor.submit(self._run_node, node)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result = future.result()
+                    results.append(result)
+                    if not result['success']:
+                        failed.add(name)
+                    for child in self.children[name]:
+                        waiting[child] -= 1
+                        if waiting[child] == 0:
+                            ready.append(child)
+        metrics.observe_cycle(time.time() - start)
+        return results
+
+    def _run_node(self, node: SyncNode) -> dict:
+        start = time.time()
+        try:
+            skipped = node.run() is True
+        except Exception as e:
+            duration = time.time() - start
+            self.error_logger.error(f"Nodo {node.name} fallito dopo {duration:.2f}s: {e}")
+            self.logger.error(f"✗ {node.name} fallita in {duration:.2f}s: {e}")
+            return {
+                'table': node.name, 'kind': node.kind, 'success': False, 'skipped': False,
+                'duration': duration, 'error': str(e),
+            }
+        duration = time.time() - start
+        if skipped:
+            # Durata non registrata: la priorità stima il costo di quando il nodo lavora
+            self.logger.info(f"↷ {node.name} invariata, saltata in {duration:.2f}s")
+        else:
+            self.history.record(node.name, duration)
+            self.logger.info(f"✓ {node.name} completata in {duration:.2f}s")
+        return {
+            'table': node.name, 'kind': node.kind, 'success': True, 'skipped': skipped,
+            'duration': duration, 'error': None,
+        }
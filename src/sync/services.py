@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 from ..models.sync_state import SAP_SyncState
@@ -21,3 +22,19 @@ class SyncStateService:
             state.last_synced_at = ts
         else:
             session.add(SAP_SyncState(table_name=table_name, last_synced_at=ts))
+
+    @staticmethod
+    def get_fingerprint(session: Session, table_name: str) -> Optional[str]:
+        """Impronta della sonda di modifica salvata dall'ultimo sync completato senza errori"""
+        return session.query(SAP_SyncState.change_fingerprint).filter(
+            SAP_SyncState.table_name == table_name
+        ).scalar()
+
+    @staticmethod
+    def update_fingerprint(session: Session, table_name: str, fingerprint: Optional[str]):
+        """Salva (o azzera con None) l'impronta della sonda di modifica"""
+        state = session.query(SAP_SyncState).filter_by(table_name=table_name).first()
+        if state:
+            state.change_fingerprint = fingerprint
+        elif fingerprint is not None:
+            session.add(SAP_SyncState(table_name=table_name, change_fingerprint=fingerprint))
@@ -0,0 +1,517 @@
+"""
+Ricaricamento TRUNCATE_INSERT tramite tabella ombra e scambio per rename.
+
+Invece di TRUNCATE ... CASCADE sulla tabella letta dallo STM Scheduler (lock
+ACCESS EXCLUSIVE per tutta la durata del caricamento), le righe vengono
+scritte in una copia UNLOGGED della tabella (<tabella>__shadow):
+
+1. prepare(): crea la copia (LIKE ... senza indici) con PK, vincoli UNIQUE e
+   indici UNIQUE, così ON CONFLICT e gli errori di vincolo si comportano come
+   sulla tabella originale; copia owner e GRANT.
+2. finalize(): SET LOGGED, creazione degli indici secondari a tabella piena
+   e ANALYZE.
+3. swap(): sotto lock_timeout (con retry) aggiunge alla copia le FK uscenti
+   NOT VALID, rimuovendo le righe caricate senza riferimento (il lock SHARE ROW
+   EXCLUSIVE sulle tabelle referenziate dura dallo swap al commit, non per
+   tutto il caricamento), rinomina originale e copia, elimina la vecchia
+   tabella (le sequence serial passano alla nuova) e riallinea i nomi di
+   vincoli e indici. Le FK entranti
+   (es. entrata_merci_lines -> entrata_merci) vengono ricreate NOT VALID, dopo
+   aver eliminato le righe orfane come avrebbe fatto il CASCADE (per le tabelle
+   indicate in `references` i valori referenziati dalle righe eliminate restano
+   in `released`, per il cleanup incrementale).
+4. validate_foreign_keys(): dopo il commit, VALIDATE CONSTRAINT delle FK
+   ricreate e delle FK uscenti (non blocca letture e scritture sulla tabella
+   referenziante).
+
+I lettori restano bloccati solo per il tempo dello scambio. Le tabelle con
+colonne identity, viste dipendenti, trigger, RLS, ereditarietà o FK verso
+se stesse non sono idonee: prepare() restituisce None e si usa TRUNCATE.
+"""
+from __future__ import annotations
+
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import MetaData, Table, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from ..config.settings import Settings
+from ..utils.logger import log_performance
+
+SHADOW_SUFFIX = '__shadow'
+OLD_SUFFIX = '__old'
+# Limite PostgreSQL per i nomi di oggetto (NAMEDATALEN - 1).
+_MAX_IDENTIFIER = 63
+# SQLSTATE lock_not_available (scadenza lock_timeout).
+_LOCK_NOT_AVAILABLE = '55P03'
+
+
+def shadow_name(name: str, suffix: str = SHADOW_SUFFIX) -> str:
+    """Nome dell'oggetto ombra, troncato al limite degli identificatori PostgreSQL."""
+    return name[:_MAX_IDENTIFIER - len(suffix)] + suffix
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _is_lock_timeout(error: Exception) -> bool:
+    return getattr(getattr(error, 'orig', None), 'pgcode', None) == _LOCK_NOT_AVAILABLE
+
+
+@dataclass
+class _Constraint:
+    name: str
+    definition: str
+
+
+@dataclass
+class _OutboundForeignKey:
+    name: str
+    definition: str
+    ref_table: str
+    columns: List[str]
+    ref_columns: List[str]
+
+
+@dataclass
+class _InboundForeignKey:
+    name: str
+    table: str
+    definition: str
+    columns: List[str]
+    ref_columns: List[str]
+    on_delete: str
+    qualified_name: str
+
+
+_ELIGIBILITY_SQL = """
+SELECT c.oid,
+       c.relkind,
+       c.relrowsecurity,
+       pg_has_role(c.relowner, 'MEMBER') AS owned,
+       pg_get_userbyid(c.relowner) AS owner,
+       EXISTS (
+           SELECT 1 FROM pg_attribute a
+           WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped AND a.attidentity <> ''
+       ) AS has_identity,
+       EXISTS (
+           SELECT 1 FROM pg_depend dep
+           JOIN pg_rewrite r ON r.oid = dep.objid
+           WHERE dep.classid = 'pg_rewrite'::regclass
+             AND dep.refobjid = c.oid AND r.ev_class <> c.oid
+       ) AS has_views,
+       EXISTS (
+           SELECT 1 FROM pg_trigger t WHERE t.tgrelid = c.oid AND NOT t.tgisinternal
+       ) AS has_triggers,
+       EXISTS (
+           SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid OR i.inhparent = c.oid
+       ) AS inherited,
+       EXISTS (
+           SELECT 1 FROM pg_constraint f
+           WHERE f.contype = 'f' AND f.conrelid = c.oid AND f.confrelid = c.oid
+       ) AS self_reference
+FROM pg_class c
+WHERE c.oid = to_regclass(:name)
+"""
+
+_INBOUND_FK_SQL = """
+SELECT c.conname,
+       c.conrelid::regclass::text AS table_name,
+       pg_get_constraintdef(c.oid) AS definition,
+       c.confdeltype,
+       (SELECT n.nspname || '.' || r.relname FROM pg_class r
+        JOIN pg_namespace n ON n.oid = r.relnamespace WHERE r.oid = c.conrelid) AS qualified_name,
+       ARRAY(
+           SELECT a.attname FROM unnest(c.conkey) WITH ORDINALITY AS k(attnum, pos)
+           JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+           ORDER BY k.pos
+       ) AS columns,
+       ARRAY(
+           SELECT a.attname FROM unnest(c.confkey) WITH ORDINALITY AS k(attnum, pos)
+           JOIN pg_attribute a ON a.attrelid = c.confrelid AND a.attnum = k.attnum
+           ORDER BY k.pos
+       ) AS ref_columns
+FROM pg_constraint c
+WHERE c.contype = 'f' AND c.confrelid = :oid AND c.conrelid <> :oid
+ORDER BY c.conrelid::regclass::text, c.conname
+"""
+
+_OUTBOUND_FK_SQL = """
+SELECT c.conname,
+       pg_get_constraintdef(c.oid) AS definition,
+       c.confrelid::regclass::text AS ref_table,
+       ARRAY(
+           SELECT a.attname FROM unnest(c.conkey) WITH ORDINALITY AS k(attnum, pos)
+           JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+           ORDER BY k.pos
+       ) AS columns,
+       ARRAY(
+           SELECT a.attname FROM unnest(c.confkey) WITH ORDINALITY AS k(attnum, pos)
+           JOIN pg_attribute a ON a.attrelid = c.confrelid AND a.attnum = k.attnum
+           ORDER BY k.pos
+       ) AS ref_columns
+FROM pg_constraint c
+WHERE c.contype = 'f' AND c.conrelid = :oid
+ORDER BY c.conname
+"""
+
+
+class ShadowTable:
+    """Tabella ombra per il ricaricamento completo di `table` con scambio finale."""
+
+    def __init__(self, session: Session, table: Table, logger, references: Optional[Dict[str, str]] = None):
+        self.session = session
+        self.original = table
+        self.logger = logger
+        self.schema = table.schema or 'public'
+        self.name = shadow_name(table.name)
+        # Stessa definizione del modello, con il nome della copia: usata da insert()/COPY.
+        self.table = table.to_metadata(MetaData(), name=self.name)
+        self.oid: Optional[int] = None
+        self.owner: Optional[str] = None
+        self.constraints: List[_Constraint] = []
+        self.indexes: List[_Constraint] = []
+        self.deferred_indexes: List[_Constraint] = []
+        self.outbound_fks: List[_OutboundForeignKey] = []
+        self.inbound_fks: List[_InboundForeignKey] = []
+        self.owned_sequences: List[tuple] = []
+        # (tabella, vincolo) delle FK da validare dopo il commit dello swap
+        self.pending_validation: List[Tuple[str, str]] = []
+        # Tabella referenziante (schema.nome) -> colonna i cui valori vanno raccolti dalle
+        # righe orfane eliminate; released: valori raccolti (None = tabella svuotata)
+        self.references = dict(references or {})
+        self.released: Dict[str, Optional[Set]] = {}
+        self.swapped = False
+
+    @property
+    def fullname(self) -> str:
+        return f'{quote_ident(self.schema)}.{quote_ident(self.name)}'
+
+    @property
+    def original_fullname(self) -> str:
+        return f'{quote_ident(self.schema)}.{quote_ident(self.original.name)}'
+
+    @classmethod
+    def prepare(
+        cls, session: Session, table: Table, logger, references: Optional[Dict[str, str]] = None,
+    ) -> Optional['ShadowTable']:
+        """
+        Crea la tabella ombra vuota per `table`.
+        Restituisce None se la tabella non è idonea allo scambio (il chiamante usa TRUNCATE).
+        """
+        shadow = cls(session, table, logger, references)
+        reason = shadow._check_eligibility()
+        if reason:
+            logger.info(f"Shadow swap non applicabile a {table.fullname} ({reason}): uso TRUNCATE")
+            return None
+        start = time.time()
+        shadow._create()
+        log_performance(logger, f"Creazione tabella ombra {shadow.name}", time.time() - start)
+        return shadow
+
+    def _check_eligibility(self) -> Optional[str]:
+        row = self.session.execute(
+            text(_ELIGIBILITY_SQL), {'name': f'{self.schema}.{self.original.name}'}
+        ).mappings().first()
+        if row is None:
+            return 'tabella inesistente'
+        checks = [
+            (row['relkind'] != 'r', 'non è una tabella semplice'),
+            (not row['owned'], f"owner {row['owner']} non gestibile dall'utente corrente"),
+            (row['has_identity'], 'colonne identity'),
+            (row['has_views'], 'viste dipendenti'),
+            (row['has_triggers'], 'trigger definiti'),
+            (row['relrowsecurity'], 'row level security attiva'),
+            (row['inherited'], 'ereditarietà/partizioni'),
+            (row['self_reference'], 'FK verso se stessa'),
+        ]
+        for failed, reason in checks:
+            if failed:
+                return reason
+        self.oid = row['oid']
+        self.owner = row['owner']
+        return None
+
+    def _create(self) -> None:
+        session = self.session
+        session.execute(text(f'DROP TABLE IF EXISTS {self.fullname}'))
+        session.execute(text(
+            f'CREATE UNLOGGED TABLE {self.fullname} ({self._like_clause()})'
+        ))
+        session.execute(text(f'ALTER TABLE {self.fullname} OWNER TO {quote_ident(self.owner)}'))
+        for grant in self._grants():
+            session.execute(text(grant))
+
+        # PK, UNIQUE ed EXCLUDE prima del caricamento: gli INSERT ... ON CONFLICT
+        # e il fallback riga per riga vedono gli stessi vincoli. Le FK uscenti
+        # vengono aggiunte nello swap: qui terrebbero SHARE ROW EXCLUSIVE sulle
+        # tabelle referenziate per tutto il caricamento.
+        rows = session.execute(text(
+            "SELECT conname, pg_get_constraintdef(oid) AS definition "
+            "FROM pg_constraint WHERE conrelid = :oid AND contype IN ('p', 'u', 'x') "
+            "ORDER BY conname"
+        ), {'oid': self.oid}).all()
+        for row in rows:
+            constraint = _Constraint(row.conname, row.definition)
+            session.execute(text(
+                f'ALTER TABLE {self.fullname} ADD CONSTRAINT '
+                f'{quote_ident(shadow_name(constraint.name))} {constraint.definition}'
+            ))
+            self.constraints.append(constraint)
+
+        # Indici non legati a vincoli: quelli UNIQUE subito (ON CONFLICT DO NOTHING
+        # senza target li considera), gli altri dopo il caricamento.
+        rows = session.execute(text(
+            "SELECT ic.relname, pg_get_indexdef(i.indexrelid) AS definition, i.indisunique "
+            "FROM pg_index i JOIN pg_class ic ON ic.oid = i.indexrelid "
+            "WHERE i.indrelid = :oid AND NOT EXISTS ("
+            "    SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid AND c.conrelid = :oid"
+            ") ORDER BY ic.relname"
+        ), {'oid': self.oid}).all()
+        for row in rows:
+            index = _Constraint(row.relname, row.definition)
+            self.indexes.append(index)
+            if row.indisunique:
+                session.execute(text(self._shadow_index_sql(index)))
+            else:
+                self.deferred_indexes.append(index)
+
+        # Sequence delle colonne serial: il default della copia le usa già, la
+        # proprietà va spostata prima del DROP della vecchia tabella.
+        self.owned_sequences = [
+            (row.sequence, row.attname)
+            for row in session.execute(text(
+                "SELECT d.objid::regclass::text AS sequence, a.attname "
+                "FROM pg_depend d "
+                "JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S' "
+                "JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid "
+                "WHERE d.classid = 'pg_class'::regclass AND d.refobjid = :oid AND d.deptype = 'a'"
+            ), {'oid': self.oid})
+        ]
+
+        self.outbound_fks = [
+            _OutboundForeignKey(
+                row.conname, row.definition, row.ref_table, list(row.columns), list(row.ref_columns),
+            )
+            for row in session.execute(text(_OUTBOUND_FK_SQL), {'oid': self.oid})
+        ]
+
+        rows = session.execute(text(_INBOUND_FK_SQL), {'oid': self.oid}).all()
+        self.inbound_fks = [
+            _InboundForeignKey(
+                row.conname, row.table_name, row.definition,
+                list(row.columns), list(row.ref_columns), row.confdeltype, row.qualified_name,
+            )
+            for row in rows
+        ]
+
+    def _like_clause(self) -> str:
+        return (
+            f'LIKE {self.original_fullname} INCLUDING DEFAULTS INCLUDING CONSTRAINTS '
+            f'INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMMENTS'
+        )
+
+    def _grants(self) -> List[str]:
+        rows = self.session.execute(text(
+            "SELECT CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE pg_get_userbyid(a.grantee) END AS grantee, "
+            "a.privilege_type, a.is_grantable "
+            "FROM pg_class c, aclexplode(c.relacl) a WHERE c.oid = :oid"
+        ), {'oid': self.oid}).all()
+        grants = []
+        for row in rows:
+            grantee = 'PUBLIC' if row.grantee == 'PUBLIC' else quote_ident(row.grantee)
+            option = ' WITH GRANT OPTION' if row.is_grantable else ''
+            grants.append(f'GRANT {row.privilege_type} ON {self.fullname} TO {grantee}{option}')
+        return grants
+
+    def _shadow_index_sql(self, index: _Constraint) -> str:
+        """Riscrive la CREATE INDEX dell'originale su tabella e nome ombra."""
+        return re.sub(
+            r'^(CREATE (?:UNIQUE )?INDEX )\S+( ON (?:ONLY )?)\S+',
+            lambda m: f'{m.group(1)}{quote_ident(shadow_name(index.name))}{m.group(2)}{self.fullname}',
+            index.definition,
+            count=1,
+        )
+
+    def finalize(self) -> None:
+        """Dopo il caricamento: SET LOGGED, indici secondari e statistiche."""
+        session = self.session
+        start = time.time()
+        session.execute(text(f'ALTER TABLE {self.fullname} SET LOGGED'))
+        for index in self.deferred_indexes:
+            session.execute(text(self._shadow_index_sql(index)))
+        session.execute(text(f'ANALYZE {self.fullname}'))
+        log_performance(
+            self.logger,
+            f"Finalizzazione {self.name} (SET LOGGED, {len(self.deferred_indexes)} indici, ANALYZE)",
+            time.time() - start,
+        )
+
+    def _add_outbound_fk(self, fk: _OutboundForeignKey) -> None:
+        """
+        Aggiunge la FK NOT VALID (nessuna scansione, vale per le scritture successive)
+        e rimuove le righe caricate senza riferimento. Dopo il lock della ADD
+        CONSTRAINT la DELETE vede le tabelle referenziate stabili: la VALIDATE
+        dopo lo swap trova la tabella già coerente.
+        """
+        self.session.execute(text(
+            f'ALTER TABLE {self.fullname} ADD CONSTRAINT '
+            f'{quote_ident(shadow_name(fk.name))} {fk.definition} NOT VALID'
+        ))
+        self._remove_unreferenced(fk)
+
+    def _remove_unreferenced(self, fk: _OutboundForeignKey) -> None:
+        """
+        Rimuove dalla copia le righe senza riferimento per `fk`, che con la FK
+        presente durante il caricamento il fallback riga per riga avrebbe scartato.
+        """
+        not_null = ' AND '.join(f'r.{quote_ident(col)} IS NOT NULL' for col in fk.columns)
+        match = ' AND '.join(
+            f't.{quote_ident(ref)} = r.{quote_ident(col)}'
+            for col, ref in zip(fk.columns, fk.ref_columns)
+        )
+        removed = self.session.execute(text(
+            f'DELETE FROM {self.fullname} r WHERE {not_null} '
+            f'AND NOT EXISTS (SELECT 1 FROM {fk.ref_table} t WHERE {match})'
+        )).rowcount or 0
+        if removed:
+            self.logger.warning(f"{self.original.fullname}: {removed} righe senza riferimento scartate ({fk.name})")
+
+    def swap(self) -> None:
+        """
+        Sostituisce l'originale con la tabella ombra. Ogni tentativo gira in un
+        savepoint con lock_timeout: se i lock non arrivano in tempo si riprova
+        con backoff; esauriti i tentativi (o per altri errori) si ripiega su
+        TRUNCATE + INSERT ... SELECT dalla copia.
+        """
+        retries = Settings.get_shadow_swap_retries()
+        lock_timeout_ms = Settings.get_shadow_swap_lock_timeout_ms()
+        for attempt in range(1, retries + 1):
+            start = time.time()
+            savepoint = self.session.begin_nested()
+            try:
+                self.session.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout_ms}ms'"))
+                self._swap_tables()
+                self.session.execute(text('SET LOCAL lock_timeout TO DEFAULT'))
+                savepoint.commit()
+                self.swapped = True
+                log_performance(self.logger, f"Swap {self.original.fullname}", time.time() - start)
+                return
+            except OperationalError as e:
+                savepoint.rollback()
+                if not _is_lock_timeout(e):
+                    self.logger.warning(f"Swap {self.original.fullname} fallito: {type(e).__name__}: {e}")
+                    break
+                delay = min(0.2 * 2 ** (attempt - 1), 5.0)
+                self.logger.warning(
+                    f"Swap {self.original.fullname}: lock non ottenuto entro {lock_timeout_ms}ms "
+                    f"(tentativo {attempt}/{retries}), nuovo tentativo tra {delay:.1f}s"
+                )
+                time.sleep(delay)
+            except Exception as e:
+                savepoint.rollback()
+                self.logger.warning(f"Swap {self.original.fullname} fallito: {type(e).__name__}: {e}")
+                break
+        self._copy_back()
+
+    def _swap_tables(self) -> None:
+        session = self.session
+        original = self.original_fullname
+        # Ordine dei lock fisso: tabella originale, tabelle referenzianti, poi le referenziate.
+        session.execute(text(f'LOCK TABLE {original} IN ACCESS EXCLUSIVE MODE'))
+        self.released = {}
+        for fk in self.inbound_fks:
+            session.execute(text(f'ALTER TABLE {fk.table} DROP CONSTRAINT {quote_ident(fk.name)}'))
+        for fk in self.outbound_fks:
+            self._add_outbound_fk(fk)
+
+        old_name = shadow_name(self.original.name, OLD_SUFFIX)
+        for sequence, column in self.owned_sequences:
+            session.execute(text(
+                f'ALTER SEQUENCE {sequence} OWNED BY {self.fullname}.{quote_ident(column)}'
+            ))
+        session.execute(text(f'ALTER TABLE {original} RENAME TO {quote_ident(old_name)}'))
+        session.execute(text(f'ALTER TABLE {self.fullname} RENAME TO {quote_ident(self.original.name)}'))
+        session.execute(text(f'DROP TABLE {quote_ident(self.schema)}.{quote_ident(old_name)}'))
+
+        # I nomi di vincoli e indici sono tornati liberi con il DROP della vecchia tabella.
+        for name in [constraint.name for constraint in self.constraints] + [fk.name for fk in self.outbound_fks]:
+            session.execute(text(
+                f'ALTER TABLE {original} RENAME CONSTRAINT '
+                f'{quote_ident(shadow_name(name))} TO {quote_ident(name)}'
+            ))
+        for index in self.indexes:
+            session.execute(text(
+                f'ALTER INDEX {quote_ident(self.schema)}.{quote_ident(shadow_name(index.name))} '
+                f'RENAME TO {quote_ident(index.name)}'
+            ))
+
+        for fk in self.inbound_fks:
+            removed = self._remove_orphans(fk)
+            if removed:
+                self.logger.info(f"{fk.table}: {removed} righe orfane rimosse ({fk.name})")
+            session.execute(text(
+                f'ALTER TABLE {fk.table} ADD CONSTRAINT {quote_ident(fk.name)} {fk.definition} NOT VALID'
+            ))
+        self.pending_validation = [(original, fk.name) for fk in self.outbound_fks]
+        self.pending_validation += [(fk.table, fk.name) for fk in self.inbound_fks]
+
+    def _remove_orphans(self, fk: _InboundForeignKey) -> int:
+        """
+        Emula il CASCADE del TRUNCATE sulle sole righe che referenziano chiavi
+        non più presenti (ON DELETE SET NULL: azzera le colonne FK).
+        """
+        not_null = ' AND '.join(f'r.{quote_ident(col)} IS NOT NULL' for col in fk.columns)
+        match = ' AND '.join(
+            f't.{quote_ident(ref)} = r.{quote_ident(col)}'
+            for col, ref in zip(fk.columns, fk.ref_columns)
+        )
+        orphan = f'{not_null} AND NOT EXISTS (SELECT 1 FROM {self.original_fullname} t WHERE {match})'
+        if fk.on_delete == 'n':
+            assignments = ', '.join(f'{quote_ident(col)} = NULL' for col in fk.columns)
+            sql = f'UPDATE {fk.table} r SET {assignments} WHERE {orphan}'
+            return self.session.execute(text(sql)).rowcount or 0
+        reference = self.references.get(fk.qualified_name)
+        if reference is None:
+            return self.session.execute(text(f'DELETE FROM {fk.table} r WHERE {orphan}')).rowcount or 0
+        rows = self.session.execute(text(
+            f'DELETE FROM {fk.table} r WHERE {orphan} RETURNING r.{quote_ident(reference)}'
+        )).fetchall()
+        released = self.released.setdefault(fk.qualified_name, set())
+        released.update(row[0] for row in rows if row[0] is not None)
+        return len(rows)
+
+    def _copy_back(self) -> None:
+        """Ripiego: svuota l'originale e copia le righe dalla tabella ombra."""
+        start = time.time()
+        self.logger.warning(f"Swap non riuscito: copia di {self.name} in {self.original.fullname} con TRUNCATE")
+        self.session.execute(text(f'TRUNCATE TABLE {self.original_fullname} CASCADE'))
+        self.released = dict.fromkeys(self.references)
+        # Le FK uscenti dell'originale scarterebbero l'intera INSERT per una riga senza riferimento
+        for fk in self.outbound_fks:
+            self._remove_unreferenced(fk)
+        self.session.execute(text(f'INSERT INTO {self.original_fullname} SELECT * FROM {self.fullname}'))
+        self.session.execute(text(f'DROP TABLE {self.fullname}'))
+        log_performance(self.logger, f"Copia {self.name} -> {self.original.fullname}", time.time() - start)
+
+    def validate_foreign_keys(self) -> None:
+        """
+        Da chiamare dopo il commit dello swap: valida le FK uscenti e le FK entranti
+        ricreate NOT VALID, ognuna nella propria transazione. Un errore lascia la FK
+        NOT VALID (già applicata alle nuove scritture) e viene solo segnalato.
+        """
+        for table, name in self.pending_validation:
+            try:
+                self.session.execute(text(
+                    f'ALTER TABLE {table} VALIDATE CONSTRAINT {quote_ident(name)}'
+                ))
+                self.session.commit()
+            except Exception as e:
+                self.session.rollback()
+                self.logger.warning(f"Validazione {table}.{name} fallita: {type(e).__name__}: {e}")
+        self.pending_validation = []
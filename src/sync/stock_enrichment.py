@@ -0,0 +1,92 @@
+"""
+Aggiornamenti set-based condivisi dagli arricchimenti stock (DEPOSYTA, MODULA).
+
+I valori letti dai sistemi di magazzino vengono risolti per articolo in Python,
+caricati con un solo COPY in una tabella temporanea (una riga per articolo)
+e applicati con un UPDATE ... FROM per tabella destinazione, che tocca solo
+le righe con valori diversi.
+"""
+from __future__ import annotations
+
+from typing import Iterable, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .bulk_load import copy_into
+
+
+def stage_stock(
+    session: Session,
+    name: str,
+    columns: Sequence[Tuple[str, str]],
+    records: Iterable[dict],
+) -> str:
+    """
+    Crea (se assente), svuota e carica con COPY la tabella temporanea `name`.
+    `columns` = [(colonna, tipo SQL)]; la prima colonna è la chiave articolo.
+    """
+    ddl = ', '.join(f'"{col}" {sql_type}' for col, sql_type in columns)
+    session.execute(text(
+        f'CREATE TEMP TABLE IF NOT EXISTS {name} ({ddl}, PRIMARY KEY ("{columns[0][0]}")) '
+        f'ON COMMIT DROP'
+    ))
+    session.execute(text(f'TRUNCATE {name}'))
+    copy_into(session, name, [col for col, _ in columns], records)
+    return name
+
+
+_UPDATE_MAGAZZINO_SQL = """
+WITH target AS (
+    SELECT m.articolo, m.posizione, s.quantita
+    FROM {stage} s
+    JOIN sap.anagrafica_articoli sa
+      ON sa.id = s.articolo
+     AND sa.categoria = :categoria
+    JOIN magazzino m
+      ON m.articolo = sa.id
+     AND m.posizione = COALESCE(NULLIF(TRIM(sa.ubicazione), ''), 'NON_SPECIFICATA')
+    WHERE s.quantita IS NOT NULL
+),
+updated AS (
+    UPDATE magazzino m
+    SET quantita = t.quantita,
+        data_aggiornamento = CURRENT_TIMESTAMP,
+        note = CASE
+            WHEN m.note IS NULL OR TRIM(m.note) = ''
+            THEN :note
+            WHEN m.note NOT LIKE :note_marker
+            THEN m.note || ' - ' || :note
+            ELSE m.note
+        END
+    FROM target t
+    WHERE m.articolo = t.articolo
+      AND m.posizione = t.posizione
+      AND (
+          m.quantita IS DISTINCT FROM t.quantita
+          OR m.note IS NULL OR TRIM(m.note) = ''
+          OR m.note NOT LIKE :note_marker
+      )
+    RETURNING 1
+)
+SELECT (SELECT COUNT(*) FROM target), (SELECT COUNT(*) FROM updated)
+"""
+
+
+def update_magazzino_quantita(session: Session, stage: str, categoria: str, source: str) -> Tuple[int, int]:
+    """
+    Aggiorna magazzino.quantita dalla colonna `quantita` dello staging, sulla riga
+    creata da bootstrap_magazzino_from_sap (posizione = ubicazione o NON_SPECIFICATA).
+    La nota 'Arricchito da <source>' viene aggiunta una sola volta; le righe con
+    quantità e nota già aggiornate non vengono riscritte.
+    Restituisce (righe_magazzino_trovate, righe_aggiornate).
+    """
+    matched, updated = session.execute(
+        text(_UPDATE_MAGAZZINO_SQL.format(stage=stage)),
+        {
+            'categoria': categoria,
+            'note': f'Arricchito da {source}',
+            'note_marker': f'%{source}%',
+        },
+    ).one()
+    return matched, updated
@@ -0,0 +1,315 @@
+"""
+Registry di metriche in-process esposto da /api/metrics nel formato testo di Prometheus.
+
+Contatori, gauge e istogrammi con etichette, senza dipendenze esterne. Il motore
+aggiorna le metriche una volta per stadio o per sync (mai per riga): ogni
+aggiornamento prende il lock della sola metrica per il tempo di una somma.
+I valori calcolati al momento della lettura (pool di connessioni, età
+dell'ultimo sync riuscito) sono forniti da collector registrati sul registry.
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Secondi: dalla singola query veloce al ricaricamento completo di una tabella
+DEFAULT_SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+ROWS_BUCKETS = (0, 10, 100, 1000, 10000, 50000, 100000, 500000, 1000000)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+class _Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: etichette attese {self.labelnames}, ricevute {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Valore monotòno crescente per combinazione di etichette."""
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if amount < 0:
+            raise ValueError(f"{self.name}: un counter non può diminuire")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Valore istantaneo per combinazione di etichette."""
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def value(self, **labels) -> Optional[float]:
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def items(self) -> List[Tuple[Dict[str, str], float]]:
+        with self._lock:
+            return [(self._labels(key), value) for key, value in self._values.items()]
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, labels, value) for labels, value in self.items()]
+
+
+class Histogram(_Metric):
+    """Distribuzione delle osservazioni su bucket cumulativi (+ somma e conteggio)."""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        # per etichette: [conteggi per bucket (non cumulativi) + overflow, somma]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return sum(state[0]) if state else 0
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            snapshot = [(key, list(state[0]), state[1]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, total in snapshot:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Metriche registrate per nome e collector valutati a ogni lettura."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[_Metric]]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metrica {metric.name} già registrata con tipo o etichette diversi")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_SECONDS_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[_Metric]]) -> None:
+        """`collector()` restituisce metriche costruite al momento della lettura."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Tutte le metriche nel formato testo di Prometheus (exposition format 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for collector in collectors:
+            metrics.extend(collector())
+        lines = []
+        for metric in metrics:
+            samples = metric.samples()
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for name, labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# ─── Metriche del servizio ───────────────────────────────────────────────────
+
+registry = MetricsRegistry()
+
+SAP_QUERY_SECONDS = registry.histogram(
+    'sap_sync_sap_query_seconds', 'Tempo della query SAP fino al primo blocco di righe', ('table',),
+)
+TRANSFORM_SECONDS = registry.histogram(
+    'sap_sync_transform_seconds', 'Tempo di trasformazione delle righe SAP per sync', ('table',),
+)
+PG_WRITE_SECONDS = registry.histogram(
+    'sap_sync_pg_write_seconds', 'Tempo di scrittura su PostgreSQL per sync', ('table',),
+)
+ROWS_PER_SYNC = registry.histogram(
+    'sap_sync_rows', 'Righe estratte da SAP per sync', ('table',), buckets=ROWS_BUCKETS,
+)
+FALLBACK_STATEMENTS = registry.counter(
+    'sap_sync_fallback_statements_total', 'Statement emessi dal fallback a bisezione dei batch', ('table',),
+)
+SKIPPED_ROWS = registry.counter(
+    'sap_sync_skipped_rows_total', 'Righe skippate per errori di trasformazione o scrittura', ('table',),
+)
+SYNC_RUNS = registry.counter(
+    'sap_sync_table_runs_total', 'Sync di tabella eseguiti per esito', ('table', 'result'),
+)
+CYCLE_SECONDS = registry.histogram(
+    'sap_sync_cycle_seconds', 'Durata del ciclo di sincronizzazione completo (grafo)',
+)
+LAST_SUCCESS = registry.gauge(
+    'sap_sync_last_success_timestamp_seconds', 'Unix time dell\'ultimo sync riuscito per tabella', ('table',),
+)
+
+
+def observe_table_sync(
+    table: str,
+    sap_query_seconds: float,
+    transform_seconds: float,
+    pg_write_seconds: float,
+    rows: int,
+    fallback_statements: int,
+    skipped_rows: int,
+) -> None:
+    """Registra un sync di tabella riuscito (chiamata una volta a fine sync)."""
+    SAP_QUERY_SECONDS.observe(sap_query_seconds, table=table)
+    TRANSFORM_SECONDS.observe(transform_seconds, table=table)
+    PG_WRITE_SECONDS.observe(pg_write_seconds, table=table)
+    ROWS_PER_SYNC.observe(rows, table=table)
+    if fallback_statements:
+        FALLBACK_STATEMENTS.inc(fallback_statements, table=table)
+    if skipped_rows:
+        SKIPPED_ROWS.inc(skipped_rows, table=table)
+    SYNC_RUNS.inc(table=table, result='success')
+    LAST_SUCCESS.set(time.time(), table=table)
+
+
+def observe_table_failure(table: str) -> None:
+    SYNC_RUNS.inc(table=table, result='error')
+
+
+def observe_table_skipped(table: str) -> None:
+    """Sync saltato perché la sonda di modifica è invariata: i dati risultano aggiornati."""
+    SYNC_RUNS.inc(table=table, result='skipped')
+    LAST_SUCCESS.set(time.time(), table=table)
+
+
+def observe_cycle(duration: float) -> None:
+    CYCLE_SECONDS.observe(duration)
+
+
+def _last_success_age() -> Iterable[_Metric]:
+    age = Gauge('sap_sync_last_success_age_seconds', 'Secondi dall\'ultimo sync riuscito per tabella', ('table',))
+    now = time.time()
+    for labels, timestamp in LAST_SUCCESS.items():
+        age.set(max(0.0, now - timestamp), **labels)
+    return [age]
+
+
+_POOL_FIELDS = {
+    'size': ('sap_sync_db_pool_size', 'Dimensione configurata del pool'),
+    'checked_out': ('sap_sync_db_pool_checked_out', 'Connessioni in uso'),
+    'checked_in': ('sap_sync_db_pool_checked_in', 'Connessioni inattive nel pool'),
+    'overflow': ('sap_sync_db_pool_overflow', 'Connessioni in overflow'),
+    'wait_count': ('sap_sync_db_pool_checkouts_total', 'Richieste di connessione al pool'),
+    'wait_seconds_total': ('sap_sync_db_pool_wait_seconds_total', 'Attesa cumulata per ottenere una connessione'),
+    'wait_seconds_max': ('sap_sync_db_pool_wait_seconds_max', 'Attesa massima per ottenere una connessione'),
+}
+
+
+def _pool_stats() -> Iterable[_Metric]:
+    from ..config.database import get_pool_stats
+
+    metrics = {}
+    for field, (name, documentation) in _POOL_FIELDS.items():
+        metric_type = Counter if name.endswith('_total') else Gauge
+        metrics[field] = metric_type(name, documentation, ('database',))
+    for database, stats in get_pool_stats().items():
+        for field, metric in metrics.items():
+            if field not in stats:
+                continue
+            if isinstance(metric, Counter):
+                metric.inc(stats[field], database=database)
+            else:
+                metric.set(stats[field], database=database)
+    return list(metrics.values())
+
+
+registry.register_collector(_last_success_age)
+registry.register_collector(_pool_stats)
@@ -0,0 +1,52 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from src.mappings.anagrafica_articoli import (
+    _parse_assoc_articoli_macchina,
+    _sync_assoc_articoli_macchina,
+)
+
+
+def _row(item_code, machines):
+    return SimpleNamespace(_mapping={'ItemCode': item_code, 'U_FamigliaLEV2': machines})
+
+
+class AssocArticoliMacchinaTestCase(unittest.TestCase):
+    def test_parse_splits_and_strips_machine_codes(self):
+        parsed = _parse_assoc_articoli_macchina([
+            _row('A1', 'M1-M2'),
+            _row('A2', ' M2 - M3-'),
+            _row('A3', '-M4--M4'),
+        ])
+        self.assertEqual(parsed, {'A1': ['M1', 'M2'], 'A2': ['M2', 'M3'], 'A3': ['M4']})
+
+    def test_articles_without_machines_are_kept_for_delete(self):
+        parsed = _parse_assoc_articoli_macchina([_row('A1', None), _row('A2', '  '), _row(None, 'M1')])
+        self.assertEqual(parsed, {'A1': [], 'A2': []})
+
+    def test_last_row_wins_for_repeated_article(self):
+        parsed = _parse_assoc_articoli_macchina([_row('A1', 'M1'), _row('A1', 'M2')])
+        self.assertEqual(parsed, {'A1': ['M2']})
+
+    def test_sync_runs_one_delete_and_one_insert_per_block(self):
+        session = MagicMock()
+        session.execute.return_value.rowcount = 0
+        _sync_assoc_articoli_macchina(session, [_row('A1', 'M1-M2'), _row('A2', None)])
+
+        self.assertEqual(session.execute.call_count, 2)
+        params = session.execute.call_args_list[0].args[1]
+        self.assertEqual(params, {
+            'articoli': ['A1', 'A2'],
+            'pair_articoli': ['A1', 'A1'],
+            'pair_macchine': ['M1', 'M2'],
+        })
+
+    def test_empty_block_does_not_touch_database(self):
+        session = MagicMock()
+        _sync_assoc_articoli_macchina(session, [_row(None, 'M1')])
+        session.execute.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
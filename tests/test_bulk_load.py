@@ -0,0 +1,93 @@
+import unittest
+from datetime import date, datetime
+
+from src.models.anagrafiche_business_partner import SAP_AnagraficheBusinessPartner
+from src.models.entrata_merci_lines import SAP_EntrataMerciLine
+from src.sync.bulk_load import (
+    StagingMerge,
+    copy_text_value,
+    format_copy_rows,
+    record_columns,
+    scalar_column_defaults,
+)
+
+
+class CopyFormatTestCase(unittest.TestCase):
+    def test_copy_text_value_null_and_scalars(self):
+        self.assertEqual(copy_text_value(None), r'\N')
+        self.assertEqual(copy_text_value(True), 't')
+        self.assertEqual(copy_text_value(12.5), '12.5')
+        self.assertEqual(copy_text_value(date(2026, 1, 15)), '2026-01-15')
+        self.assertEqual(
+            copy_text_value(datetime(2026, 1, 15, 8, 30)),
+            '2026-01-15T08:30:00',
+        )
+
+    def test_copy_text_value_escapes_special_characters(self):
+        self.assertEqual(copy_text_value('a\tb\nc\\d\re'), 'a\\tb\\nc\\\\d\\re')
+
+    def test_empty_string_is_not_null(self):
+        self.assertEqual(copy_text_value(''), '')
+
+    def test_format_copy_rows_uses_defaults_for_missing_columns(self):
+        payload = format_copy_rows(
+            [{'a': 1}, {'a': 2, 'b': 'x'}],
+            ['a', 'b'],
+            {'b': 'def'},
+        )
+        self.assertEqual(payload, '1\tdef\n2\tx\n')
+
+    def test_format_copy_rows_empty(self):
+        self.assertEqual(format_copy_rows([], ['a']), '')
+
+    def test_record_columns_keeps_first_seen_order(self):
+        self.assertEqual(
+            record_columns([{'b': 1, 'a': 2}, {'c': 3, 'a': 4}]),
+            ['b', 'a', 'c'],
+        )
+
+    def test_scalar_column_defaults_only_for_missing_columns(self):
+        table = SAP_EntrataMerciLine.__table__
+        self.assertEqual(
+            scalar_column_defaults(table, ['cod_entrata_merci', 'line_num']),
+            {'quantity': 0.0},
+        )
+        self.assertEqual(
+            scalar_column_defaults(table, ['quantity', 'status']),
+            {},
+        )
+
+
+class StagingMergeSqlTestCase(unittest.TestCase):
+    def _stager(self, skip_unchanged):
+        stager = StagingMerge(None, SAP_AnagraficheBusinessPartner.__table__, ['id'], skip_unchanged)
+        stager.staging = '_stage_anagrafiche_business_partner'
+        stager.payload_columns = ['id', 'name', 'email']
+        stager.columns = list(stager.payload_columns)
+        return stager
+
+    def test_merge_counts_inserted_and_updated_rows(self):
+        sql = self._stager(False).merge_sql()
+        self.assertIn('DO UPDATE SET "name" = EXCLUDED."name", "email" = EXCLUDED."email" RETURNING', sql)
+        self.assertIn('RETURNING (xmax = 0) AS inserted', sql)
+        self.assertNotIn('IS DISTINCT FROM', sql)
+
+    def test_skip_unchanged_compares_payload_columns_only(self):
+        sql = self._stager(True).merge_sql()
+        self.assertIn(
+            'WHERE (target."name", target."email") IS DISTINCT FROM (EXCLUDED."name", EXCLUDED."email")',
+            sql,
+        )
+        self.assertNotIn('"type"', sql)
+
+    def test_last_staged_row_wins_by_load_sequence(self):
+        sql = self._stager(False).merge_sql()
+        self.assertIn('SELECT DISTINCT ON ("id")', sql)
+        self.assertIn('ORDER BY "id", "_stage_seq" DESC', sql)
+        self.assertNotIn('ctid', sql)
+        # La sequenza resta interna allo staging: non viene scritta in destinazione
+        self.assertIn('AS target ("id", "name", "email") SELECT "id", "name", "email" FROM source', sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import copy
+import logging
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.sync import profiler as profiling
+from src.sync import progress as progress_tracking
+from src.sync.engine import SyncEngine, _empty_stage_seconds
+from src.sync.scheduler import DagScheduler, DurationHistory, SyncNode
+
+MIGRATION = Path(__file__).resolve().parents[1] / 'migrations' / '012_sync_state_fingerprint.sql'
+
+
+class _ProbeEngine(SyncEngine):
+    """SyncEngine su sessioni finte: la sonda restituisce `probe_row`, la query nessuna riga."""
+
+    def __init__(self, probe_row, stored_fingerprint=None, probe_error=None):
+        self.logger = logging.getLogger(__name__)
+        self.error_logger = self.logger
+        self.pg_session = MagicMock()
+        self.sap_session = MagicMock()
+        self.db_config = MagicMock()
+        self.db_config.get_pg_session.return_value = self.pg_session
+        self.db_config.get_sap_session.return_value = self.sap_session
+        self.sync_state_service = MagicMock()
+        self.sync_state_service.get_fingerprint.return_value = stored_fingerprint
+        self.sync_state_service.get_last_sync.return_value = None
+        self.batch_size = 100
+        self.pipelined = False
+        self.profiler = profiling.NULL_PROFILER
+        self.progress = progress_tracking.NULL_PROGRESS
+        self.table_progress = progress_tracking.NULL_TABLE_PROGRESS
+        self.stage_seconds = _empty_stage_seconds()
+
+        probe = MagicMock()
+        if probe_error is not None:
+            probe.first.side_effect = probe_error
+        else:
+            probe.first.return_value = probe_row
+        rows = MagicMock()
+        rows.fetchmany.return_value = []
+        self.sap_session.execute.side_effect = [probe, rows]
+
+
+class ChangeProbeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.logger.disabled = True
+        self.mapping = copy.copy(MAPPINGS_REGISTRY['catalogoBusinessPartner'])
+        self.mapping.post_sync_callback = MagicMock()
+        patchers = [
+            patch('src.sync.engine.setup_sync_logger', return_value=self.logger),
+            patch('src.sync.engine.get_mapping', return_value=self.mapping),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.logger.disabled = False
+
+    def _fingerprint(self, row, mapping=None):
+        engine = _ProbeEngine(row)
+        return engine._probe_fingerprint(engine.sap_session, mapping or self.mapping, self.logger)
+
+    def test_fingerprint_follows_probe_and_mapping_definition(self):
+        fingerprint = self._fingerprint((10, 123, 4, 56))
+
+        self.assertEqual(len(fingerprint), 64)
+        self.assertEqual(fingerprint, self._fingerprint((10, 123, 4, 56)))
+        self.assertNotEqual(fingerprint, self._fingerprint((10, 124, 4, 56)))
+        changed = copy.copy(self.mapping)
+        changed.sap_query = self.mapping.sap_query + ' WHERE 1 = 1'
+        self.assertNotEqual(fingerprint, self._fingerprint((10, 123, 4, 56), changed))
+
+    def test_unchanged_table_is_skipped_but_post_sync_runs(self):
+        engine = _ProbeEngine((10, 123, 4, 56), stored_fingerprint=self._fingerprint((10, 123, 4, 56)))
+
+        engine.sync_table('catalogoBusinessPartner')
+
+        self.assertTrue(engine.skipped)
+        self.assertEqual(engine.touched_documents, set())
+        self.assertEqual(engine.sap_session.execute.call_count, 1)
+        self.mapping.post_sync_callback.assert_called_once_with(engine.pg_session, 0, False)
+        engine.pg_session.commit.assert_called_once()
+        engine.sync_state_service.update_last_sync.assert_not_called()
+        engine.sync_state_service.update_fingerprint.assert_not_called()
+
+    def test_changed_or_forced_table_is_synced_and_fingerprint_stored(self):
+        stored = self._fingerprint((10, 123, 4, 56))
+        for row, force_full in (((11, 123, 4, 56), False), ((10, 123, 4, 56), True)):
+            with self.subTest(row=row, force_full=force_full):
+                engine = _ProbeEngine(row, stored_fingerprint=stored)
+
+                engine.sync_table('catalogoBusinessPartner', force_full=force_full)
+
+                self.assertFalse(engine.skipped)
+                self.assertEqual(engine.sap_session.execute.call_count, 2)
+                engine.sync_state_service.update_fingerprint.assert_called_once_with(
+                    engine.pg_session, 'catalogoBusinessPartner', self._fingerprint(row)
+                )
+
+    def test_failed_probe_falls_back_to_a_full_sync(self):
+        engine = _ProbeEngine(None, stored_fingerprint='x', probe_error=RuntimeError('COUNT_BIG'))
+
+        engine.sync_table('catalogoBusinessPartner')
+
+        self.assertFalse(engine.skipped)
+        engine.sap_session.rollback.assert_called_once()
+        engine.sync_state_service.update_fingerprint.assert_called_once_with(
+            engine.pg_session, 'catalogoBusinessPartner', None
+        )
+
+    def test_migration_adds_the_fingerprint_column(self):
+        up, down = MIGRATION.read_text().split('-- DOWN')
+        self.assertIn('ADD COLUMN IF NOT EXISTS change_fingerprint VARCHAR(64)', up)
+        self.assertIn('DROP COLUMN IF EXISTS change_fingerprint', down)
+
+
+class SkippedNodeTestCase(unittest.TestCase):
+    def test_skipped_nodes_are_reported_and_keep_their_expected_duration(self):
+        logger = logging.getLogger(__name__)
+        history = DurationHistory()
+        history.record('catalogo', 30.0)
+        nodes = [SyncNode('catalogo', lambda: True), SyncNode('ordini', lambda: None)]
+
+        results = {r['table']: r for r in DagScheduler(nodes, history=history, logger=logger).run()}
+
+        self.assertTrue(results['catalogo']['success'])
+        self.assertTrue(results['catalogo']['skipped'])
+        self.assertFalse(results['ordini']['skipped'])
+        self.assertEqual(history.expected('catalogo'), 30.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
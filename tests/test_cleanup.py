@@ -0,0 +1,171 @@
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.sync.cleanup import (
+    ENTRATA_MERCI_LINE_SOURCES,
+    FULL_SWEEP_STATE,
+    ORDER_SOURCES,
+    RELEASED_ORDERS,
+    CleanupScope,
+    cleanup_orphans,
+)
+from src.sync.header_delta import DocumentHeaders, delete_documents
+
+MIGRATION = Path(__file__).resolve().parents[1] / 'migrations' / '010_orphan_cleanup_indexes.sql'
+
+
+class CleanupScopeTestCase(unittest.TestCase):
+    def test_union_of_recorded_documents(self):
+        scope = CleanupScope()
+        scope.record('ordiniAcquisto', [1, 2])
+        scope.record('ordiniAcquistoLines', {2, 3})
+        scope.record('ordiniAcquisto', [4])
+
+        self.assertEqual(scope.documents(ORDER_SOURCES), {1, 2, 3, 4})
+        self.assertEqual(scope.documents(ENTRATA_MERCI_LINE_SOURCES), set())
+
+    def test_full_reload_makes_scope_unbounded(self):
+        scope = CleanupScope()
+        scope.record('ordiniAcquistoLines', None)
+        scope.record('ordiniAcquistoLines', [5])
+
+        self.assertIsNone(scope.documents(ORDER_SOURCES))
+
+    def test_failed_table_is_unbounded_and_reported(self):
+        scope = CleanupScope()
+        scope.record('ordiniAcquisto', [1])
+        scope.record_failure('ordiniAcquistoLines')
+
+        self.assertIsNone(scope.documents(ORDER_SOURCES))
+        self.assertTrue(scope.failed(ORDER_SOURCES))
+        self.assertFalse(scope.failed(ENTRATA_MERCI_LINE_SOURCES))
+
+    def test_sources_track_document_ids(self):
+        for name in ORDER_SOURCES + ENTRATA_MERCI_LINE_SOURCES:
+            with self.subTest(mapping=name):
+                if name == RELEASED_ORDERS:
+                    table_name, column = name.split('.')
+                    self.assertEqual(MAPPINGS_REGISTRY[table_name].reference_column, column)
+                else:
+                    self.assertIsNotNone(MAPPINGS_REGISTRY[name].document_column)
+
+
+class CleanupOrphansTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('src.sync.cleanup.SyncStateService')
+        self.state = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Sweep completo recente: i cicli successivi sono incrementali
+        self.state.get_last_sync.return_value = datetime.now() - timedelta(minutes=5)
+        self.session = MagicMock()
+        self.session.execute.return_value.one.return_value = (4, 1, [])
+        self.logger = MagicMock()
+        self.scope = CleanupScope()
+        self.scope.record('ordiniAcquisto', [10])
+        self.scope.record('ordiniAcquistoLines', [11, 12])
+        self.scope.record('entrataMerciLines', [200])
+
+    def _statements(self):
+        return [c.args for c in self.session.execute.call_args_list]
+
+    def test_incremental_cleanup_limited_to_touched_documents(self):
+        stats = cleanup_orphans(self.session, self.scope, self.logger)
+
+        (lines_sql, lines_params), (orders_sql, orders_params) = self._statements()
+        self.assertIn('DELETE FROM sap.entrata_merci_lines', lines_sql.text)
+        self.assertIn('WHERE l.cod_entrata_merci = ANY(:ids)', lines_sql.text)
+        self.assertEqual(lines_params, {'ids': [200]})
+        self.assertIn('DELETE FROM sap.ordini_acquisto', orders_sql.text)
+        self.assertIn('WHERE o.id = ANY(:ids)', orders_sql.text)
+        self.assertEqual(orders_params, {'ids': [10, 11, 12]})
+        self.session.commit.assert_called_once()
+        self.state.update_last_sync.assert_not_called()
+        self.assertFalse(stats['full_sweep'])
+        self.assertEqual(
+            (stats['orders_examined'], stats['orders_removed'], stats['lines_examined'], stats['lines_removed']),
+            (4, 1, 4, 1),
+        )
+
+    def test_deleted_goods_receipt_line_releases_its_order(self):
+        # Documento entrata merci modificato: la sua riga verso l'ordine 77 viene cancellata
+        sync_session = MagicMock()
+        sync_session.execute.return_value.fetchall.side_effect = [[(77, 1)], []]
+        headers = DocumentHeaders(window=[200], changed=[200])
+        delete_documents(sync_session, MAPPINGS_REGISTRY['entrataMerciLines'], headers)
+        scope = CleanupScope()
+        scope.record('entrataMerciLines', {200})
+        scope.record(RELEASED_ORDERS, headers.released)
+
+        cleanup_orphans(self.session, scope, self.logger)
+
+        (_, lines_params), (orders_sql, orders_params) = self._statements()
+        self.assertEqual(lines_params, {'ids': [200]})
+        self.assertIn('DELETE FROM sap.ordini_acquisto', orders_sql.text)
+        self.assertEqual(orders_params, {'ids': [77]})
+
+    def test_orders_of_orphan_lines_removed_by_cleanup_are_examined(self):
+        self.session.execute.return_value.one.return_value = (4, 1, [78])
+
+        cleanup_orphans(self.session, self.scope, self.logger)
+
+        (_, orders_params) = self._statements()[1]
+        self.assertEqual(orders_params, {'ids': [10, 11, 12, 78]})
+
+    def test_nothing_touched_runs_no_statement(self):
+        stats = cleanup_orphans(self.session, CleanupScope(), self.logger)
+
+        self.session.execute.assert_not_called()
+        self.session.commit.assert_called_once()
+        self.assertEqual(stats['orders_examined'], 0)
+
+    def test_forced_full_sweep_scans_whole_tables(self):
+        stats = cleanup_orphans(self.session, self.scope, self.logger, full=True)
+
+        for statement in self._statements():
+            self.assertEqual(len(statement), 1)
+            self.assertNotIn('ANY(:ids)', statement[0].text)
+        self.assertTrue(stats['full_sweep'])
+        self.assertEqual(self.state.update_last_sync.call_args.args[1], FULL_SWEEP_STATE)
+
+    def test_periodic_full_sweep(self):
+        self.state.get_last_sync.return_value = datetime.now() - timedelta(days=2)
+
+        stats = cleanup_orphans(self.session, self.scope, self.logger)
+
+        self.assertTrue(stats['full_sweep'])
+        self.state.update_last_sync.assert_called_once()
+
+    def test_reloaded_source_scans_only_its_table(self):
+        self.scope.record('ordiniAcquistoLines', None)
+
+        stats = cleanup_orphans(self.session, self.scope, self.logger)
+
+        (lines_sql, _), (orders_sql,) = self._statements()
+        self.assertIn('ANY(:ids)', lines_sql.text)
+        self.assertNotIn('ANY(:ids)', orders_sql.text)
+        self.assertFalse(stats['full_sweep'])
+
+    def test_error_is_not_blocking(self):
+        self.session.execute.side_effect = RuntimeError('boom')
+
+        stats = cleanup_orphans(self.session, self.scope, self.logger)
+
+        self.session.rollback.assert_called_once()
+        self.session.commit.assert_not_called()
+        self.logger.warning.assert_called_once()
+        self.assertEqual(stats['orders_removed'], 0)
+
+
+class OrphanCleanupMigrationTestCase(unittest.TestCase):
+    def test_migration_creates_and_drops_index(self):
+        up, down = MIGRATION.read_text().split('-- DOWN')
+        self.assertIn('-- UP', up)
+        self.assertIn('ON sap.entrata_merci_lines (cod_order_acquisto)', up)
+        self.assertIn('DROP INDEX IF EXISTS sap.entrata_merci_lines_cod_order_acquisto_idx', down)
+
+
+if __name__ == '__main__':
+    unittest.main()
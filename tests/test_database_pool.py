@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import text
+
+import src.config.database as database
+from src.config.database import (
+    DatabaseConfig,
+    TimedQueuePool,
+    _urls_fingerprint,
+    get_pool_stats,
+    refresh_database_config,
+    set_database_config,
+)
+
+
+class SharedDatabaseConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.urls = self._urls('a')
+        set_database_config(None)
+
+    def tearDown(self):
+        config = database._shared_config
+        if config is not None:
+            config.dispose()
+        set_database_config(None)
+        self.tmpdir.cleanup()
+
+    def _urls(self, name):
+        sqlite_url = f"sqlite:///{os.path.join(self.tmpdir.name, name + '.db')}"
+        return {
+            'environment': 'test',
+            'postgres': sqlite_url,
+            'sap': sqlite_url,
+            'deposyta': None,
+            'modula': None,
+        }
+
+    def test_engines_use_timed_pool_with_stats(self):
+        config = DatabaseConfig(self.urls)
+        self.assertIsInstance(config.pg_engine.pool, TimedQueuePool)
+        with config.pg_engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+            stats = config.pool_stats()['postgres']
+            self.assertEqual(stats['checked_out'], 1)
+        stats = config.pool_stats()['postgres']
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertGreaterEqual(stats['wait_count'], 1)
+        self.assertEqual(set(config.pool_stats()), {'postgres', 'sap'})
+        config.dispose()
+
+    def test_fingerprint_ignores_environment_label(self):
+        other = dict(self.urls, environment='production')
+        self.assertEqual(_urls_fingerprint(self.urls), _urls_fingerprint(other))
+        self.assertNotEqual(_urls_fingerprint(self.urls), _urls_fingerprint(self._urls('b')))
+
+    def test_refresh_rebuilds_only_when_credentials_change(self):
+        with mock.patch.object(database, '_resolve_database_urls', return_value=self.urls):
+            first = refresh_database_config()
+            self.assertIs(refresh_database_config(), first)
+            self.assertIs(database.get_database_config(), first)
+        with mock.patch.object(database, '_resolve_database_urls', return_value=self._urls('b')):
+            second = refresh_database_config()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.postgres_url, self._urls('b')['postgres'])
+
+    def test_pool_stats_empty_without_shared_config(self):
+        self.assertEqual(get_pool_stats(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
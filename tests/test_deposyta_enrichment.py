@@ -1,6 +1,10 @@
 import unittest
 
-from src.sync.deposyta_enrichment import normalizza_qta_confezione, pezzi_da_confezioni
+from src.sync.deposyta_enrichment import (
+    join_deposyta_stock,
+    normalizza_qta_confezione,
+    pezzi_da_confezioni,
+)
 
 
 class DeposytaEnrichmentTestCase(unittest.TestCase):
@@ -22,5 +26,47 @@ class DeposytaEnrichmentTestCase(unittest.TestCase):
         self.assertIsNone(pezzi_da_confezioni(None, 10))
 
 
+
+class JoinDeposytaStockTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stats = {'skipped': 0}
+
+    def test_join_normalizza_codici_e_location(self):
+        locations = [
+            (' A1 ', 'Magazzino ', 2, 3),
+            ('A2', 'Altro', 1, 1),
+            ('', 'Magazzino', 1, 1),
+        ]
+        oggetti = [('A1  ', 10), ('A2', 5)]
+        result = join_deposyta_stock(locations, oggetti, {'A1', 'A2'}, self.stats)
+        self.assertEqual(result, {
+            'A1': {'articolo': 'A1', 'qta_x_conf': 10.0, 'scorta_minima': 20.0, 'quantita': 30.0},
+        })
+        self.assertEqual(self.stats['skipped'], 0)
+
+    def test_join_senza_distinzione_maiuscole_minuscole(self):
+        locations = [('a1', 'MAGAZZINO', 2, 3), ('b2 ', 'magazzino', 1, 1)]
+        oggetti = [('A1', 10), ('B2', 5)]
+        result = join_deposyta_stock(locations, oggetti, {'A1', 'b2'}, self.stats)
+        # Il codice resta quello dell'anagrafica PG (UPDATE con confronto esatto)
+        self.assertEqual(result, {
+            'A1': {'articolo': 'A1', 'qta_x_conf': 10.0, 'scorta_minima': 20.0, 'quantita': 30.0},
+            'b2': {'articolo': 'b2', 'qta_x_conf': 5.0, 'scorta_minima': 5.0, 'quantita': 5.0},
+        })
+        self.assertEqual(self.stats['skipped'], 0)
+
+    def test_articoli_non_deposita_contati_come_skipped(self):
+        result = join_deposyta_stock([('B1', 'Magazzino', 1, 1)], [('B1', 1), ('B1', 2)], {'A1'}, self.stats)
+        self.assertEqual(result, {})
+        self.assertEqual(self.stats['skipped'], 2)
+
+    def test_senza_giacenza_non_aggiorna_scorta(self):
+        result = join_deposyta_stock([('A1', 'Magazzino', 4, None)], [('A1', 0)], {'A1'}, self.stats)
+        self.assertEqual(result['A1'], {'articolo': 'A1', 'qta_x_conf': 1.0, 'scorta_minima': None, 'quantita': None})
+
+    def test_oggetto_assente_esclude_la_location(self):
+        self.assertEqual(join_deposyta_stock([('A1', 'Magazzino', 1, 1)], [], {'A1'}, self.stats), {})
+
+
 if __name__ == '__main__':
     unittest.main()
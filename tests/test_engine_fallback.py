@@ -0,0 +1,103 @@
+import logging
+import unittest
+
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.sync.engine import SyncEngine
+
+
+class _FakeSavepoint:
+    def __init__(self, session):
+        self.session = session
+
+    def commit(self):
+        self.session.committed += 1
+
+    def rollback(self):
+        self.session.rolled_back += 1
+
+
+class _FakeSession:
+    def __init__(self):
+        self.committed = 0
+        self.rolled_back = 0
+
+    def begin_nested(self):
+        return _FakeSavepoint(self)
+
+
+class _RecordingEngine(SyncEngine):
+    """SyncEngine senza connessioni: la scrittura fallisce se il batch contiene righe 'bad'."""
+
+    def __init__(self, bad_ids):
+        self.logger = logging.getLogger(__name__)
+        self.fallback_statements = 0
+        self.bad_ids = set(bad_ids)
+        self.written = []
+        self.calls = 0
+
+    def _execute_insert_batch(self, session, mapping, records, table=None):
+        self.calls += 1
+        bad = [rec['id'] for rec in records if rec['id'] in self.bad_ids]
+        if bad:
+            raise ValueError(f'violazione vincolo su {bad}')
+        self.written.extend(rec['id'] for rec in records)
+
+    _execute_upsert_batch = _execute_insert_batch
+
+
+class BisectionFallbackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mapping = MAPPINGS_REGISTRY['entrataMerci']
+        self.logger = logging.getLogger(__name__)
+        self.logger.disabled = True
+        self.records = [{'id': i} for i in range(1000)]
+
+    def tearDown(self):
+        self.logger.disabled = False
+
+    def _run(self, bad_ids, records=None):
+        engine = _RecordingEngine(bad_ids)
+        session = _FakeSession()
+        result = engine._execute_batch_with_fallback(
+            session, self.mapping, records or self.records, self.logger, 'Batch insert'
+        )
+        return engine, session, result
+
+    def test_clean_batch_is_written_once(self):
+        engine, session, result = self._run([])
+        self.assertEqual(result, (1000, 0))
+        self.assertEqual(engine.calls, 1)
+        self.assertEqual(engine.fallback_statements, 0)
+        self.assertEqual(session.committed, 1)
+
+    def test_single_bad_row_is_isolated_in_log_n_statements(self):
+        engine, _, result = self._run([537])
+        self.assertEqual(result, (999, 1))
+        self.assertEqual(sorted(engine.written), [i for i in range(1000) if i != 537])
+        # Due metà per livello, ~log2(1000) livelli
+        self.assertLessEqual(engine.fallback_statements, 2 * 10)
+        self.assertEqual(engine.calls, engine.fallback_statements + 1)
+
+    def test_multiple_bad_rows_keep_accounting(self):
+        bad = [0, 1, 500, 999]
+        engine, session, result = self._run(bad)
+        self.assertEqual(result, (996, 4))
+        self.assertEqual(len(engine.written), 996)
+        self.assertLess(engine.fallback_statements, 1000)
+        self.assertEqual(session.committed + session.rolled_back, engine.calls)
+
+    def test_all_rows_bad(self):
+        records = [{'id': i} for i in range(8)]
+        engine, _, result = self._run(range(8), records)
+        self.assertEqual(result, (0, 8))
+        self.assertEqual(engine.written, [])
+
+    def test_single_row_batch_is_not_retried(self):
+        engine, _, result = self._run([3], [{'id': 3}])
+        self.assertEqual(result, (0, 1))
+        self.assertEqual(engine.calls, 1)
+        self.assertEqual(engine.fallback_statements, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
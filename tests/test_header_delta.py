@@ -0,0 +1,190 @@
+import logging
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from src.mappings.base import SyncStrategy, TableMapping
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.models.ordini_acquisto_lines import SAP_OrdiniAcquistoLine
+from src.sync import profiler as profiling
+from src.sync import progress as progress_tracking
+from src.sync.engine import SyncEngine, _empty_stage_seconds
+from src.sync.header_delta import DocumentHeaders, delete_documents, full_reload_state, split_headers
+
+LAST_SYNC = datetime(2026, 3, 1, 12, 0, 0)
+
+
+class SplitHeadersTestCase(unittest.TestCase):
+    def test_changed_documents_and_watermark(self):
+        rows = [
+            (10, datetime(2026, 2, 28), 235959),  # prima del watermark
+            (11, datetime(2026, 3, 1), 120000),   # uguale al watermark: invariato
+            (12, datetime(2026, 3, 1), 120001),
+            (13, datetime(2026, 3, 2), 5),
+        ]
+        headers = split_headers(rows, LAST_SYNC)
+        self.assertEqual(headers.window, [10, 11, 12, 13])
+        self.assertEqual(headers.changed, [12, 13])
+        self.assertEqual(headers.watermark, datetime(2026, 3, 2, 0, 0, 5))
+
+    def test_without_last_sync_every_document_changed(self):
+        headers = split_headers([(1, datetime(2026, 1, 1), 0), (2, None, None)], None)
+        self.assertEqual(headers.changed, [1, 2])
+        self.assertEqual(headers.watermark, datetime(2026, 1, 1))
+
+    def test_header_without_timestamp_is_rewritten(self):
+        headers = split_headers([(1, None, None)], LAST_SYNC)
+        self.assertEqual(headers.changed, [1])
+        self.assertIsNone(headers.watermark)
+
+    def test_empty_window(self):
+        headers = split_headers([], LAST_SYNC)
+        self.assertEqual((headers.window, headers.changed, headers.watermark), ([], [], None))
+
+
+class DocumentQueryTestCase(unittest.TestCase):
+    def test_line_mappings_use_header_delta(self):
+        for name in ('ordiniAcquistoLines', 'entrataMerciLines'):
+            with self.subTest(mapping=name):
+                mapping = MAPPINGS_REGISTRY[name]
+                self.assertTrue(mapping.uses_header_delta())
+                self.assertTrue(mapping.inserts_only())
+                self.assertFalse(mapping.requires_truncate())
+                self.assertIn(mapping.document_column, mapping.pg_model.__table__.c)
+
+    def test_document_filter_is_bound(self):
+        mapping = MAPPINGS_REGISTRY['ordiniAcquistoLines']
+        query, params = SyncEngine._build_document_query(mapping, [501, 502])
+        self.assertEqual(
+            query,
+            f"{mapping.sap_query} AND p.DocEntry IN (:document_0, :document_1)",
+        )
+        self.assertEqual(params, {'document_0': 501, 'document_1': 502})
+
+    def test_no_changed_documents_skips_query(self):
+        mapping = MAPPINGS_REGISTRY['entrataMerciLines']
+        self.assertEqual(SyncEngine._build_document_query(mapping, []), (None, {}))
+
+    def test_header_delta_requires_document_settings(self):
+        with self.assertRaises(ValueError):
+            TableMapping(
+                sap_table="dbo.POR1",
+                pg_model=SAP_OrdiniAcquistoLine,
+                column_mappings={"LineNum": "id", "DocEntry": "cod_documento"},
+                primary_key_sap=["LineNum", "DocEntry"],
+                sync_strategy=SyncStrategy.HEADER_DELTA,
+            )
+
+
+class DeleteDocumentsTestCase(unittest.TestCase):
+    def _session(self, changed_rows, trimmed_rows):
+        session = MagicMock()
+        changed, trimmed = MagicMock(), MagicMock()
+        changed.fetchall.return_value = changed_rows
+        trimmed.fetchall.return_value = trimmed_rows
+        session.execute.side_effect = [changed, trimmed]
+        return session
+
+    def test_records_documents_trimmed_from_window(self):
+        session = self._session([(None, 3)], [(7, None, 2), (8, None, 1)])
+        headers = DocumentHeaders(window=[10, 11], changed=[11])
+
+        result = delete_documents(session, MAPPINGS_REGISTRY['ordiniAcquistoLines'], headers)
+
+        self.assertEqual(result, (3, 3))
+        self.assertEqual(headers.trimmed, [7, 8])
+        self.assertEqual(headers.released, set())
+        changed_sql, trim_sql = (c.args[0].text for c in session.execute.call_args_list)
+        self.assertIn('"cod_documento" = ANY(:ids) RETURNING NULL AS reference', changed_sql)
+        self.assertIn('"cod_documento" <> ALL(:ids) RETURNING "cod_documento" AS document', trim_sql)
+
+    def test_records_references_of_deleted_lines(self):
+        session = self._session([(500, 2), (None, 1)], [(7, 501, 1), (7, None, 1), (8, 500, 1)])
+        headers = DocumentHeaders(window=[10, 11], changed=[11])
+
+        result = delete_documents(session, MAPPINGS_REGISTRY['entrataMerciLines'], headers)
+
+        self.assertEqual(result, (3, 3))
+        self.assertEqual(headers.trimmed, [7, 8])
+        self.assertEqual(headers.released, {500, 501})
+        for statement in session.execute.call_args_list:
+            self.assertIn('"cod_order_acquisto" AS reference', statement.args[0].text)
+
+
+class _HeaderDeltaEngine(SyncEngine):
+    """SyncEngine su sessioni finte: testate invariate, nessuna riga da SAP, tabella PG non vuota."""
+
+    def __init__(self, states):
+        self.logger = logging.getLogger(__name__)
+        self.error_logger = self.logger
+        self.pg_session = MagicMock()
+        self.pg_session.execute.return_value.scalar.return_value = True
+        self.pg_session.execute.return_value.fetchall.return_value = []
+        self.sap_session = MagicMock()
+        self.db_config = MagicMock()
+        self.db_config.get_pg_session.return_value = self.pg_session
+        self.db_config.get_sap_session.return_value = self.sap_session
+        self.sync_state_service = MagicMock()
+        self.sync_state_service.get_last_sync.side_effect = lambda session, name: states.get(name)
+        self.batch_size = 100
+        self.pipelined = False
+        self.profiler = profiling.NULL_PROFILER
+        self.progress = progress_tracking.NULL_PROGRESS
+        self.table_progress = progress_tracking.NULL_TABLE_PROGRESS
+        self.stage_seconds = _empty_stage_seconds()
+
+        headers = MagicMock()
+        headers.fetchall.return_value = [(200, LAST_SYNC, 120000)]
+        rows = MagicMock()
+        rows.fetchmany.return_value = []
+        self.sap_session.execute.side_effect = [headers, rows]
+
+
+class PeriodicFullReloadTestCase(unittest.TestCase):
+    """Righe che cambiano senza modifiche alla testata (ordine arrivato dopo, flag articolo)."""
+
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.logger.disabled = True
+        patcher = patch('src.sync.engine.setup_sync_logger', return_value=self.logger)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.logger.disabled = False
+
+    def _sync(self, last_reload):
+        state = full_reload_state('entrataMerciLines')
+        engine = _HeaderDeltaEngine({'entrataMerciLines': LAST_SYNC, state: last_reload})
+        engine.sync_table('entrataMerciLines')
+        return engine, state
+
+    def test_unchanged_headers_reload_all_lines_when_due(self):
+        for last_reload in (None, datetime.now() - timedelta(hours=25)):
+            with self.subTest(last_reload=last_reload):
+                engine, state = self._sync(last_reload)
+
+                self.assertIsNone(engine.touched_documents)
+                rows_query = engine.sap_session.execute.call_args_list[1].args[0].text
+                self.assertNotIn('IN (', rows_query)
+                recorded = {c.args[1]: c.args[2] for c in engine.sync_state_service.update_last_sync.call_args_list}
+                self.assertEqual(recorded['entrataMerciLines'], datetime(2026, 3, 1, 12, 0, 0))
+                self.assertLess(datetime.now() - recorded[state], timedelta(minutes=1))
+
+    def test_recent_reload_keeps_document_delta(self):
+        engine, state = self._sync(datetime.now() - timedelta(hours=1))
+
+        self.assertEqual(engine.touched_documents, set())
+        self.assertEqual(engine.sap_session.execute.call_count, 1)
+        recorded = [c.args[1] for c in engine.sync_state_service.update_last_sync.call_args_list]
+        self.assertNotIn(state, recorded)
+
+    def test_reload_interval_from_settings(self):
+        with patch.dict('os.environ', {'HEADER_DELTA_FULL_RELOAD_HOURS': '0'}):
+            engine, _ = self._sync(datetime.now() - timedelta(seconds=1))
+
+        self.assertIsNone(engine.touched_documents)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 from unittest.mock import MagicMock
 
 from src.sync.magazzino_bootstrap import (
+    _BOOTSTRAP_MAGAZZINO_ARTICOLI_SQL,
     _BOOTSTRAP_MAGAZZINO_SQL,
     bootstrap_magazzino_from_sap,
 )
@@ -31,5 +32,29 @@ class MagazzinoBootstrapTestCase(unittest.TestCase):
         self.assertEqual(result, 0)
 
 
+    def test_sql_has_no_correlated_description_lookup(self):
+        for sql in (_BOOTSTRAP_MAGAZZINO_SQL, _BOOTSTRAP_MAGAZZINO_ARTICOLI_SQL):
+            do_update = sql.split('DO UPDATE SET', 1)[1]
+            self.assertNotIn('SELECT', do_update)
+            self.assertIn('WHERE magazzino.note IS DISTINCT FROM', do_update)
+
+    def test_bootstrap_limited_to_touched_articles(self):
+        session = MagicMock()
+        session.execute.return_value.rowcount = 2
+
+        result = bootstrap_magazzino_from_sap(session, ['ART1', 'ART2'])
+
+        self.assertEqual(result, 2)
+        statement, params = session.execute.call_args.args
+        self.assertIn('ANY(CAST(:articoli AS text[]))', statement.text)
+        self.assertEqual(params, {'articoli': ['ART1', 'ART2']})
+
+    def test_bootstrap_without_touched_articles_is_noop(self):
+        session = MagicMock()
+
+        self.assertEqual(bootstrap_magazzino_from_sap(session, []), 0)
+        session.execute.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+
+import src.mappings.anagrafica_articoli as anagrafica_articoli_module
+import src.mappings.entrata_merci_lines as entrata_merci_lines_module
+from src.mappings.registry import MAPPINGS_REGISTRY
+
+
+def _sample_value(sap_col, variant):
+    """Valore rappresentativo per una colonna SAP (variant 0 = pieno, 1 = alternativo, 2 = NULL)."""
+    if variant == 2:
+        return None
+    if sap_col == 'UpdateDate':
+        return datetime(2026, 3, 1) if variant == 0 else datetime(2025, 12, 31)
+    if sap_col == 'UpdateTS':
+        return 134501 if variant == 0 else 5
+    if sap_col in ('DocDate', 'DocDueDate'):
+        return datetime(2026, 1, 15) if variant == 0 else '2026-01-16'
+    if sap_col == 'ShipDate':
+        return datetime(2026, 2, 1, 10, 0) if variant == 0 else date(2026, 2, 2)
+    if sap_col in ('DocEntry', 'DocNum', 'LineNum', 'BaseEntry', 'BaseLine'):
+        return 501 if variant == 0 else 0
+    if sap_col in ('Quantity', 'MinLevel', 'ReorderQty', 'Price'):
+        return Decimal('3.500000') if variant == 0 else 7.25
+    if sap_col in ('DocStatus', 'LineStatus'):
+        return 'C' if variant == 0 else 'O'
+    if sap_col.startswith('QryGroup'):
+        return 'Y' if (variant == 0) == (sap_col == 'QryGroup15') else 'N'
+    if sap_col == 'U_Aggiuntiva':
+        return 'PRIORITA ALTA' if variant == 0 else 'CRITICO'
+    if sap_col == 'U_SFT_SUBCAT':
+        return 'ART001' if variant == 0 else 'UNKNOWN'
+    return f'{sap_col}-value' if variant == 0 else ''
+
+
+def _description(columns, row):
+    return [(col, type(value) if value is not None else str) for col, value in zip(columns, row)]
+
+
+class CompiledTransformerTestCase(unittest.TestCase):
+    def setUp(self):
+        anagrafica_articoli_module._sap_item_codes = {'ART001'}
+        entrata_merci_lines_module._valid_order_ids = {501}
+
+    def tearDown(self):
+        anagrafica_articoli_module._sap_item_codes = None
+        entrata_merci_lines_module._valid_order_ids = None
+
+    def _assert_same_output(self, mapping, columns, rows, description=None):
+        transformer = mapping.compile_transformer(columns, description)
+        for row in rows:
+            expected = mapping.transform_row(dict(zip(columns, row)))
+            self.assertEqual(transformer(tuple(row)), expected)
+
+    def test_compiled_output_matches_transform_row_for_every_mapping(self):
+        for name, mapping in MAPPINGS_REGISTRY.items():
+            with self.subTest(mapping=name):
+                columns = list(mapping.column_mappings)
+                rows = [[_sample_value(col, variant) for col in columns] for variant in range(3)]
+                self._assert_same_output(mapping, columns, rows)
+                self._assert_same_output(mapping, columns, rows, _description(columns, rows[0]))
+
+    def test_driver_column_casing_is_resolved_case_insensitively(self):
+        mapping = MAPPINGS_REGISTRY['anagraficheBusinessPartner']
+        columns = ['cardcode', 'CARDNAME', 'CardType', 'e_mail', 'updatedate', 'UPDATETS']
+        rows = [['C001', 'Fornitore', 'S', None, datetime(2026, 3, 1), 101010]]
+        self._assert_same_output(mapping, columns, rows)
+
+    def test_missing_columns_are_omitted_like_transform_row(self):
+        mapping = MAPPINGS_REGISTRY['catalogoBusinessPartner']
+        columns = ['ItemCode', 'CardCode']
+        rows = [['ART001', 'F001']]
+        self._assert_same_output(mapping, columns, rows)
+
+    def test_fast_path_still_converts_values_of_other_types(self):
+        mapping = MAPPINGS_REGISTRY['ordiniAcquistoLines']
+        columns = list(mapping.column_mappings)
+        description = [(col, float if col == 'Quantity' else str) for col in columns]
+        transformer = mapping.compile_transformer(columns, description)
+        row = transformer((1, 501, 'ART001', Decimal('2.5'), '2026-02-01', 'O'))
+        self.assertEqual(row['quantity'], 2.5)
+        self.assertIsInstance(row['quantity'], float)
+        self.assertEqual(row['data_consegna'], date(2026, 2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.utils import metrics
+from src.utils.metrics import MetricsRegistry
+
+
+def _sample_lines(text, name):
+    return [line for line in text.splitlines() if line.startswith(name)]
+
+
+class MetricsRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter_and_gauge_exposition(self):
+        counter = self.registry.counter('jobs_total', 'Job eseguiti', ('table',))
+        gauge = self.registry.gauge('queue_size', 'Coda')
+        counter.inc(table='a')
+        counter.inc(2, table='a')
+        gauge.set(1.5)
+
+        text = self.registry.render()
+
+        self.assertIn('# TYPE jobs_total counter', text)
+        self.assertIn('jobs_total{table="a"} 3', text)
+        self.assertIn('# TYPE queue_size gauge', text)
+        self.assertIn('queue_size 1.5', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('latency_seconds', 'Latenza', ('table',), buckets=(1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value, table='t')
+
+        lines = _sample_lines(self.registry.render(), 'latency_seconds')
+
+        self.assertEqual(lines, [
+            'latency_seconds_bucket{table="t",le="1"} 2',
+            'latency_seconds_bucket{table="t",le="5"} 3',
+            'latency_seconds_bucket{table="t",le="+Inf"} 4',
+            'latency_seconds_sum{table="t"} 14.5',
+            'latency_seconds_count{table="t"} 4',
+        ])
+
+    def test_label_values_are_escaped(self):
+        gauge = self.registry.gauge('info', 'Info', ('name',))
+        gauge.set(1, name='a"b\\c\nd')
+        self.assertIn('info{name="a\\"b\\\\c\\nd"} 1', self.registry.render())
+
+    def test_wrong_labels_and_negative_counter_are_rejected(self):
+        counter = self.registry.counter('c_total', 'C', ('table',))
+        with self.assertRaises(ValueError):
+            counter.inc(other='x')
+        with self.assertRaises(ValueError):
+            counter.inc(-1, table='x')
+        with self.assertRaises(ValueError):
+            self.registry.gauge('c_total', 'C', ('table',))
+
+    def test_concurrent_updates_are_not_lost(self):
+        counter = self.registry.counter('hits_total', 'Hits')
+
+        def hit():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=hit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.value(), 8000)
+
+
+class ServiceMetricsTestCase(unittest.TestCase):
+    def test_table_sync_metrics_and_last_success_age(self):
+        before = metrics.ROWS_PER_SYNC.count(table='testTable')
+        metrics.observe_table_sync('testTable', 0.2, 0.1, 0.4, 1500, 3, 2)
+
+        self.assertEqual(metrics.ROWS_PER_SYNC.count(table='testTable'), before + 1)
+        self.assertGreaterEqual(metrics.FALLBACK_STATEMENTS.value(table='testTable'), 3)
+        self.assertGreaterEqual(metrics.SKIPPED_ROWS.value(table='testTable'), 2)
+        text = metrics.registry.render()
+        self.assertIn('sap_sync_last_success_age_seconds{table="testTable"}', text)
+        self.assertIn('sap_sync_pg_write_seconds_count{table="testTable"}', text)
+
+    def test_pool_stats_are_exported(self):
+        stats = {'postgres': {'size': 5, 'checked_out': 2, 'checked_in': 3, 'overflow': 0,
+                              'wait_count': 40, 'wait_seconds_total': 0.5, 'wait_seconds_max': 0.1}}
+        with patch('src.config.database.get_pool_stats', return_value=stats):
+            text = metrics.registry.render()
+        self.assertIn('sap_sync_db_pool_checked_out{database="postgres"} 2', text)
+        self.assertIn('sap_sync_db_pool_checkouts_total{database="postgres"} 40', text)
+
+    def test_metrics_endpoint(self):
+        from src.api.app import app
+
+        response = app.test_client().get('/api/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE sap_sync_cycle_seconds histogram', response.get_data(as_text=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,11 @@
 import unittest
+from types import SimpleNamespace
 
-from src.sync.modula_enrichment import _load_modula_by_description
+from src.sync.modula_enrichment import _load_modula_by_description, resolve_modula_stock
+
+
+def _row(descr, **values):
+    return SimpleNamespace(_mapping={'articolo_descr': descr, **values})
 
 
 class ModulaEnrichmentTestCase(unittest.TestCase):
@@ -36,5 +41,29 @@ class ModulaEnrichmentTestCase(unittest.TestCase):
         self.assertEqual(sorted(index['Same Desc']), ['ART001', 'ART002'])
 
 
+
+class ResolveModulaStockTestCase(unittest.TestCase):
+    def test_fan_out_su_descrizioni_condivise(self):
+        stats = {'skipped': 0}
+        result = resolve_modula_stock(
+            [_row('Vite M6', scorta_minima=4), _row('Dado', scorta_minima=None)],
+            [_row('Vite M6', quantita=12), _row('Sconosciuto', quantita=1), _row('Dado', quantita=3)],
+            {'Vite M6': ['ART001', 'ART002'], 'Dado': ['ART003']},
+            stats,
+        )
+        self.assertEqual(result, {
+            'ART001': {'articolo': 'ART001', 'scorta_minima': 4.0, 'quantita': 12.0},
+            'ART002': {'articolo': 'ART002', 'scorta_minima': 4.0, 'quantita': 12.0},
+            'ART003': {'articolo': 'ART003', 'scorta_minima': None, 'quantita': 3.0},
+        })
+        # scorta NULL per Dado + descrizione sconosciuta
+        self.assertEqual(stats['skipped'], 2)
+
+    def test_descrizione_vuota_skipped(self):
+        stats = {'skipped': 0}
+        self.assertEqual(resolve_modula_stock([_row(None, scorta_minima=1)], [], {'': ['X']}, stats), {})
+        self.assertEqual(stats['skipped'], 1)
+
+
 if __name__ == '__main__':
     unittest.main()
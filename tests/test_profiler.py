@@ -0,0 +1,125 @@
+import os
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from src.sync import profiler as profiling
+from src.sync.profiler import NULL_PROFILER, NULL_TABLE_PROFILE, RunProfiler, TableProfile
+
+MIGRATION = Path(__file__).resolve().parents[1] / 'migrations' / '011_sync_runs.sql'
+
+
+class TableProfileTestCase(unittest.TestCase):
+    def test_stages_accumulate_time_calls_and_counters(self):
+        profile = TableProfile('ordiniAcquisto')
+        with profile.stage('commit'):
+            pass
+        with profile.stage('commit'):
+            pass
+        profile.add('pg_write', 1.5, rows=10, skipped=0)
+        profile.add('pg_write', 0.5, rows=5, skipped=2)
+
+        records = {r['stage']: r for r in profile.records()}
+
+        self.assertEqual(records['commit']['calls'], 2)
+        self.assertIsNone(records['commit']['counters'])
+        self.assertEqual(records['pg_write']['duration_seconds'], 2.0)
+        self.assertEqual(records['pg_write']['counters'], {'rows': 15, 'skipped': 2})
+        self.assertEqual(records['pg_write']['table_name'], 'ordiniAcquisto')
+
+    def test_stage_is_recorded_when_block_raises(self):
+        profile = TableProfile('t')
+        with self.assertRaises(RuntimeError):
+            with profile.stage('post_sync_callback'):
+                raise RuntimeError('boom')
+        self.assertEqual(profile.records()[0]['calls'], 1)
+
+    def test_null_profile_records_nothing(self):
+        self.assertIs(NULL_PROFILER.table('t'), NULL_TABLE_PROFILE)
+        self.assertIs(NULL_TABLE_PROFILE.stage('a'), NULL_TABLE_PROFILE.stage('b'))
+        with NULL_TABLE_PROFILE.stage('a'):
+            NULL_TABLE_PROFILE.add('a', 1.0, rows=1)
+        self.assertEqual(NULL_TABLE_PROFILE.records(), [])
+        self.assertIsNone(NULL_PROFILER.finish(True))
+
+
+class CurrentProfileTestCase(unittest.TestCase):
+    def tearDown(self):
+        profiling.set_current(None)
+
+    def test_current_is_thread_local(self):
+        profile = TableProfile('t')
+        profiling.set_current(profile)
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(profiling.current()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(profiling.current(), profile)
+        self.assertIs(seen[0], NULL_TABLE_PROFILE)
+        profiling.set_current(None)
+        self.assertIs(profiling.current(), NULL_TABLE_PROFILE)
+
+
+class RunProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = MagicMock()
+        self.db_config = MagicMock()
+        self.db_config.get_pg_session.return_value = self.session
+
+    def test_same_profile_per_table(self):
+        profiler = RunProfiler()
+        self.assertIs(profiler.table('a'), profiler.table('a'))
+        self.assertIsNot(profiler.table('a'), profiler.table('b'))
+
+    def test_finish_writes_run_and_stages(self):
+        profiler = RunProfiler('api', force_full=True)
+        profiler.table('ordiniAcquisto').add('pg_write', 0.2, rows=3)
+        profiler.table(profiling.CYCLE).add('graph', 1.0)
+
+        def assign_id():
+            self.session.add.call_args.args[0].id = 7
+        self.session.flush.side_effect = assign_id
+
+        run_id = profiler.finish(True, db_config=self.db_config)
+
+        self.assertEqual(run_id, 7)
+        run = self.session.add.call_args.args[0]
+        self.assertEqual((run.trigger, run.force_full, run.success), ('api', True, True))
+        stages = list(self.session.add_all.call_args.args[0])
+        self.assertEqual({(s.run_id, s.table_name, s.stage) for s in stages},
+                         {(7, 'ordiniAcquisto', 'pg_write'), (7, profiling.CYCLE, 'graph')})
+        self.session.commit.assert_called_once()
+        self.session.close.assert_called_once()
+
+    def test_finish_does_not_raise(self):
+        self.session.commit.side_effect = RuntimeError('boom')
+        logger = MagicMock()
+
+        self.assertIsNone(RunProfiler().finish(False, logger, self.db_config))
+
+        self.session.rollback.assert_called_once()
+        self.session.close.assert_called_once()
+        logger.warning.assert_called_once()
+
+    def test_create_run_profiler_honours_setting(self):
+        with patch.dict(os.environ, {'SYNC_PROFILER': 'false'}):
+            self.assertIs(profiling.create_run_profiler(), NULL_PROFILER)
+        with patch.dict(os.environ, {'SYNC_PROFILER': 'true'}):
+            profiler = profiling.create_run_profiler('api')
+        self.assertIsInstance(profiler, RunProfiler)
+        self.assertEqual(profiler.trigger, 'api')
+
+
+class SyncRunsMigrationTestCase(unittest.TestCase):
+    def test_migration_creates_and_drops_tables(self):
+        up, down = MIGRATION.read_text().split('-- DOWN')
+        self.assertIn('CREATE TABLE IF NOT EXISTS sap.sync_runs', up)
+        self.assertIn('REFERENCES sap.sync_runs(id) ON DELETE CASCADE', up)
+        self.assertIn('DROP TABLE IF EXISTS sap.sync_run_stages', down)
+        self.assertIn('DROP TABLE IF EXISTS sap.sync_runs', down)
+
+
+if __name__ == '__main__':
+    unittest.main()
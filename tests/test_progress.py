@@ -0,0 +1,225 @@
+import json
+import logging
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.sync import progress as progress_tracking
+from src.sync.engine import SyncEngine, _empty_stage_seconds
+from src.sync.progress import (
+    NULL_PROGRESS,
+    NULL_TABLE_PROGRESS,
+    RowHistory,
+    SyncCancelled,
+    SyncProgress,
+)
+
+
+class SyncProgressTestCase(unittest.TestCase):
+    def test_rows_rate_and_eta_from_previous_run(self):
+        history = RowHistory()
+        history.record('ordiniAcquisto', True, 1000)
+        run = SyncProgress('api', ['ordiniAcquisto', 'entrataMerci'], history=history)
+        tracker = run.table('ordiniAcquisto')
+
+        tracker.start()
+        tracker.set_mode(True)
+        tracker.set_stage('stream_rows')
+        tracker.update(250, 200)
+        snapshot = run.snapshot()
+        table = snapshot['tables'][0]
+
+        self.assertEqual((table['status'], table['stage'], table['mode']), ('running', 'stream_rows', 'full'))
+        self.assertEqual((table['rows_extracted'], table['rows_written'], table['expected_rows']), (250, 200, 1000))
+        self.assertGreater(table['rows_per_second'], 0)
+        self.assertIsNotNone(table['eta_seconds'])
+        self.assertEqual(snapshot['current_tables'], ['ordiniAcquisto'])
+        self.assertEqual(snapshot['tables'][1]['status'], 'pending')
+
+        # Senza storico per la modalità delta non c'è ETA
+        tracker.set_mode(False)
+        self.assertIsNone(run.snapshot()['tables'][0]['eta_seconds'])
+
+    def test_only_completed_tables_update_the_history(self):
+        history = RowHistory()
+        run = SyncProgress('api', history=history)
+        done, failed = run.table('a'), run.table('b')
+        for tracker in (done, failed):
+            tracker.start()
+            tracker.set_mode(False)
+            tracker.update(42, 42)
+        done.finish(progress_tracking.DONE)
+        failed.finish(progress_tracking.FAILED, 'boom')
+
+        self.assertEqual(history.expected('a', False), 42)
+        self.assertIsNone(history.expected('a', True))
+        self.assertIsNone(history.expected('b', False))
+        self.assertEqual(run.snapshot()['tables'][1]['error'], 'boom')
+
+    def test_cancel_marks_pending_tables_and_is_refused_after_finish(self):
+        run = SyncProgress('scheduler', ['a', 'b'])
+        run.table('a').start()
+
+        self.assertTrue(run.cancel())
+        with self.assertRaises(SyncCancelled):
+            run.check_cancelled()
+        run.table('a').finish(progress_tracking.CANCELLED)
+        run.finish()
+
+        snapshot = run.snapshot()
+        self.assertEqual(snapshot['status'], 'cancelled')
+        self.assertTrue(snapshot['cancel_requested'])
+        self.assertEqual([t['status'] for t in snapshot['tables']], ['cancelled', 'cancelled'])
+        self.assertFalse(run.cancel())
+
+    def test_wait_returns_on_update(self):
+        run = SyncProgress('api', ['a'])
+        version = run.version
+        timer = threading.Timer(0.05, run.table('a').start)
+        timer.start()
+        try:
+            self.assertNotEqual(run.wait(version, timeout=5), version)
+        finally:
+            timer.join()
+        self.assertEqual(run.wait(run.version, timeout=0.01), run.version)
+
+    def test_null_progress_is_never_cancelled(self):
+        self.assertIs(NULL_PROGRESS.table('a'), NULL_TABLE_PROGRESS)
+        NULL_PROGRESS.check_cancelled()
+        NULL_TABLE_PROGRESS.update(1, 1)
+
+
+class _CountingEngine(SyncEngine):
+    """SyncEngine senza connessioni: conta i batch scritti e annulla il run dopo `cancel_after`."""
+
+    def __init__(self, progress, cancel_after, pipelined):
+        self.logger = logging.getLogger(__name__)
+        self.pipelined = pipelined
+        self.progress = progress
+        self.table_progress = progress.table('entrataMerci')
+        self.touched_documents = None
+        self.stage_seconds = _empty_stage_seconds()
+        self.cancel_after = cancel_after
+        self.batches = 0
+
+    def _transform_chunk(self, chunk, mapping, logger, first_row_num, transformer=None):
+        return list(chunk), 0, None
+
+    def _execute_batch_with_fallback(self, session, mapping, records, logger, operation_name, table=None):
+        self.batches += 1
+        if self.batches == self.cancel_after:
+            self.progress.cancel()
+        return len(records), 0
+
+
+class EngineCancellationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.logger.disabled = True
+
+    def tearDown(self):
+        self.logger.disabled = False
+
+    def test_cancel_stops_at_the_next_batch_boundary(self):
+        mapping = MAPPINGS_REGISTRY['entrataMerci']
+        for pipelined in (False, True):
+            with self.subTest(pipelined=pipelined):
+                run = SyncProgress('api', ['entrataMerci'])
+                engine = _CountingEngine(run, cancel_after=2, pipelined=pipelined)
+                chunks = ([{'id': i * 10 + j} for j in range(10)] for i in range(50))
+
+                with self.assertRaises(SyncCancelled):
+                    engine._process_rows(chunks, mapping, None, self.logger)
+
+                self.assertEqual(engine.batches, 2)
+                table = run.snapshot()['tables'][0]
+                self.assertEqual((table['rows_extracted'], table['rows_written']), (20, 20))
+                # La pipeline è chiusa subito, senza attendere la garbage collection
+                alive = [t.name for t in threading.enumerate() if t.name.startswith('sync-sap-reader')]
+                self.assertEqual(alive, [])
+
+
+class SyncApiTestCase(unittest.TestCase):
+    def setUp(self):
+        from src.api import app as api_module
+
+        self.api = api_module
+        self.client = api_module.app.test_client()
+        patchers = [
+            patch.object(progress_tracking, '_latest', None),
+            patch.dict(api_module._sync_status, {'running': False, 'last_result': None}),
+            patch.object(api_module, '_run_sync_background'),
+        ]
+        self.background = [p.start() for p in patchers][-1]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_sync_selected_tables_in_registry_order(self):
+        response = self.client.post('/api/sync', json={'tables': ['ordiniAcquistoLines', 'ordiniAcquisto']})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json()['tables'], ['ordiniAcquisto', 'ordiniAcquistoLines'])
+        tables, force_full, run = self.background.call_args.args
+        self.assertEqual((tables, force_full), (['ordiniAcquisto', 'ordiniAcquistoLines'], False))
+        self.assertIs(progress_tracking.latest(), run)
+
+        # Il flag resta attivo finché il thread (qui simulato) non termina
+        self.assertEqual(self.client.post('/api/sync', json={'table': 'entrataMerci'}).status_code, 409)
+
+    def test_default_is_every_mapping_and_unknown_tables_are_rejected(self):
+        response = self.client.post('/api/sync')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json()['tables'], list(MAPPINGS_REGISTRY))
+        self.api._sync_status['running'] = False
+
+        for body in ({'table': 'nonEsiste'}, {'tables': []}, {'tables': [1]}):
+            with self.subTest(body=body):
+                response = self.client.post('/api/sync', json=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.get_json()['accepted'])
+
+    def test_cancel_and_status(self):
+        self.assertEqual(self.client.post('/api/sync/cancel').status_code, 409)
+
+        self.client.post('/api/sync', json={'table': 'ordiniAcquisto'})
+        response = self.client.post('/api/sync/cancel')
+
+        self.assertEqual(response.status_code, 202)
+        status = self.client.get('/api/sync/status').get_json()
+        self.assertTrue(status['running'])
+        self.assertTrue(status['progress']['cancel_requested'])
+        self.assertEqual(status['progress']['tables'][0]['table'], 'ordiniAcquisto')
+
+        progress_tracking.latest().finish()
+        self.assertEqual(self.client.post('/api/sync/cancel').status_code, 409)
+
+    def test_events_stream_until_the_run_ends(self):
+        self.assertEqual(self.client.get('/api/sync/events').status_code, 404)
+
+        run = progress_tracking.start_run('api', ['ordiniAcquisto'])
+        tracker = run.table('ordiniAcquisto')
+
+        def work():
+            tracker.start()
+            tracker.update(10, 10)
+            tracker.finish(progress_tracking.DONE)
+            run.finish()
+
+        timer = threading.Timer(0.05, work)
+        timer.start()
+        try:
+            response = self.client.get('/api/sync/events')
+            body = response.get_data(as_text=True)
+        finally:
+            timer.join()
+
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = [block for block in body.split('\n\n') if block.startswith('event: ')]
+        self.assertTrue(events[-1].startswith('event: end'))
+        last = json.loads(events[-2].split('data: ', 1)[1])
+        self.assertEqual((last['status'], last['rows_written']), ('done', 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
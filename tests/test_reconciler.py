@@ -0,0 +1,183 @@
+import unittest
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, call, patch
+
+from src.sync.cleanup import CleanupScope
+from src.sync.reconciler import (
+    ORDERS_WATERMARK,
+    RFQ_WATERMARK,
+    RFQ_WATERMARK_OVERLAP,
+    _RECONCILE_SQL,
+    reconcile_rfq_with_orders,
+)
+
+MIGRATION = Path(__file__).resolve().parents[1] / 'migrations' / '009_rfq_reconcile_indexes.sql'
+
+ORDERS_SINCE = datetime(2026, 3, 1, 10, 0, 0)
+RFQ_SINCE = datetime(2026, 3, 1, 9, 30, 0)
+
+
+def _result_row(**overrides):
+    values = {
+        'rfq_open': 12,
+        'rfq_new': 2,
+        'orders_changed': 5,
+        'candidates': 7,
+        'closed': 3,
+        'orders_watermark': datetime(2026, 3, 2, 8, 0, 0),
+        'rfq_watermark': datetime(2026, 3, 2, 7, 45, 0),
+    }
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+class ReconcileRfqTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('src.sync.reconciler.SyncStateService')
+        self.state = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.state.get_last_sync.side_effect = lambda session, name: {
+            ORDERS_WATERMARK: ORDERS_SINCE,
+            RFQ_WATERMARK: RFQ_SINCE,
+        }.get(name)
+        self.session = MagicMock()
+        self.logger = MagicMock()
+
+    def test_incremental_run_uses_watermarks_and_advances_them(self):
+        row = _result_row()
+        self.session.execute.return_value.one.return_value = row
+
+        stats = reconcile_rfq_with_orders(self.session, self.logger)
+
+        _, params = self.session.execute.call_args.args
+        # Le RFQ create poco prima del watermark (commit tardivi) vengono rilette
+        self.assertEqual(params, {'orders_since': ORDERS_SINCE, 'rfq_since': RFQ_SINCE - RFQ_WATERMARK_OVERLAP})
+        self.assertEqual(self.state.update_last_sync.call_args_list, [
+            call(self.session, ORDERS_WATERMARK, row.orders_watermark),
+            call(self.session, RFQ_WATERMARK, row.rfq_watermark),
+        ])
+        self.session.commit.assert_called_once()
+        self.assertFalse(stats['full'])
+        self.assertEqual(
+            {key: stats[key] for key in ('rfq_open', 'rfq_new', 'orders_changed', 'candidates', 'closed')},
+            {'rfq_open': 12, 'rfq_new': 2, 'orders_changed': 5, 'candidates': 7, 'closed': 3},
+        )
+
+    def test_full_run_ignores_watermarks(self):
+        self.session.execute.return_value.one.return_value = _result_row()
+
+        stats = reconcile_rfq_with_orders(self.session, self.logger, full=True)
+
+        _, params = self.session.execute.call_args.args
+        self.assertEqual(params, {'orders_since': None, 'rfq_since': None})
+        self.state.get_last_sync.assert_not_called()
+        self.assertTrue(stats['full'])
+
+    def test_full_reload_of_order_lines_forces_full_run(self):
+        self.session.execute.return_value.one.return_value = _result_row()
+        for reloaded, expected_full in ((False, False), (True, True)):
+            with self.subTest(reloaded=reloaded):
+                scope = CleanupScope()
+                scope.record('ordiniAcquisto', [1])
+                scope.record('ordiniAcquistoLines', None if reloaded else [1])
+
+                stats = reconcile_rfq_with_orders(self.session, self.logger, scope=scope)
+
+                _, params = self.session.execute.call_args.args
+                self.assertEqual(params['orders_since'] is None, expected_full)
+                self.assertEqual(stats['full'], expected_full)
+
+    def test_failed_order_lines_keep_orders_watermark_until_next_cycle(self):
+        # Ciclo 1: testata scritta, nodo righe fallito; ciclo 2: righe caricate,
+        # testata invariata. L'RFQ si chiude solo se il ciclo 2 rilegge la testata.
+        header_synced_at = datetime(2026, 3, 1, 12, 0, 0)
+        latest_synced_at = datetime(2026, 3, 1, 12, 5, 0)
+        watermarks = {ORDERS_WATERMARK: ORDERS_SINCE, RFQ_WATERMARK: RFQ_SINCE}
+        self.state.get_last_sync.side_effect = lambda session, name: watermarks.get(name)
+        self.state.update_last_sync.side_effect = lambda session, name, value: watermarks.__setitem__(name, value)
+        lines_loaded = False
+
+        def execute(sql, params):
+            orders_since = params['orders_since']
+            header_visible = orders_since is None or header_synced_at >= orders_since
+            result = MagicMock()
+            result.one.return_value = _result_row(
+                closed=int(lines_loaded and header_visible), orders_watermark=latest_synced_at,
+            )
+            return result
+        self.session.execute.side_effect = execute
+
+        failed_cycle = CleanupScope()
+        failed_cycle.record('ordiniAcquisto', [1])
+        failed_cycle.record_failure('ordiniAcquistoLines')
+        stats = reconcile_rfq_with_orders(self.session, self.logger, scope=failed_cycle)
+        self.assertEqual(stats['closed'], 0)
+        self.assertEqual(watermarks[ORDERS_WATERMARK], ORDERS_SINCE)
+
+        lines_loaded = True
+        next_cycle = CleanupScope()
+        next_cycle.record('ordiniAcquisto', [])
+        next_cycle.record('ordiniAcquistoLines', [1])
+        stats = reconcile_rfq_with_orders(self.session, self.logger, scope=next_cycle)
+
+        self.assertFalse(stats['full'])
+        self.assertEqual(stats['closed'], 1)
+        self.assertEqual(watermarks[ORDERS_WATERMARK], latest_synced_at)
+
+    def test_first_run_without_watermarks_is_full(self):
+        self.state.get_last_sync.side_effect = None
+        self.state.get_last_sync.return_value = None
+        self.session.execute.return_value.one.return_value = _result_row()
+
+        stats = reconcile_rfq_with_orders(self.session, self.logger)
+
+        self.assertTrue(stats['full'])
+
+    def test_empty_tables_do_not_write_watermarks(self):
+        self.session.execute.return_value.one.return_value = _result_row(
+            orders_watermark=None, rfq_watermark=None,
+        )
+
+        reconcile_rfq_with_orders(self.session, self.logger)
+
+        self.state.update_last_sync.assert_not_called()
+
+    def test_error_rolls_back_and_keeps_watermarks(self):
+        self.session.execute.side_effect = RuntimeError('boom')
+
+        stats = reconcile_rfq_with_orders(self.session, self.logger)
+
+        self.session.rollback.assert_called_once()
+        self.session.commit.assert_not_called()
+        self.state.update_last_sync.assert_not_called()
+        self.assertEqual(stats['closed'], 0)
+        self.logger.error.assert_called_once()
+
+    def test_old_rfqs_only_join_changed_orders(self):
+        sql = _RECONCILE_SQL.text
+        incremental = sql.split('UNION ALL', 1)[1].split('best_order AS', 1)[0]
+        self.assertIn('JOIN changed_orders o', incremental)
+        self.assertIn('WHERE NOT r.is_new', incremental)
+        self.assertIn('o.last_synced_at >= :orders_since', sql)
+
+
+class RfqReconcileMigrationTestCase(unittest.TestCase):
+    def test_migration_creates_and_drops_indexes(self):
+        up, down = MIGRATION.read_text().split('-- DOWN')
+        self.assertIn('-- UP', up)
+        for index in (
+            'richieste_offerte_aperte_idx',
+            'ordini_acquisto_bp_doc_date_idx',
+            'ordini_acquisto_last_synced_at_idx',
+            'ordini_acquisto_lines_documento_articolo_idx',
+        ):
+            with self.subTest(index=index):
+                self.assertIn(f'CREATE INDEX IF NOT EXISTS {index}', up)
+                self.assertIn(f'DROP INDEX IF EXISTS sap.{index}', down)
+        self.assertIn('WHERE ordine_acquisto_id IS NULL', up)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+import unittest
+
+from src.sync.scheduler import DagScheduler, DurationHistory, SyncNode, table_nodes
+
+
+class _Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.finished = []
+
+    def node(self, name, depends_on=(), duration=0.0, fail=False):
+        def run():
+            with self.lock:
+                self.started.append(name)
+            time.sleep(duration)
+            with self.lock:
+                self.finished.append(name)
+            if fail:
+                raise RuntimeError(f'{name} fallito')
+        return SyncNode(name, run, depends_on)
+
+
+class DagSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger(__name__)
+        self.logger.disabled = True
+        self.recorder = _Recorder()
+
+    def tearDown(self):
+        self.logger.disabled = False
+
+    def _scheduler(self, nodes, max_workers=3, history=None):
+        return DagScheduler(nodes, max_workers=max_workers, history=history or DurationHistory(), logger=self.logger)
+
+    def test_children_start_after_all_parents(self):
+        rec = self.recorder
+        nodes = [
+            rec.node('lines', ('headers', 'orders')),
+            rec.node('headers', duration=0.05),
+            rec.node('orders', duration=0.02),
+            rec.node('cleanup', ('lines',)),
+        ]
+        results = self._scheduler(nodes).run()
+        self.assertTrue(all(r['success'] for r in results))
+        self.assertEqual(len(results), 4)
+        self.assertLess(rec.finished.index('headers'), rec.started.index('lines'))
+        self.assertLess(rec.finished.index('orders'), rec.started.index('lines'))
+        self.assertEqual(rec.started[-1], 'cleanup')
+
+    def test_failed_parent_still_runs_children(self):
+        rec = self.recorder
+        nodes = [rec.node('headers', fail=True), rec.node('lines', ('headers',))]
+        results = {r['table']: r for r in self._scheduler(nodes).run()}
+        self.assertFalse(results['headers']['success'])
+        self.assertEqual(results['headers']['error'], 'headers fallito')
+        self.assertTrue(results['lines']['success'])
+
+    def test_longest_critical_path_starts_first(self):
+        history = DurationHistory()
+        history.record('short', 1.0)
+        history.record('long', 10.0)
+        history.record('chain_head', 2.0)
+        history.record('chain_tail', 20.0)
+        rec = self.recorder
+        nodes = [
+            rec.node('short'),
+            rec.node('long'),
+            rec.node('chain_head'),
+            rec.node('chain_tail', ('chain_head',)),
+        ]
+        self._scheduler(nodes, max_workers=1, history=history).run()
+        self.assertEqual(rec.started, ['chain_head', 'chain_tail', 'long', 'short'])
+
+    def test_durations_update_history(self):
+        history = DurationHistory(alpha=0.5)
+        history.record('a', 4.0)
+        history.record('a', 2.0)
+        self.assertAlmostEqual(history.expected('a'), 3.0)
+        self.assertEqual(history.expected('unknown'), history.default)
+
+    def test_cycle_and_unknown_dependency_are_rejected(self):
+        noop = lambda: None
+        with self.assertRaises(ValueError):
+            self._scheduler([SyncNode('a', noop, ('b',)), SyncNode('b', noop, ('a',))])
+        with self.assertRaises(ValueError):
+            self._scheduler([SyncNode('a', noop, ('missing',))])
+
+    def test_table_nodes_use_mapping_dependencies(self):
+        nodes = {node.name: node for node in table_nodes(
+            ['ordiniAcquisto', 'ordiniAcquistoLines', 'entrataMerci', 'entrataMerciLines'],
+            lambda name: None,
+        )}
+        self.assertEqual(nodes['ordiniAcquistoLines'].depends_on, ('ordiniAcquisto',))
+        self.assertEqual(set(nodes['entrataMerciLines'].depends_on), {'entrataMerci', 'ordiniAcquisto'})
+        self.assertEqual(nodes['ordiniAcquisto'].depends_on, ())
+
+    def test_table_nodes_ignore_dependencies_outside_the_run(self):
+        nodes = table_nodes(['entrataMerciLines'], lambda name: None)
+        self.assertEqual(nodes[0].depends_on, ())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, text
+
+from src.config.settings_cache import SettingsCache
+
+
+class SettingsCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.url = f"sqlite:///{os.path.join(self.tmpdir.name, 'settings.db')}"
+        self.engine = create_engine(self.url)
+        with self.engine.begin() as conn:
+            conn.execute(text('CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT)'))
+            conn.execute(text(
+                "INSERT INTO settings VALUES ('sap_sync_interval_minutes', '15'), ('empty', NULL)"
+            ))
+        self.cache = SettingsCache(self.url, ttl=0)
+
+    def tearDown(self):
+        if self.cache._engine is not None:
+            self.cache._engine.dispose()
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def _set(self, key, value):
+        with self.engine.begin() as conn:
+            conn.execute(text('UPDATE settings SET value = :value WHERE key = :key'), {'key': key, 'value': value})
+
+    def test_reads_come_from_snapshot_until_invalidated(self):
+        self.assertEqual(self.cache.get('sap_sync_interval_minutes'), '15')
+        self._set('sap_sync_interval_minutes', '30')
+        self.assertEqual(self.cache.get('sap_sync_interval_minutes'), '15')
+        self.cache.invalidate()
+        self.assertEqual(self.cache.get('sap_sync_interval_minutes'), '30')
+
+    def test_missing_and_null_keys_use_default(self):
+        self.assertEqual(self.cache.get('missing', 'd'), 'd')
+        self.assertEqual(self.cache.get('empty', 'd'), 'd')
+        self.assertEqual(self.cache.get_many(['sap_sync_interval_minutes', 'empty', 'missing']),
+                         {'sap_sync_interval_minutes': '15'})
+
+    def test_invalidate_wakes_waiters_once(self):
+        self.assertFalse(self.cache.wait_for_change(0.01))
+        self.cache.invalidate()
+        self.assertTrue(self.cache.wait_for_change(0.01))
+        self.assertFalse(self.cache.wait_for_change(0.01))
+
+    def test_ttl_expiry_reloads(self):
+        cache = SettingsCache(self.url, ttl=0.01)
+        self.assertEqual(cache.get('sap_sync_interval_minutes'), '15')
+        self._set('sap_sync_interval_minutes', '45')
+        cache._loaded_at -= 1
+        self.assertEqual(cache.get('sap_sync_interval_minutes'), '45')
+        cache._engine.dispose()
+
+    def test_unreachable_database_returns_default(self):
+        cache = SettingsCache(f"sqlite:///{os.path.join(self.tmpdir.name, 'missing', 'x.db')}", ttl=0)
+        self.assertEqual(cache.get('sap_sync_interval_minutes', '60'), '60')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import logging
+import unittest
+from unittest.mock import MagicMock
+
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.models.entrata_merci import SAP_EntrataMerci
+from src.sync.engine import _reference_tables
+from src.sync.shadow_swap import ShadowTable, _Constraint, _InboundForeignKey, _OutboundForeignKey, shadow_name
+
+
+class ShadowSwapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.shadow = ShadowTable(None, SAP_EntrataMerci.__table__, logging.getLogger(__name__))
+
+    def test_shadow_name_respects_identifier_limit(self):
+        self.assertEqual(shadow_name('entrata_merci'), 'entrata_merci__shadow')
+        long_name = shadow_name('x' * 70)
+        self.assertEqual(len(long_name), 63)
+        self.assertTrue(long_name.endswith('__shadow'))
+
+    def test_shadow_table_keeps_model_columns(self):
+        self.assertEqual(self.shadow.table.name, 'entrata_merci__shadow')
+        self.assertEqual(self.shadow.table.schema, 'sap')
+        self.assertEqual(
+            [col.name for col in self.shadow.table.columns],
+            [col.name for col in SAP_EntrataMerci.__table__.columns],
+        )
+
+    def test_index_definition_is_rewritten_on_shadow_table(self):
+        index = _Constraint(
+            'entrata_merci_status_idx',
+            'CREATE INDEX entrata_merci_status_idx ON sap.entrata_merci USING btree (status)',
+        )
+        self.assertEqual(
+            self.shadow._shadow_index_sql(index),
+            'CREATE INDEX "entrata_merci_status_idx__shadow" ON "sap"."entrata_merci__shadow" '
+            'USING btree (status)',
+        )
+
+    def test_shadow_swap_only_for_insert_strategies(self):
+        for name, mapping in MAPPINGS_REGISTRY.items():
+            with self.subTest(mapping=name):
+                if mapping.uses_shadow_swap():
+                    self.assertTrue(mapping.inserts_only())
+
+    def test_orphans_removed_on_swap_release_their_references(self):
+        session = MagicMock()
+        session.execute.return_value.fetchall.return_value = [(77,), (None,), (78,)]
+        references = {
+            name: column for name, (_, column) in _reference_tables(SAP_EntrataMerci.__table__).items()
+        }
+        self.assertEqual(references, {'sap.entrata_merci_lines': 'cod_order_acquisto'})
+        shadow = ShadowTable(session, SAP_EntrataMerci.__table__, logging.getLogger(__name__), references)
+        fk = _InboundForeignKey(
+            'entrata_merci_lines_cod_entrata_merci_fkey', 'sap.entrata_merci_lines', '',
+            ['cod_entrata_merci'], ['id'], 'c', 'sap.entrata_merci_lines',
+        )
+
+        self.assertEqual(shadow._remove_orphans(fk), 3)
+        self.assertIn('RETURNING r."cod_order_acquisto"', session.execute.call_args.args[0].text)
+        self.assertEqual(shadow.released, {'sap.entrata_merci_lines': {77, 78}})
+
+        shadow._copy_back()
+        self.assertEqual(shadow.released, {'sap.entrata_merci_lines': None})
+
+    def test_outbound_foreign_keys_are_added_not_valid_under_the_swap_lock_timeout(self):
+        session = MagicMock()
+        session.execute.return_value.rowcount = 0
+        shadow = ShadowTable(session, SAP_EntrataMerci.__table__, logging.getLogger(__name__))
+        shadow.outbound_fks = [_OutboundForeignKey(
+            'entrata_merci_bp_fkey', 'FOREIGN KEY (cod_business_partner) REFERENCES sap.bp(id)',
+            'sap.bp', ['cod_business_partner'], ['id'],
+        )]
+        add_fk = (
+            'ALTER TABLE "sap"."entrata_merci__shadow" ADD CONSTRAINT "entrata_merci_bp_fkey__shadow" '
+            'FOREIGN KEY (cod_business_partner) REFERENCES sap.bp(id) NOT VALID'
+        )
+
+        shadow.finalize()
+        statements = [c.args[0].text for c in session.execute.call_args_list]
+        self.assertNotIn(add_fk, statements)
+        self.assertTrue(statements[-1].startswith('ANALYZE'))
+
+        session.execute.reset_mock()
+        shadow.swap()
+
+        statements = [c.args[0].text for c in session.execute.call_args_list]
+        self.assertTrue(shadow.swapped)
+        self.assertTrue(statements[0].startswith('SET LOCAL lock_timeout'))
+        self.assertTrue(statements[1].startswith('LOCK TABLE "sap"."entrata_merci"'))
+        add = statements.index(add_fk)
+        self.assertIn('NOT EXISTS (SELECT 1 FROM sap.bp t WHERE t."id" = r."cod_business_partner")', statements[add + 1])
+        # Rinominata allo swap come gli altri vincoli, validata dopo il commit
+        self.assertLess(add, statements.index(
+            'ALTER TABLE "sap"."entrata_merci" RENAME CONSTRAINT '
+            '"entrata_merci_bp_fkey__shadow" TO "entrata_merci_bp_fkey"'
+        ))
+        self.assertEqual(shadow.constraints, [])
+        self.assertEqual(shadow.pending_validation, [('"sap"."entrata_merci"', 'entrata_merci_bp_fkey')])
+
+    def test_copy_back_removes_rows_without_outbound_reference(self):
+        session = MagicMock()
+        session.execute.return_value.rowcount = 0
+        shadow = ShadowTable(session, SAP_EntrataMerci.__table__, logging.getLogger(__name__))
+        shadow.outbound_fks = [_OutboundForeignKey(
+            'entrata_merci_bp_fkey', 'FOREIGN KEY (cod_business_partner) REFERENCES sap.bp(id)',
+            'sap.bp', ['cod_business_partner'], ['id'],
+        )]
+
+        shadow._copy_back()
+
+        statements = [c.args[0].text for c in session.execute.call_args_list]
+        delete = next(i for i, sql in enumerate(statements) if sql.startswith('DELETE FROM'))
+        self.assertLess(delete, next(i for i, sql in enumerate(statements) if sql.startswith('INSERT INTO')))
+
+if __name__ == '__main__':
+    unittest.main()
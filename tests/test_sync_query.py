@@ -0,0 +1,97 @@
+import re
+import unittest
+from datetime import date, datetime
+
+from src.mappings.base import TableMapping
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.sync.engine import SyncEngine, _has_top_level_where
+
+LAST_SYNC = datetime(2026, 3, 1, 13, 45, 1)
+EXPECTED_PARAMS = {'last_sync_date': date(2026, 3, 1), 'last_sync_ts': 134501}
+
+
+def _delta_predicate(prefix=''):
+    return (
+        f"({prefix}UpdateDate >= :last_sync_date"
+        f" AND ({prefix}UpdateDate > :last_sync_date OR {prefix}UpdateTS > :last_sync_ts))"
+    )
+
+
+# Query attese per ogni mapping registrato con un last_sync valorizzato
+# (None = mapping TRUNCATE_INSERT/HEADER_DELTA: query invariata e nessun parametro).
+EXPECTED_DELTA = {
+    'anagraficheArticoli': ('WHERE', 'o.'),
+    'anagraficheBusinessPartner': ('WHERE', ''),
+    'catalogoBusinessPartner': None,
+    'ordiniAcquisto': ('AND', ''),
+    'ordiniAcquistoLines': None,
+    'entrataMerci': None,
+    'entrataMerciLines': None,
+}
+
+
+class BuildSyncQueryTestCase(unittest.TestCase):
+    def _base_query(self, mapping):
+        if mapping.sap_query:
+            return mapping.sap_query
+        return f"SELECT {', '.join(mapping.column_mappings)} FROM {mapping.sap_table}"
+
+    def test_every_mapping_is_covered(self):
+        self.assertEqual(set(EXPECTED_DELTA), set(MAPPINGS_REGISTRY))
+
+    def test_full_sync_has_no_filter(self):
+        for name, mapping in MAPPINGS_REGISTRY.items():
+            with self.subTest(mapping=name):
+                query, params = SyncEngine._build_sync_query(mapping, None)
+                self.assertEqual(query, self._base_query(mapping))
+                self.assertEqual(params, {})
+
+    def test_delta_query_and_params_per_mapping(self):
+        for name, mapping in MAPPINGS_REGISTRY.items():
+            with self.subTest(mapping=name):
+                query, params = SyncEngine._build_sync_query(mapping, LAST_SYNC)
+                expected = EXPECTED_DELTA[name]
+                if expected is None:
+                    self.assertEqual(query, self._base_query(mapping))
+                    self.assertEqual(params, {})
+                    continue
+                connector, prefix = expected
+                self.assertEqual(
+                    query,
+                    f"{self._base_query(mapping)} {connector} {_delta_predicate(prefix)}",
+                )
+                self.assertEqual(params, EXPECTED_PARAMS)
+
+    def test_delta_predicate_is_sargable_and_parameterised(self):
+        for name, mapping in MAPPINGS_REGISTRY.items():
+            with self.subTest(mapping=name):
+                query, _ = SyncEngine._build_sync_query(mapping, LAST_SYNC)
+                self.assertNotIn('CONVERT(', query.upper())
+                self.assertNotIn('20260301', query)
+                self.assertNotIn('134501', query)
+
+    def test_top_level_where_ignores_subqueries(self):
+        self.assertFalse(_has_top_level_where(MAPPINGS_REGISTRY['catalogoBusinessPartner'].sap_query))
+        self.assertTrue(_has_top_level_where(MAPPINGS_REGISTRY['ordiniAcquisto'].sap_query))
+        self.assertFalse(_has_top_level_where('SELECT a FROM t WHERE_COL'))
+
+    def test_custom_query_with_where_gets_parenthesised_and(self):
+        mapping = MAPPINGS_REGISTRY['anagraficheArticoli']
+        custom = TableMapping(
+            sap_table=mapping.sap_table,
+            pg_model=mapping.pg_model,
+            column_mappings=mapping.column_mappings,
+            transformations={},
+            primary_key_sap=mapping.primary_key_sap,
+            sync_strategy=mapping.sync_strategy,
+            sap_query="SELECT o.ItemCode FROM dbo.OITM o WHERE o.validFor = 'Y' OR o.frozenFor = 'N'",
+            sap_timestamp_prefix='o',
+        )
+        query, params = SyncEngine._build_sync_query(custom, LAST_SYNC)
+        self.assertTrue(query.endswith(f" AND {_delta_predicate('o.')}"))
+        self.assertEqual(len(re.findall(r':last_sync_date\b', query)), 2)
+        self.assertEqual(params, EXPECTED_PARAMS)
+
+
+if __name__ == '__main__':
+    unittest.main()
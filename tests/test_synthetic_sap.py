@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from sqlalchemy import text
+
+from benchmarks.sync_benchmark import _ordered_tables, compare
+from benchmarks.synthetic_sap import (
+    QUERY_OVERRIDES,
+    create_sap_engine,
+    generate,
+    sqlite_mapping,
+    sqlite_mappings,
+    to_sqlite,
+)
+from src.mappings.registry import MAPPINGS_REGISTRY
+from src.sync.engine import SyncEngine
+
+
+class SyntheticSapTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'sap.db')
+        cls.counts = generate(cls.path, 5000, seed=1)
+        cls.engine = create_sap_engine(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        cls.directory.cleanup()
+
+    def test_generated_counts(self):
+        self.assertEqual(self.counts['OITM'], 1000)
+        self.assertEqual(self.counts['POR1'], 1250)
+        self.assertTrue(all(count > 0 for count in self.counts.values()))
+
+    def test_dateadd_is_rewritten(self):
+        self.assertEqual(
+            to_sqlite("WHERE DocDate >= DATEADD(year, -1, GETDATE())"),
+            "WHERE DocDate >= DATEADD('year', -1, GETDATE())",
+        )
+        with self.engine.connect() as connection:
+            value = connection.execute(text("SELECT DATEADD('day', 1, '2026-02-28')")).scalar()
+        self.assertEqual(value, '2026-03-01 00:00:00')
+
+    def test_every_mapping_query_runs(self):
+        with self.engine.connect() as connection:
+            for table_name in MAPPINGS_REGISTRY:
+                mapping = sqlite_mapping(table_name)
+                query, params = SyncEngine._build_sync_query(mapping, datetime(2000, 1, 1))
+                with self.subTest(table=table_name):
+                    result = connection.execute(text(query), params)
+                    self.assertTrue(set(mapping.column_mappings) <= set(result.keys()))
+                    rows = result.fetchall()
+                    self.assertTrue(rows)
+                    if mapping.header_query:
+                        header = connection.execute(text(mapping.header_query)).first()
+                        self.assertIsInstance(header[1], datetime)
+                    if mapping.change_probe:
+                        probe = connection.execute(text(mapping.change_probe)).fetchall()
+                        self.assertEqual(len(probe), 1)
+                        self.assertTrue(all(value is not None for value in probe[0]))
+
+    def test_registry_is_restored(self):
+        original = MAPPINGS_REGISTRY['catalogoBusinessPartner']
+        with sqlite_mappings() as registry:
+            self.assertEqual(registry['catalogoBusinessPartner'].sap_query, QUERY_OVERRIDES['catalogoBusinessPartner'])
+        self.assertIs(MAPPINGS_REGISTRY['catalogoBusinessPartner'], original)
+
+
+class BenchmarkReportTestCase(unittest.TestCase):
+    def test_tables_follow_dependencies(self):
+        ordered = _ordered_tables(list(reversed(list(MAPPINGS_REGISTRY))))
+        for name in ordered:
+            for dep in MAPPINGS_REGISTRY[name].depends_on:
+                self.assertLess(ordered.index(dep), ordered.index(name))
+
+    def test_compare_flags_only_slowdowns_beyond_tolerance(self):
+        baseline = {'results': [
+            {'table': 'a', 'pass': 'full', 'seconds': 1.0},
+            {'table': 'b', 'pass': 'full', 'seconds': 1.0},
+            {'table': 'c', 'pass': 'delta', 'seconds': 0.01},
+        ]}
+        results = [
+            {'table': 'a', 'pass': 'full', 'seconds': 1.05},
+            {'table': 'b', 'pass': 'full', 'seconds': 1.5},
+            {'table': 'c', 'pass': 'delta', 'seconds': 0.03},
+            {'table': 'd', 'pass': 'full', 'seconds': 9.0},
+        ]
+
+        regressions = compare(results, baseline, tolerance=0.1)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('b (full)'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+import src.mappings.anagrafica_articoli as anagrafica_articoli_module
+from benchmarks.synthetic_sap import generate
+from benchmarks.transform_benchmark import build_cases, check, load_thresholds, merge, run, sample_rows
+from src.mappings.registry import MAPPINGS_REGISTRY
+
+
+class TransformBenchmarkTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'sap.db')
+        generate(cls.path, 3000, seed=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_every_case_has_a_threshold(self):
+        cases = build_cases(sample_rows(self.path))
+
+        for table_name in MAPPINGS_REGISTRY:
+            self.assertIn(f'compiled:{table_name}', cases)
+            self.assertIn(f'transform_row:{table_name}', cases)
+        self.assertEqual(set(cases) - set(load_thresholds()), set())
+
+    def test_run_measures_selected_cases_and_restores_state(self):
+        report = run(500, repeats=1, sap_path=self.path, select=lambda name: 'articoli' in name.lower())
+
+        self.assertEqual(set(report['cases']), {'compiled:anagraficheArticoli', 'transform_row:anagraficheArticoli'})
+        for result in report['cases'].values():
+            self.assertGreater(result['ns_per_row'], 0)
+            self.assertGreater(result['relative'], 0)
+        self.assertIsNone(anagrafica_articoli_module._sap_item_codes)
+
+    def test_check_and_merge(self):
+        slow = {'cases': {'a': {'relative': 3.0, 'ns_per_row': 300}, 'b': {'relative': 1.0, 'ns_per_row': 100}}}
+        fast = {'cases': {'a': {'relative': 1.5, 'ns_per_row': 150}, 'b': {'relative': 1.2, 'ns_per_row': 120}}}
+
+        regressions, missing = check(slow, {'a': 2.0})
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('a:'))
+        self.assertEqual(missing, ['b'])
+
+        best = merge([slow, fast], min)
+        self.assertEqual((best['cases']['a']['relative'], best['cases']['b']['relative']), (1.5, 1.0))
+        worst = merge([slow, fast], max)
+        self.assertEqual((worst['cases']['a']['relative'], worst['cases']['b']['relative']), (3.0, 1.2))
+        self.assertEqual(check(best, {'a': 2.0, 'b': 2.0}), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()